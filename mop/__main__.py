@@ -2,10 +2,21 @@ import sys
 import pathlib
 import logging
 import argparse
+from eyed3.utils import formatSize
 from nicfit.logger import addCommandLineArgs as addLoggingArgs
 from .app import MopApp
+from .library import LibraryIndex
+from .config import getConfig
+from .utils import eyed3_load, eyed3_load_dir
+from .tagcache import getTagCache
+from .memory import formatReport, fileTagBytes, MemoryMonitor
 from .__about__ import version
 
+log = logging.getLogger(__name__)
+
+# Files listed by --memory-report, those with the largest tags.
+MEMORY_REPORT_FILES = 10
+
 
 class ArgumentParser(argparse.ArgumentParser):
     def __init__(self):
@@ -17,13 +28,78 @@ class ArgumentParser(argparse.ArgumentParser):
         addLoggingArgs(self, hide_args=True)
         self.add_argument("path_args", nargs="*", metavar="PATH", type=pathlib.Path,
                           help="An audio file or directory of audio files.")
+        self.add_argument("--memory-report", action="store_true",
+                          help="Load the files, applying the memory budget, print their memory "
+                               "use, and exit.")
+
+
+class QueryArgumentParser(argparse.ArgumentParser):
+    def __init__(self):
+        super().__init__(prog="mop query",
+                         description="Open the files of the library index (every file Mop has "
+                                     "loaded) matching a query.")
+        self.add_argument("query", metavar="QUERY",
+                          help="Terms such as \"artist:X genre:'Hip Hop' year:199*\", plain words "
+                               "match title, artist, or album.")
+        self.add_argument("--list", action="store_true",
+                          help="Print the matching paths instead of opening them.")
+
+
+def query(argv) -> int:
+    query_args = QueryArgumentParser().parse_args(argv)
+
+    library = LibraryIndex()
+    try:
+        paths = library.query(query_args.query)
+    except ValueError as ex:
+        log.error(f"Invalid query: {ex}")
+        return 2
+    finally:
+        library.close()
+
+    if query_args.list:
+        for path in paths:
+            print(path)
+        return 0
+    elif not paths:
+        log.error(f"No files match: {query_args.query}")
+        return 1
+
+    # Opened as files, no directory is scanned.
+    args = ArgumentParser().parse_args([])
+    args.path_args = paths
+    return MopApp().run(args)
+
+
+def reportMemory(paths) -> int:
+    audio_files = []
+    for path in paths:
+        if path.is_dir():
+            audio_files += eyed3_load_dir(path)
+        elif audio_file := eyed3_load(path):
+            audio_files.append(audio_file)
+
+    monitor = MemoryMonitor()
+    monitor.setFiles(audio_files)
+    print(formatReport(monitor.check(budget=getConfig().memory_budget, tag_cache=getTagCache())))
+    largest = sorted(audio_files, key=lambda af: fileTagBytes(af)[0], reverse=True)
+    for audio_file in largest[:MEMORY_REPORT_FILES]:
+        size, images = fileTagBytes(audio_file)
+        if size:
+            print(f"{formatSize(size):>10}  {formatSize(images):>10}  {audio_file.path}")
+    return 0
 
 
 def main():
     logging.basicConfig(stream=sys.stderr, level=logging.INFO)
 
+    if sys.argv[1:2] == ["query"]:
+        return query(sys.argv[2:])
+
     cli = ArgumentParser()
     args = cli.parse_args()
+    if args.memory_report:
+        return reportMemory(args.path_args)
 
     app = MopApp()
     return app.run(args)
@@ -1,20 +1,44 @@
+import os
+import sqlite3
 import logging
+import threading
 
 from pathlib import Path
-from gi.repository import Gtk
+from gi.repository import GLib, Gtk
 
-from eyed3.id3 import ID3_V1, ID3_V2, ID3_V2_2, ID3_DEFAULT_VERSION, Tag
+from eyed3.id3 import ID3_V1, ID3_V2, ID3_V2_2, ID3_DEFAULT_VERSION, Tag, UTF_8_ENCODING
 from eyed3.utils import formatTime, formatSize
 
 from .config import getState, DEFAULT_STATE_FILE, getConfig
 from .utils import eyed3_load, eyed3_load_dir, escapeMarkup
-from .dialogs import Dialog, FileSaveDialog, AboutDialog, FileChooserDialog, NothingToDoDialog
+from .dialogs import (
+    Dialog, FileSaveDialog, AboutDialog, FileChooserDialog, NothingToDoDialog, PreviewDialog,
+    SnapshotFileDialog,
+)
 from .editor import EditorControl
 from .filesctl import FileListControl
+from .core import getTagValue
+from .groups import GroupIndex
+from .transforms import TransformPipeline, TransformChange, GenreCleanup, DEFAULT_TRANSFORMS
+from .rename import planRenames, findCollisions, renameFiles
+from .encoding import normalizeEncoding, normalizeFiles, scanEncodings, ENCODING_NAMES
+from .duplicates import findDuplicates
+from .mpeg import scanFiles, scanProblems
+from .loudness import analyzeAlbums
+from .merge import lockFile, loadValues, mergeExternalChanges
+from .storage import LocalStorage, localCopy
+from .id3v1 import saveV1Tag
+from .snapshot import exportSnapshot, readSnapshot, diffSnapshot, SNAPSHOT_FORMATS
+from .library import LibraryIndex
+from .memory import formatReport, peekTags, MemoryMonitor
+from .tagcache import getTagCache
 
 log = logging.getLogger(__name__)
 logging.getLogger("eyed3").setLevel(logging.ERROR)
 
+# Memory use is shown, and the budget enforced, at this interval.
+MEMORY_CHECK_SECS = 10
+
 
 class MopApp:
 
@@ -74,6 +98,10 @@ class MopWindow:
         self._window.set_title("Mop")
 
         self._file_info_label = builder.get_object("current_file_info_label")
+        self._statusbar = builder.get_object("main_statusbar")
+        self._memory_status_id = self._statusbar.get_context_id("memory")
+        self._error_status_id = self._statusbar.get_context_id("error")
+        self._memory_status = None
         self._file_path_label = builder.get_object("current_edit_filename_label")
         self._file_size_label = builder.get_object("current_edit_size_label")
         self._file_time_label = builder.get_object("current_edit_time_label")
@@ -84,12 +112,37 @@ class MopWindow:
             self._file_mpeg_info_labels[label] = builder.get_object(f"current_edit_{label}")
 
         # AudioFile list control
-        self._file_list_control = FileListControl(builder.get_object("audio_files_tree_view"))
+        self._file_list_control = FileListControl(builder.get_object("audio_files_tree_view"),
+                                                  builder.get_object("audio_files_search_entry"))
         self._file_list_control.connect("current-edit-changed", self._onFileEditChange)
+        self._file_list_control.connect("durations-changed", self._onFileEditChange)
 
         # Tag editor control
         self._editor_control = EditorControl(self._file_list_control, builder)
 
+        self._initTransformsMenu(builder.get_object("tools_transforms_menu"))
+        self._verify_thread = None
+        self._replaygain_thread = None
+        self._normalize_thread = None
+        self._library = LibraryIndex()
+        self._memory_monitor = MemoryMonitor()
+        GLib.timeout_add_seconds(MEMORY_CHECK_SECS, self._onMemoryCheck)
+
+    def _initTransformsMenu(self, menu):
+        transforms = dict(DEFAULT_TRANSFORMS)
+        transforms["Clean Up Genres"] = TransformPipeline(GenreCleanup(getConfig().genre_aliases))
+        transforms.update(getConfig().transforms or {})
+
+        for name, pipeline in transforms.items():
+            if not isinstance(pipeline, TransformPipeline):
+                # A list of transforms
+                pipeline = TransformPipeline(*pipeline)
+
+            menu_item = Gtk.MenuItem(label=name)
+            menu_item.connect("activate", self._onTransform, pipeline)
+            menu_item.show()
+            menu.append(menu_item)
+
     def show(self):
         # Restore last window size and position
         app_state = getState()
@@ -111,7 +164,7 @@ class MopWindow:
                         if af := eyed3_load(path):
                             audio_files.append(af)
 
-            self._file_list_control.setFiles(audio_files)
+            self._setFiles(audio_files)
 
         if self._file_list_control.current_audio_file:
             # Not using show_all here since some widgets may have hidden
@@ -133,7 +186,17 @@ class MopWindow:
         return {
             "on_file_open_menu_item_activate": self._onDirectoryOpen,
             "on_file_save_menu_item_activate": self._onFileSaveAll,
+            "on_file_export_tags_menu_item_activate": self._onExportTags,
+            "on_file_import_tags_menu_item_activate": self._onImportTags,
+            "on_edit_undo_menu_item_activate": lambda _: self._editor_control.undo(),
+            "on_edit_redo_menu_item_activate": lambda _: self._editor_control.redo(),
             "on_help_about_menu_item_activate": self._onHelpAbout,
+            "on_tools_organize_menu_item_activate": self._onOrganizeFiles,
+            "on_tools_normalize_encoding_menu_item_activate": self._onNormalizeEncoding,
+            "on_tools_find_duplicates_menu_item_activate": self._onFindDuplicates,
+            "on_tools_verify_current_menu_item_activate": self._onVerifyStreams,
+            "on_tools_verify_all_menu_item_activate": self._onVerifyStreams,
+            "on_tools_replaygain_menu_item_activate": self._onAnalyzeReplayGain,
         }
 
     def _onFileSaveAll(self, _):
@@ -145,13 +208,41 @@ class MopWindow:
 
         resp, opts = FileSaveDialog(files).run()
         if resp == Gtk.ResponseType.OK:
+            conflicts = []
             for audio_file in files:
                 if audio_file.is_dirty:
-                    self._saveAudioFile(audio_file, opts)
+                    try:
+                        conflicts += self._saveAudioFile(audio_file, opts)
+                    except OSError as ex:
+                        log.error(f"Save error, {audio_file.path}: {ex}")
+
+            self._updateLibrary([f for f in files if not f.is_dirty])
+
+            # Saved edits need no recovery
+            self._editor_control.flushEditLog()
+            self._editor_control.edit_log.discard(
+                [f.path for f in files if not f.is_dirty]
+            )
+
+            if conflicts:
+                PreviewDialog("Save Conflicts",
+                              f"<b>{len(conflicts)}</b> field(s) were also changed by another "
+                              "program, your edits were saved",
+                              ["File", "Field", "Original", "Other Program", "Saved"],
+                              [(Path(c.audio_file.path).name, c.field, c.base, c.theirs, c.mine)
+                               for c in conflicts]).run()
 
         # Restored current edit based on file list selection.
 
-    def _saveAudioFile(self, audio_file, opts):
+    def _saveAudioFile(self, audio_file, opts) -> list:
+        """Save, with the file locked and merging changes other programs made to it since it was
+        loaded. Returns the conflicting changes (see mergeExternalChanges)."""
+        with lockFile(audio_file.path, storage=audio_file.storage):
+            conflicts = mergeExternalChanges(audio_file)
+            self._writeTags(audio_file, opts)
+        return conflicts
+
+    def _writeTags(self, audio_file, opts):
         assert audio_file is not None and audio_file.tag is not None
         assert opts.id3_v2_version != ID3_V2_2
 
@@ -162,17 +253,42 @@ class MopWindow:
         assert v2_tag is None or v2_tag.isV2()
         assert v1_tag is None or v1_tag.isV1()
 
+        if v2_tag is None and v1_tag is not None and opts.id3_v2_version is None \
+                and opts.id3_v1_version:
+            # v1 only, written in place
+            log.debug(f"Saving v1 tag {audio_file.path}, {opts=}")
+            audio_file.tag = saveV1Tag(audio_file, v1_tag, opts.id3_v1_version)
+            audio_file.is_dirty = False
+            audio_file.has_v1_tag = True
+            audio_file.load_stat = (audio_file.storage or LocalStorage()).stat(audio_file.path)
+            audio_file.load_values = loadValues(audio_file)
+            self._editor_control.edit(audio_file)
+            return
+
+        reload = True
+        try:
+            # eyeD3 writes local files only, others are saved to a local copy written back.
+            with localCopy(audio_file.storage, audio_file.path) as local_path:
+                reload = self._writeLocalTags(audio_file, opts, v1_tag, v2_tag, str(local_path))
+        finally:
+            # After the copy is written back
+            if reload:
+                self._reloadTags(audio_file)
+                self._editor_control.edit(audio_file)
+
+    def _writeLocalTags(self, audio_file, opts, v1_tag, v2_tag, local_path) -> bool:
+        """Write the tags to `local_path`, returns whether tags were saved (to be reloaded)."""
         # Handle v1 removes
         if opts.id3_v1_version is None:
             if v1_tag:
                 log.info("Removing v1 tag")
-                Tag.remove(audio_file.path, ID3_V1)
+                Tag.remove(local_path, ID3_V1)
 
         # Handle v2 removes
         if opts.id3_v2_version is None:
             if v2_tag:
                 log.info("Removing v2 tag")
-                Tag.remove(audio_file.path, ID3_V2)
+                Tag.remove(local_path, ID3_V2)
 
         # No tags to save, nothing to do.
         if (opts.id3_v1_version, opts.id3_v2_version) == (None, None):
@@ -180,41 +296,42 @@ class MopWindow:
             audio_file.initTag(getConfig().preferred_id3_version or ID3_DEFAULT_VERSION)
             audio_file.is_dirty = False
             self._editor_control.edit(audio_file)
-            return
-
-        try:
-            assert v2_tag is None or v2_tag.isV2()
-            assert v1_tag is None or v1_tag.isV1()
-
-            # Save v1
-            if opts.id3_v1_version:
-                save_tag = v1_tag or v2_tag
-                log.debug(f"Saving v1 tag {audio_file.path}, {opts=}")
-                audio_file.tag = save_tag
-                audio_file.tag.save(version=opts.id3_v1_version)
-
-            # Save v2
-            if opts.id3_v2_version:
-                save_tag = v2_tag or v1_tag
-                log.debug(f"Saving v2 tag {audio_file.path}, {opts=}")
-
-                if opts.id3_v2_encoding:
-                    assert type(opts.id3_v2_encoding) is bytes
-                    for frame_list in save_tag.frame_set.values():
-                        for frame in frame_list:
-                            if hasattr(frame, "encoding"):
-                                frame.encoding = opts.id3_v2_encoding
-
-                audio_file.tag = save_tag
-                audio_file.tag.save(version=opts.id3_v2_version)
-
-            audio_file.is_dirty = False
+            return False
+
+        # Save v1
+        if opts.id3_v1_version:
+            save_tag = v1_tag or v2_tag
+            log.debug(f"Saving v1 tag {audio_file.path}, {opts=}")
+            audio_file.tag = save_tag
+            audio_file.tag.file_info.name = local_path
+            audio_file.tag.save(version=opts.id3_v1_version)
+
+        # Save v2
+        if opts.id3_v2_version:
+            save_tag = v2_tag or v1_tag
+            log.debug(f"Saving v2 tag {audio_file.path}, {opts=}")
+
+            if opts.id3_v2_encoding:
+                assert type(opts.id3_v2_encoding) is bytes
+                # Only frames with a different encoding are touched
+                normalizeEncoding(save_tag, opts.id3_v2_encoding,
+                                  version=opts.id3_v2_version)
+
+            audio_file.tag = save_tag
+            audio_file.tag.file_info.name = local_path
+            audio_file.tag.save(version=opts.id3_v2_version)
+
+        audio_file.is_dirty = False
+        return True
 
-        finally:
-            reload = eyed3_load(audio_file.path)
-            audio_file.tag = reload.tag
-            audio_file.second_v1_tag = reload.second_v1_tag
-            self._editor_control.edit(audio_file)
+    @staticmethod
+    def _reloadTags(audio_file):
+        reload = eyed3_load(audio_file.path, audio_file.storage)
+        audio_file.tag = reload.tag
+        audio_file.second_v1_tag = reload.second_v1_tag
+        audio_file.load_stat = reload.load_stat
+        audio_file.load_values = reload.load_values
+        audio_file.has_v1_tag = reload.has_v1_tag
 
     def _onDirectoryOpen(self, _):
         state = getState()
@@ -237,10 +354,282 @@ class MopWindow:
                     audio_files.append(audio_file)
 
         if audio_files:
-            self._file_list_control.setFiles(audio_files)
+            self._setFiles(audio_files)
 
         state.file_open_action = dialog.actionToSting(action)
 
+    def _onTransform(self, menu_item, pipeline):
+        audio_files = list(self._file_list_control.list_store.iterAudioFiles())
+        changes = pipeline.preview(audio_files)
+
+        num_files = len({c.audio_file for c in changes})
+        dialog = PreviewDialog(menu_item.get_label(),
+                               f"<b>{len(changes)}</b> change(s) to <b>{num_files}</b> of "
+                               f"{len(audio_files)} file(s)",
+                               ["File", "Field", "Current", "New"],
+                               [(Path(c.audio_file.path).name, c.field, c.old, c.new)
+                                for c in changes])
+        if dialog.run() != Gtk.ResponseType.OK:
+            return
+
+        renames = self._editor_control.applyTransformChanges(changes)
+        if renames:
+            renames = {c.audio_file: c.new for c in renames}
+            collisions = findCollisions(renames)
+            for target, reason in collisions.items():
+                log.error(f"Not renaming to {target}: {reason}")
+            self._renameFiles({af: p for af, p in renames.items() if p not in collisions})
+
+    def _onOrganizeFiles(self, _):
+        config = getConfig()
+        template = config.organize_template or "{artist}/{album}/{track_num:02d} - {title}"
+        audio_files = list(self._file_list_control.list_store.iterAudioFiles())
+        if not audio_files:
+            return
+
+        base_dir = config.organize_dir or os.path.commonpath([Path(af.path).parent
+                                                              for af in audio_files])
+        renames = planRenames(audio_files, template, base_dir=base_dir)
+        collisions = findCollisions(renames)
+
+        dialog = PreviewDialog("Organize Files",
+                               f"<b>{len(renames) - len(collisions)}</b> of {len(audio_files)} "
+                               f"file(s) to move to <i>{escapeMarkup(str(base_dir))}</i>, "
+                               f"<b>{len(collisions)}</b> collision(s) will be skipped",
+                               ["File", "New Path", "Collision"],
+                               [(audio_file.path, new_path, collisions.get(new_path))
+                                for audio_file, new_path in renames.items()])
+        if dialog.run() != Gtk.ResponseType.OK:
+            return
+
+        self._renameFiles({af: p for af, p in renames.items() if p not in collisions})
+
+    def _onNormalizeEncoding(self, _):
+        if self._normalize_thread and self._normalize_thread.is_alive():
+            log.warning("Encoding normalization already running")
+            return
+
+        encoding = getConfig().preferred_id3_v2_encoding or UTF_8_ENCODING
+        audio_files = list(self._file_list_control.list_store.iterAudioFiles())
+
+        # Exactly which files change, before anything is written.
+        changes = scanEncodings(audio_files, encoding)
+        dialog = PreviewDialog("Normalize Text Encoding",
+                               f"<b>{len(changes)}</b> of {len(audio_files)} file(s) have text "
+                               f"not encoded as <b>{ENCODING_NAMES.get(encoding)}</b> "
+                               "(or utf16 for ID3 v2.3)",
+                               ["File", "Frames", "Unsaved Edits"],
+                               [(af.path, n, "Yes" if af.is_dirty else "")
+                                for af, n in changes.items()])
+        if dialog.run() != Gtk.ResponseType.OK:
+            return
+
+        # Files with unsaved edits are normalized in memory, and written on save.
+        for audio_file in [af for af in changes if af.is_dirty]:
+            normalizeEncoding(audio_file.tag, encoding)
+
+        # The others are rewritten in the background, then reloaded.
+        clean_files = {str(af.path): af for af in changes if not af.is_dirty}
+
+        def normalize():
+            try:
+                results = normalizeFiles(list(clean_files.values()), encoding)
+            except Exception as ex:
+                log.exception(f"Encoding normalization failed: {ex}")
+                GLib.idle_add(self._showError, f"Encoding normalization failed: {ex}")
+                return
+            GLib.idle_add(self._applyNormalizedFiles, clean_files, results)
+
+        self._normalize_thread = threading.Thread(target=normalize, name="normalize",
+                                                  daemon=True)
+        self._normalize_thread.start()
+
+    def _applyNormalizedFiles(self, audio_files: dict, results: dict):
+        """Reload the files normalizeFiles rewrote, `audio_files` maps path to AudioFile."""
+        n = 0
+        for path, result in results.items():
+            audio_file = audio_files[path]
+            if isinstance(result, str) or not result:
+                continue
+            if audio_file.is_dirty:
+                # Edited meanwhile, the save merges the rewritten tag
+                continue
+            self._reloadTags(audio_file)
+            self._file_list_control.list_store.updateRow(audio_file)
+            n += 1
+
+        log.info(f"Normalized text encoding of {n} saved file(s)")
+        self._onFileEditChange(self._file_list_control)
+        return False
+
+    def _onFindDuplicates(self, _):
+        audio_files = list(self._file_list_control.list_store.iterAudioFiles())
+        duplicates = findDuplicates(audio_files)
+
+        self._file_list_control.showDuplicates(duplicates)
+        log.info(f"{sum(len(g) for g in duplicates)} of {len(audio_files)} file(s) are "
+                 f"duplicates, in {len(duplicates)} group(s)")
+
+    def _onVerifyStreams(self, menu_item):
+        if self._verify_thread and self._verify_thread.is_alive():
+            log.warning("Stream verification already running")
+            return
+
+        if Gtk.Buildable.get_name(menu_item) == "tools_verify_current_menu_item":
+            audio_file = self._file_list_control.current_audio_file
+            paths = [audio_file.path] if audio_file else []
+        else:
+            paths = [af.path for af in self._file_list_control.list_store.iterAudioFiles()]
+        if not paths:
+            return
+
+        def onResult(path, scan):
+            status = "; ".join(scanProblems(scan)) or "OK"
+            GLib.idle_add(self._file_list_control.showStreamStatus, path, status)
+
+        def verify():
+            results = scanFiles(paths, on_result=onResult)
+            num_bad = sum(1 for scan in results.values() if scanProblems(scan))
+            log.info(f"Verified {len(results)} of {len(paths)} file(s), {num_bad} with problems")
+
+        # A library can take hours, the UI is updated as each file completes.
+        self._verify_thread = threading.Thread(target=verify, name="verify", daemon=True)
+        self._verify_thread.start()
+
+    def _onAnalyzeReplayGain(self, _):
+        if self._replaygain_thread and self._replaygain_thread.is_alive():
+            log.warning("ReplayGain analysis already running")
+            return
+
+        # Album gain is per album, regardless of the list grouping.
+        albums = GroupIndex(GroupIndex.ALBUM)
+        for audio_file in self._file_list_control.list_store.iterAudioFiles():
+            tag = peekTags(audio_file)[0]
+            if tag and tag.isV2():
+                albums.update(audio_file)
+
+        def analyze():
+            try:
+                results = analyzeAlbums(list(albums.iterGroups()),
+                                        decoder=getConfig().replaygain_decoder)
+            except Exception as ex:
+                log.exception(f"ReplayGain analysis failed: {ex}")
+                GLib.idle_add(self._showError, f"ReplayGain analysis failed: {ex}")
+                return
+            GLib.idle_add(self._applyReplayGain, results)
+
+        self._replaygain_thread = threading.Thread(target=analyze, name="replaygain",
+                                                   daemon=True)
+        self._replaygain_thread.start()
+
+    def _applyReplayGain(self, results: dict):
+        changes = []
+        for audio_file, gain in results.items():
+            for field, value in (("replaygain_track_gain", f"{gain.track_gain:+.2f} dB"),
+                                 ("replaygain_track_peak", f"{gain.track_peak:.6f}"),
+                                 ("replaygain_album_gain", f"{gain.album_gain:+.2f} dB"),
+                                 ("replaygain_album_peak", f"{gain.album_peak:.6f}")):
+                old_value = getTagValue(audio_file.tag, field)
+                if value != old_value:
+                    changes.append(TransformChange(audio_file, field, old_value, value))
+
+        dialog = PreviewDialog("ReplayGain",
+                               f"<b>{len(changes)}</b> change(s) to <b>{len(results)}</b> "
+                               "analyzed file(s), saved with the other edits",
+                               ["File", "Field", "Current", "New"],
+                               [(Path(c.audio_file.path).name, c.field, c.old, c.new)
+                                for c in changes])
+        if dialog.run() == Gtk.ResponseType.OK:
+            self._editor_control.applyTransformChanges(changes)
+
+    def _onExportTags(self, _):
+        filename = SnapshotFileDialog(True, SNAPSHOT_FORMATS).run()
+        if filename is None:
+            return
+
+        try:
+            exportSnapshot(self._file_list_control.list_store.iterAudioFiles(), filename)
+        except (OSError, ValueError) as ex:
+            log.error(f"Tag export error: {ex}")
+
+    def _onImportTags(self, _):
+        filename = SnapshotFileDialog(False, SNAPSHOT_FORMATS).run()
+        if filename is None:
+            return
+
+        audio_files = list(self._file_list_control.list_store.iterAudioFiles())
+        try:
+            changes, missing = diffSnapshot(readSnapshot(filename), audio_files)
+        except (OSError, ValueError) as ex:
+            log.error(f"Tag import error: {ex}")
+            return
+
+        num_files = len({c.audio_file for c in changes})
+        message = f"<b>{len(changes)}</b> change(s) to <b>{num_files}</b> of " \
+                  f"{len(audio_files)} file(s)"
+        if missing:
+            message += f", {len(missing)} file(s) of the snapshot are not open"
+        dialog = PreviewDialog("Import Tags", message,
+                               ["File", "Field", "Current", "New"],
+                               [(Path(c.audio_file.path).name, c.field, c.old, c.new)
+                                for c in changes])
+        if dialog.run() == Gtk.ResponseType.OK:
+            self._editor_control.applyTransformChanges(changes)
+
+    def _renameFiles(self, renames: dict):
+        """Move files, `renames` maps AudioFile to the new path. Check for collisions first."""
+        old_paths = {af: af.path for af in renames}
+        done, errors = renameFiles(renames)
+
+        # Re-keyed in place, nothing is reloaded.
+        self._file_list_control.list_store.rename(done)
+        self._editor_control.flushEditLog()
+        self._editor_control.edit_log.rename({old_paths[af]: af.path for af in done})
+        try:
+            self._library.rename({old_paths[af]: af.path for af in done})
+        except sqlite3.Error as ex:
+            log.error(f"Library index error: {ex}")
+        log.info(f"Renamed {len(done)} of {len(renames)} file(s), {len(errors)} error(s)")
+
+        self._onFileEditChange(self._file_list_control)
+
+    def _setFiles(self, audio_files):
+        self._file_list_control.setFiles(audio_files)
+        # Undo history is for the previous files
+        self._editor_control.journal.clear()
+        self._editor_control.recoverEdits(audio_files)
+        self._updateLibrary(audio_files)
+        self._memory_monitor.setFiles(audio_files)
+        self._onMemoryCheck()
+
+    def _showError(self, message):
+        """Show `message` in the status bar, for errors of background work (via idle_add)."""
+        self._statusbar.remove_all(self._error_status_id)
+        self._statusbar.push(self._error_status_id, message)
+        return False
+
+    def _onMemoryCheck(self):
+        """Enforce the memory budget (config memory_budget) and show memory use, periodically.
+        Only files touched since the last check, or modified, are measured again."""
+        dirty_files = [af for af in self._file_list_control.list_store.iterAudioFiles()
+                       if af.is_dirty]
+        report = self._memory_monitor.check(dirty_files, getConfig().memory_budget,
+                                            keep=self._file_list_control.selected_audio_files,
+                                            tag_cache=getTagCache())
+        # Only when changed, not to cover an error shown since
+        if (text := formatReport(report)) != self._memory_status:
+            self._memory_status = text
+            self._statusbar.remove_all(self._memory_status_id)
+            self._statusbar.push(self._memory_status_id, text)
+        # Keep the timer
+        return True
+
+    def _updateLibrary(self, audio_files):
+        try:
+            self._library.update(audio_files)
+        except sqlite3.Error as ex:
+            log.error(f"Library index error: {ex}")
+
     def shutdown(self) -> bool:
         if self._file_list_control.is_dirty:
             resp = Dialog("quit_confirm_dialog").run()
@@ -251,6 +640,13 @@ class MopWindow:
             if resp == Gtk.ResponseType.OK:
                 self._onFileSaveAll(None)
 
+        # Edits not saved by now are abandoned, unlike a crash there is nothing to recover.
+        self._editor_control.flushEditLog()
+        self._editor_control.edit_log.discard(
+            [f.path for f in self._file_list_control.list_store.iterAudioFiles()]
+        )
+        self._library.close()
+
         return True
 
     @staticmethod
@@ -264,8 +660,10 @@ class MopWindow:
 
         # File n of N label
         if list_control.current_index is not None:
+            num_selected = len(list_control.selected_audio_files)
             self._file_info_label.set_markup(
                 f"<b>File {list_control.current_index + 1}  of  {num}</b>"
+                + (f"  ({num_selected} selected)" if num_selected > 1 else "")
             )
         else:
             self._file_info_label.set_markup("")
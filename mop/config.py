@@ -16,6 +16,15 @@ __all__ = ["CONFIG_DIR", "Config", "getConfig", "getState"]
 CONFIG_DIR = Path("~/.config/Mop/").expanduser()
 CACHE_DIR = Path("~/.cache/Mop/").expanduser()
 DEFAULT_STATE_FILE = CACHE_DIR / "mop.json"
+DEFAULT_EDIT_LOG_FILE = CACHE_DIR / "edits.log"
+# Renamed when what they hold changes, e.g. the audio region excluding APE and Lyrics3 blocks
+DEFAULT_AUDIO_HASH_CACHE_FILE = CACHE_DIR / "audio_hashes-2.json"
+DEFAULT_STREAM_SCAN_CACHE_FILE = CACHE_DIR / "stream_scans-2.json"
+DEFAULT_LOUDNESS_CACHE_FILE = CACHE_DIR / "loudness.json"
+DEFAULT_LIBRARY_FILE = CACHE_DIR / "library.db"
+DEFAULT_TAG_CACHE_FILE = CACHE_DIR / "tags.db"
+DEFAULT_SCAN_CHECKPOINT_FILE = CACHE_DIR / "scan_checkpoint.jsonl"
+DEFAULT_GENRES_FILE = CONFIG_DIR / "genres.txt"
 
 # Global config and state
 _config = None
@@ -58,11 +67,67 @@ class _Config:
 class _PyConfig(_Config):
     DEFAULT_PATH = CONFIG_DIR / "mop_cfg.py"
     DEFAULT_CONFIG = textwrap.dedent("""
-    from eyed3.id3 import ID3_V2_4, ID3_V1_1
+    from eyed3.id3 import ID3_V2_4, ID3_V1_1, UTF_8_ENCODING
 
     preferred_id3_v1_version = ID3_V1_1
     preferred_id3_v2_version = ID3_V2_4
     preferred_id3_version = preferred_id3_v2_version
+    # Used by Tools > Normalize Text Encoding, UTF-16 is used for ID3 v2.3 (no UTF-8 support)
+    preferred_id3_v2_encoding = UTF_8_ENCODING
+
+    # Count MPEG frames for exact durations of VBR files without a Xing/VBRI header, eyeD3
+    # estimates those from the file size. Results are cached, only new files are counted. Files
+    # are counted in the background, with the estimates shown until then.
+    accurate_durations = False
+
+    # For directories on network filesystems (NFS, SMB): several files load at once. Files of
+    # directories (with an .mp3 extension only) are read in a few large reads either way.
+    # storage_latency (seconds) adds latency to each request, for measuring.
+    network_storage = False
+    # storage_latency = 0.005
+
+    # Files loaded from directories: names (or trailing path components, for globs with a "/")
+    # matching a scan_include glob and no scan_exclude glob, case-insensitive. Excluded
+    # directories are skipped. Sizes are in bytes, depth 0 is the opened directory. Symlinked
+    # directories are followed with scan_follow_symlinks, those looping back are skipped.
+    scan_include = ["*.mp3"]
+    scan_exclude = []
+    # scan_exclude = [".*", "@eaDir", "Podcasts", "Live/*.mp3"]
+    scan_max_depth = None
+    scan_min_size = None
+    scan_max_size = None
+    scan_follow_symlinks = False
+
+    # Tags of the files of loaded directories are cached, for loading them again without
+    # reading the files, e.g. when resuming an interrupted scan. Size limit in bytes:
+    # tag_cache_size = 1024 * 1024 * 1024
+
+    # Memory for the tags of loaded files, in bytes. Past it, the tags of the least recently used
+    # files without unsaved changes are dropped from memory, and parsed again (from the tag cache)
+    # when next used. For example 512 MB: memory_budget = 512 * 1024 * 1024
+    memory_budget = None
+
+    # Tools > ReplayGain decoder, "{path}" is replaced by the file. It must write signed 16-bit
+    # little endian stereo 48 kHz PCM to stdout. Defaults to:
+    # replaygain_decoder = ["ffmpeg", "-v", "error", "-i", "{path}",
+    #                       "-f", "s16le", "-ac", "2", "-ar", "48000", "-"]
+
+    # Grouping for per group operations (track numbering, totals, copy):
+    # "directory", "album", "disc", or "none" for all opened files.
+    group_by = "directory"
+
+    # Tools > Organize Files, moves files to paths made from their tags. Relative templates are
+    # relative to organize_dir, or the common directory of the files when not set.
+    organize_template = "{artist}/{album}/{track_num:02d} - {title}"
+    organize_dir = None
+
+    # Tools > Transforms > Clean Up Genres, spellings to replace (besides those differing only
+    # by case, spacing, or punctuation). For example:
+    # genre_aliases = {"Chiptunes": "Chiptune", "Hiphop": "Hip-Hop"}
+
+    # Additional Tools > Transforms, name -> list of mop.transforms.Transform. For example:
+    # from mop.transforms import RegexReplace
+    # transforms = {"Feat. -> ft.": [RegexReplace("artist", r"\\s+feat\\.?\\s+", " ft. ")]}
     """).lstrip()
 
     def __init__(self):
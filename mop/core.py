@@ -1,26 +1,210 @@
-from eyed3.id3 import GenreMap, Genre
+import bisect
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from eyed3.id3 import GenreMap, Genre, DEFAULT_LANG
+from eyed3.id3.tag import ID3_V1_COMMENT_DESC
+from .config import DEFAULT_GENRES_FILE
 
-__all__ = ["Genre", "GENRES"]
+log = logging.getLogger(__name__)
+
+__all__ = ["Genre", "GENRES", "TAG_FIELDS", "REPLAYGAIN_FIELDS", "getTagValue", "setTagValue",
+           "getTagValues", "normalizeGenre"]
+
+# Editable tag fields. All but "comment" and "url" are eyeD3 Tag attributes of the same name, those
+# two are the description-less comment and user URL frames.
+TAG_FIELDS = (
+    "title", "artist", "album", "album_artist", "original_artist", "composer", "encoded_by",
+    "publisher", "copyright", "track_num", "disc_num", "release_date", "recording_date",
+    "original_release_date", "album_type", "genre", "comment", "url",
+)
+
+# ReplayGain values, ID3 v2 user text (TXXX) frames. Not editable but getTagValue/setTagValue
+# accept them too.
+REPLAYGAIN_FIELDS = {
+    "replaygain_track_gain": "REPLAYGAIN_TRACK_GAIN",
+    "replaygain_track_peak": "REPLAYGAIN_TRACK_PEAK",
+    "replaygain_album_gain": "REPLAYGAIN_ALBUM_GAIN",
+    "replaygain_album_peak": "REPLAYGAIN_ALBUM_PEAK",
+}
+
+
+def normalizeGenre(name: str) -> str:
+    """Genre lookup key: casefolded with whitespace collapsed."""
+    return " ".join(name.casefold().split())
+
+
+class _QuietFilter(logging.Filter):
+    """Drops the records of a logger logged by threads within `quiet()`."""
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    @contextmanager
+    def quiet(self):
+        self._local.quiet = True
+        try:
+            yield
+        finally:
+            self._local.quiet = False
+
+    def filter(self, record) -> bool:
+        return not getattr(self._local, "quiet", False)
+
+
+# eyeD3 warns for each Genre of a non standard name
+_eyed3_id3_filter = _QuietFilter()
+logging.getLogger("eyed3.id3").addFilter(_eyed3_id3_filter)
+
+
+def _customGenre(name) -> Genre:
+    """A Genre of non standard `name`, with no id as when read from tags."""
+    with _eyed3_id3_filter.quiet():
+        return Genre(name=name, id=None)
 
 
 class Genres(GenreMap):
-    _next_gid = GenreMap.GENRE_ID3V1_MAX + 1
+    """The standard genres, plus custom genres with ids above GENRE_ID3V1_MAX.
 
-    def __init__(self, *args):
-        super().__init__(*args)
+    Names are looked up normalized (see normalizeGenre) in constant time. Custom genres are
+    persisted to `filename`, one per line, so their ids are stable from run to run.
+    """
+    def __init__(self, filename=None):
+        super().__init__()
+        self._next_gid = self.GENRE_ID3V1_MAX + 1
+        self._filename = Path(filename) if filename else None
+        self._completion_index = None  # Sorted (normalized name, gid)
 
-    def add(self, name) -> Genre:
-        if name in self:
-            raise ValueError(f"Genre exists: {name}")
+        # Standard names normalized, the base class only lower cases them
+        for gid in self.ids:
+            dict.__setitem__(self, normalizeGenre(self[gid]), gid)
+
+        if self._filename and self._filename.exists():
+            for name in self._filename.read_text(encoding="utf8").splitlines():
+                if name.strip() and name not in self:
+                    self._add(name.strip())
+            log.debug(f"Loaded {self._next_gid - self.GENRE_ID3V1_MAX - 1} custom genres")
+
+    def __getitem__(self, key):
+        if key and type(key) is not int:
+            key = normalizeGenre(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        if key and type(key) is not int:
+            key = normalizeGenre(key)
+        return dict.__contains__(self, key)
 
-        assert self._next_gid not in self
+    def isCustom(self, gid) -> bool:
+        return gid is not None and gid > self.GENRE_ID3V1_MAX
+
+    def _add(self, name) -> int:
         gid = self._next_gid
         self._next_gid += 1
 
-        self[gid] = name
-        self[name.lower()] = gid
+        dict.__setitem__(self, gid, name)
+        dict.__setitem__(self, normalizeGenre(name), gid)
+        if self._completion_index is not None:
+            bisect.insort(self._completion_index, (normalizeGenre(name), gid))
+        return gid
+
+    def add(self, name) -> Genre:
+        """Register custom genre `name`, and persist it."""
+        name = " ".join(name.split())
+        if name in self:
+            raise ValueError(f"Genre exists: {name}")
+
+        gid = self._add(name)
+        if self._filename:
+            try:
+                self._filename.parent.mkdir(parents=True, exist_ok=True)
+                with open(self._filename, "a", encoding="utf8") as fp:
+                    fp.write(name + "\n")
+            except OSError as ex:
+                log.error(f"Custom genre save error: {ex}")
 
         return self.get(gid)
 
+    def genre(self, name):
+        """A Genre for `name`, None if empty. Registered names are returned with their registered
+        spelling, standard genres with their id; custom genres have no id, as when read from a
+        tag."""
+        if not name or not name.strip():
+            return None
+
+        gid = self[name] if name in self else None
+        if gid is not None and not self.isCustom(gid):
+            return Genre(id=gid, genre_map=self)
+        return _customGenre(dict.__getitem__(self, gid) if gid is not None else name.strip())
+
+    def complete(self, prefix) -> list:
+        """Ids of the genres starting with `prefix` (normalized), in name order."""
+        if self._completion_index is None:
+            self._completion_index = sorted((normalizeGenre(dict.__getitem__(self, gid)), gid)
+                                            for gid in self.ids)
+
+        prefix = normalizeGenre(prefix)
+        start = bisect.bisect_left(self._completion_index, (prefix,))
+        gids = []
+        for key, gid in self._completion_index[start:]:
+            if not key.startswith(prefix):
+                break
+            gids.append(gid)
+        return gids
+
+
+GENRES = Genres(DEFAULT_GENRES_FILE)
+
+
+def _commentDesc(tag):
+    return "" if tag.isV2() else ID3_V1_COMMENT_DESC
+
+
+def getTagValue(tag, field):
+    """Get the value of `field` (see TAG_FIELDS) from an eyeD3 tag."""
+    if field == "comment":
+        comment = tag.comments.get(_commentDesc(tag), lang=DEFAULT_LANG)
+        return comment.text if comment else None
+    elif field == "url":
+        url = tag.user_url_frames.get("")
+        return url.url if url else None
+    elif field in REPLAYGAIN_FIELDS:
+        frame = tag.user_text_frames.get(REPLAYGAIN_FIELDS[field])
+        return frame.text if frame else None
+    elif field in TAG_FIELDS:
+        return getattr(tag, field)
+    else:
+        raise ValueError(f"Unsupported tag field: {field}")
+
+
+def getTagValues(tag) -> dict:
+    """All TAG_FIELDS and REPLAYGAIN_FIELDS values of an eyeD3 tag."""
+    values = {field: getTagValue(tag, field) for field in TAG_FIELDS}
+    if tag.isV2():
+        values.update({field: getTagValue(tag, field) for field in REPLAYGAIN_FIELDS})
+    return values
+
 
-GENRES = Genres()
+def setTagValue(tag, field, value):
+    """Set `field` (see TAG_FIELDS) of an eyeD3 tag, a None value removes comments, URLs, and
+    ReplayGain values."""
+    if field == "comment":
+        if value is None:
+            tag.comments.remove(_commentDesc(tag), lang=DEFAULT_LANG)
+        else:
+            tag.comments.set(value, _commentDesc(tag), lang=DEFAULT_LANG)
+    elif field == "url":
+        if value is None:
+            tag.user_url_frames.remove("")
+        else:
+            tag.user_url_frames.set(value, "")
+    elif field in REPLAYGAIN_FIELDS:
+        if value is None:
+            tag.user_text_frames.remove(REPLAYGAIN_FIELDS[field])
+        else:
+            tag.user_text_frames.set(value, REPLAYGAIN_FIELDS[field])
+    elif field in TAG_FIELDS:
+        setattr(tag, field, value)
+    else:
+        raise ValueError(f"Unsupported tag field: {field}")
@@ -272,6 +272,54 @@ class FileChooserDialog(Dialog):
         self._dialog.connect(*args)
 
 
+class PreviewDialog(Dialog):
+    """Lists pending changes, for the user to apply or cancel."""
+    def __init__(self, title, message, columns, rows):
+        super().__init__("preview_dialog")
+        self._dialog.set_title(title)
+        self._builder.get_object("preview_dialog_message_label").set_markup(message)
+
+        model = Gtk.ListStore(*([str] * len(columns)))
+        for row in rows:
+            model.append([str(value) if value is not None else "" for value in row])
+
+        tree_view = self._builder.get_object("preview_tree_view")
+        for i, title in enumerate(columns):
+            tree_view.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i))
+        tree_view.set_model(model)
+
+        # Nothing to apply
+        self._builder.get_object("preview_apply_button").set_sensitive(len(model) > 0)
+
+
+class SnapshotFileDialog:
+    """Choose a tag snapshot file (see mop.snapshot), to export to or import from."""
+    def __init__(self, export: bool, formats: list):
+        action = Gtk.FileChooserAction.SAVE if export else Gtk.FileChooserAction.OPEN
+        self._dialog = Gtk.FileChooserDialog(title="Export Tags" if export else "Import Tags",
+                                             action=action)
+        self._dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                                 Gtk.STOCK_SAVE if export else Gtk.STOCK_OPEN,
+                                 Gtk.ResponseType.OK)
+        if export:
+            self._dialog.set_do_overwrite_confirmation(True)
+            self._dialog.set_current_name(f"tags{formats[0]}")
+
+        snapshot_filter = Gtk.FileFilter()
+        snapshot_filter.set_name(f"Tag Snapshots ({', '.join(formats)})")
+        for suffix in formats:
+            snapshot_filter.add_pattern(f"*{suffix}")
+        self._dialog.add_filter(snapshot_filter)
+
+    def run(self) -> Optional[Path]:
+        try:
+            if self._dialog.run() == Gtk.ResponseType.OK:
+                return Path(self._dialog.get_filename())
+            return None
+        finally:
+            self._dialog.destroy()
+
+
 class NothingToDoDialog(Dialog):
     def __init__(self):
         super().__init__("nothing_to_do_dialog")
@@ -0,0 +1,172 @@
+import os
+import hashlib
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .config import DEFAULT_AUDIO_HASH_CACHE_FILE
+from .filecache import FileCache
+from .id3v1 import V1_TAG_SIZE
+from .storage import ID3_V2_HEADER_SIZE, synchsafe
+
+log = logging.getLogger(__name__)
+
+__all__ = ["audioRegion", "audioHash", "audioHashes", "findDuplicates"]
+
+# hashlib releases the GIL for large buffers, so threads hash (and read) in parallel.
+MAX_HASH_WORKERS = 8
+READ_SIZE = 1024 * 1024
+
+# APEv2 (and v1) tag footer: "APETAGEX", version, size (with the footer, not the header), item
+# count, flags (bit 31: a header precedes the items), reserved. All little endian.
+APE_FOOTER_SIZE = 32
+APE_HAS_HEADER = 0x80000000
+# Lyrics3 v2 ends with the block's size, 6 ASCII digits, and "LYRICS200". Lyrics3 v1 has no
+# size, it ends with "LYRICSEND" and is at most 5100 bytes of lyrics after "LYRICSBEGIN".
+LYRICS3_V1_MAX_SIZE = 5100 + 11 + 9
+
+
+def _trailingBlockStart(fp, end, start):
+    """The offset of an APE or Lyrics3 block ending at `end`, not before `start`, else None."""
+    if end - APE_FOOTER_SIZE >= start:
+        fp.seek(end - APE_FOOTER_SIZE)
+        footer = fp.read(APE_FOOTER_SIZE)
+        if footer[:8] == b"APETAGEX":
+            size = int.from_bytes(footer[12:16], "little")
+            flags = int.from_bytes(footer[20:24], "little")
+            block_start = end - size - (APE_FOOTER_SIZE if flags & APE_HAS_HEADER else 0)
+            if start <= block_start < end:
+                return block_start
+
+    if end - 15 >= start:
+        fp.seek(end - 15)
+        footer = fp.read(15)
+        if footer[6:] == b"LYRICS200" and footer[:6].isdigit():
+            block_start = end - 15 - int(footer[:6])
+            if start <= block_start < end:
+                return block_start
+        elif footer[6:] == b"LYRICSEND":
+            size = min(LYRICS3_V1_MAX_SIZE, end - start)
+            fp.seek(end - size)
+            if (i := fp.read(size).rfind(b"LYRICSBEGIN")) != -1:
+                return end - size + i
+
+    return None
+
+
+def audioRegion(fp, file_size) -> tuple:
+    """The (start, end) offsets of the audio data of open file `fp`, i.e. without a leading ID3
+    v2 tag (padding and footer included), or trailing ID3 v1 tag and APE and Lyrics3 blocks
+    (before the v1 tag, in either order)."""
+    start, end = 0, file_size
+
+    fp.seek(0)
+    header = fp.read(ID3_V2_HEADER_SIZE)
+    if len(header) == ID3_V2_HEADER_SIZE and header[:3] == b"ID3":
+        start = ID3_V2_HEADER_SIZE + synchsafe(header[6:10])
+        if header[5] & 0x10:
+            # Footer present
+            start += ID3_V2_HEADER_SIZE
+
+    if file_size - V1_TAG_SIZE >= start:
+        fp.seek(file_size - V1_TAG_SIZE)
+        if fp.read(3) == b"TAG":
+            end = file_size - V1_TAG_SIZE
+
+    while (block_start := _trailingBlockStart(fp, end, start)) is not None:
+        end = block_start
+
+    return min(start, end), end
+
+
+def audioHash(path) -> str:
+    """Hash of the audio data of `path`, tags excluded, so retagged copies hash the same."""
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = memoryview(bytearray(READ_SIZE))
+
+    with open(path, "rb", buffering=0) as fp:
+        start, end = audioRegion(fp, os.fstat(fp.fileno()).st_size)
+        fp.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            n = fp.readinto(buffer[:min(remaining, READ_SIZE)])
+            if not n:
+                break
+            digest.update(buffer[:n])
+            remaining -= n
+
+    return digest.hexdigest()
+
+
+def _hashFiles(files, cache: FileCache, max_workers) -> dict:
+    """Hash `files`, (AudioFile, stat result) pairs, using and updating `cache`."""
+    hashes = {}
+    to_hash = []
+    for audio_file, stat_result in files:
+        if (hash_ := cache.get(audio_file.path, stat_result)) is not None:
+            hashes[audio_file] = hash_
+        else:
+            to_hash.append((audio_file, stat_result))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(audioHash, af.path): (af, st) for af, st in to_hash}
+        for future, (audio_file, stat_result) in futures.items():
+            try:
+                hashes[audio_file] = future.result()
+            except OSError as ex:
+                log.error(f"Audio hash error: {ex}")
+                continue
+            cache.set(audio_file.path, stat_result, hashes[audio_file])
+
+    try:
+        cache.save()
+    except OSError as ex:
+        log.warning(f"Audio hash cache save error: {ex}")
+
+    log.debug(f"Hashed {len(to_hash)} of {len(files)} file(s), {len(files) - len(to_hash)} "
+              "cached")
+    return hashes
+
+
+def audioHashes(audio_files, cache_file=DEFAULT_AUDIO_HASH_CACHE_FILE,
+                max_workers=MAX_HASH_WORKERS) -> dict:
+    """AudioFile -> `audioHash`, cached by path, mtime, and size in `cache_file`."""
+    files = []
+    for audio_file in audio_files:
+        try:
+            files.append((audio_file, os.stat(audio_file.path)))
+        except OSError as ex:
+            log.error(f"Audio hash error: {ex}")
+    return _hashFiles(files, FileCache(cache_file), max_workers)
+
+
+def findDuplicates(audio_files, cache_file=DEFAULT_AUDIO_HASH_CACHE_FILE,
+                   max_workers=MAX_HASH_WORKERS) -> list:
+    """Group `audio_files` with identical audio data, returns a list of groups (lists of two or
+    more files). Only files whose size of audio data matches that of another file are hashed,
+    and hashes are cached by path, mtime, and size in `cache_file`.
+    """
+    cache = FileCache(cache_file)
+
+    # Audio data sizes are an exact and cheap first pass.
+    by_size = defaultdict(list)
+    for audio_file in audio_files:
+        try:
+            with open(audio_file.path, "rb") as fp:
+                stat_result = os.fstat(fp.fileno())
+                start, end = audioRegion(fp, stat_result.st_size)
+        except OSError as ex:
+            log.error(f"Audio hash error: {ex}")
+            continue
+        by_size[end - start].append((audio_file, stat_result))
+    candidates = [c for group in by_size.values() if len(group) > 1 for c in group]
+
+    hashes = _hashFiles(candidates, cache, max_workers)
+
+    by_hash = defaultdict(list)
+    for audio_file, hash_ in hashes.items():
+        by_hash[hash_].append(audio_file)
+    duplicates = [group for group in by_hash.values() if len(group) > 1]
+
+    log.debug(f"{len(candidates)} of {len(audio_files)} file(s) hashed, "
+              f"{len(duplicates)} duplicate group(s)")
+    return duplicates
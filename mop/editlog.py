@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from eyed3.core import Date
+from .core import Genre, GENRES
+
+log = logging.getLogger(__name__)
+
+__all__ = ["EditLog"]
+
+# Edits older than this are dropped when the log is loaded, as are those of files that were
+# moved, deleted, or changed since.
+MAX_EDIT_AGE_DAYS = 30
+
+
+def encodeValue(value):
+    """Tag field value to a JSON compatible value."""
+    if value is None or isinstance(value, (str, int)):
+        return value
+    elif isinstance(value, tuple):
+        return {"tuple": list(value)}
+    elif isinstance(value, Date):
+        return {"date": str(value)}
+    elif isinstance(value, Genre):
+        return {"genre": value.name}
+    raise TypeError(f"Unsupported tag value type: {type(value)}")
+
+
+def decodeValue(value):
+    if isinstance(value, dict):
+        if "tuple" in value:
+            return tuple(value["tuple"])
+        elif "date" in value:
+            return Date.parse(value["date"])
+        elif "genre" in value:
+            return GENRES.genre(value["genre"])
+        raise ValueError(f"Unsupported tag value: {value}")
+    return value
+
+
+def fileStamp(stat_result) -> tuple:
+    """The (mtime, size) an edit is recorded against, used to tell if the file has changed."""
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+class EditLog:
+    """Append-only log of unsaved tag edits, for recovering from crashes.
+
+    Edits are appended as JSON lines, one per (path, tag slot, field), stamped with the file's
+    (mtime, size) at load time. Appends are coalesced in memory and written by `flush`, one
+    write and one fsync for all edits since the previous flush, which makes `append` cheap enough
+    to call per keystroke. Edits for a file are only replayed if its stamp still matches.
+
+    The log is compacted when loaded, dropping the edits that can no longer be replayed (their
+    file is gone or changed) and those older than `max_age_days`.
+    """
+    def __init__(self, filename, max_age_days=MAX_EDIT_AGE_DAYS):
+        self._path = Path(filename)
+        self._max_age_days = max_age_days
+        self._pending = {}  # (path, slot, field) -> record, the next flush
+        self._records = {}  # path -> {(slot, field): record}, everything logged
+
+        if self._path.exists():
+            self._load()
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def _load(self):
+        n = 0
+        with open(self._path, "r", encoding="utf8") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write from a crash, nothing follows it.
+                    log.warning(f"Truncated edit log: {self._path}")
+                    break
+                # Logs of earlier versions have no time, they age from now
+                record.setdefault("time", time.time())
+                self._records.setdefault(record["path"], {})[(record["slot"],
+                                                              record["field"])] = record
+                n += 1
+        log.debug(f"Loaded {n} edit log records for {len(self._records)} file(s)")
+
+        stale = [path for path, records in self._records.items() if self._isStale(path, records)]
+        if stale:
+            for path in stale:
+                del self._records[path]
+            log.info(f"Dropped the edit log records of {len(stale)} file(s), gone, changed, or "
+                     f"older than {self._max_age_days} days")
+            self._rewrite()
+
+    def _isStale(self, path, records: dict) -> bool:
+        """Whether none of the edits of `path` can be, or should be, replayed."""
+        try:
+            stamp = fileStamp(os.stat(path))
+        except OSError:
+            return True
+
+        expired = time.time() - self._max_age_days * 24 * 60 * 60
+        return not any((r["mtime"], r["size"]) == stamp and r["time"] >= expired
+                       for r in records.values())
+
+    def append(self, audio_file, slot, field, value):
+        path = str(audio_file.path)
+        mtime, size = fileStamp(audio_file.load_stat)
+        record = dict(path=path, mtime=mtime, size=size, slot=slot, field=field,
+                      value=encodeValue(value), time=time.time())
+
+        self._pending[(path, slot, field)] = record
+        self._records.setdefault(path, {})[(slot, field)] = record
+
+    def flush(self):
+        """Write and fsync all pending edits."""
+        if not self._pending:
+            return
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        data = "".join(json.dumps(r) + "\n" for r in self._pending.values())
+        with open(self._path, "a", encoding="utf8") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        log.debug(f"Flushed {len(self._pending)} edit(s) to {self._path}")
+        self._pending.clear()
+
+    def recoveredEdits(self, audio_file):
+        """Yields (slot, field, value) for the logged edits of `audio_file`, if it is unchanged
+        since they were recorded."""
+        records = self._records.get(str(audio_file.path))
+        if not records:
+            return
+
+        stamp = fileStamp(audio_file.load_stat)
+        for (slot, field), record in list(records.items()):
+            if (record["mtime"], record["size"]) == stamp:
+                yield slot, field, decodeValue(record["value"])
+
+    def discard(self, paths):
+        """Forget the edits of `paths` (i.e. saved or abandoned) and compact the log."""
+        n = 0
+        for path in paths:
+            if self._records.pop(str(path), None) is not None:
+                n += 1
+        if not n:
+            return
+        self._rewrite()
+
+    def rename(self, renames: dict):
+        """Move the edits of renamed files, `renames` maps old to new paths."""
+        n = 0
+        for old_path, new_path in renames.items():
+            records = self._records.pop(str(old_path), None)
+            if records:
+                for record in records.values():
+                    record["path"] = str(new_path)
+                self._records[str(new_path)] = records
+                n += 1
+
+        if n:
+            self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = self._path.with_suffix(".tmp")
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf8") as fp:
+            for records in self._records.values():
+                for record in records.values():
+                    fp.write(json.dumps(record) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self._path)
+
+        # Pending edits were all written.
+        self._pending.clear()
@@ -1,10 +1,15 @@
+import re
 import logging
-from contextlib import contextmanager
-from gi.repository import GObject
+from contextlib import contextmanager, nullcontext
+from gi.repository import GObject, Gtk
 from eyed3.id3 import ID3_ANY_VERSION, versionToString
+from ..core import TAG_FIELDS, getTagValue
 
 log = logging.getLogger(__name__)
 
+# Shown by editors of a field whose value differs among the selected files.
+MULTIPLE_VALUES = "<multiple>"
+
 
 class EditorWidget(GObject.GObject):
     __gsignals__ = {
@@ -35,7 +40,28 @@ class EditorWidget(GObject.GObject):
     def _getInternalName(name) -> str:
         return f"current_edit_{name}"
 
+    @property
+    def field(self) -> str:
+        """The tag field (see `mop.core.TAG_FIELDS`) edited, None if not a tag field editor."""
+        # e.g. tag_albumArtist_entry -> album_artist
+        field = re.sub(r"[A-Z]", lambda m: f"_{m.group().lower()}",
+                       self._name[len("tag_"):self._name.rindex("_")])
+        field = {"orig_artist": "original_artist",
+                 "track_total": "track_num",
+                 "disc_total": "disc_num",
+                 }.get(field, field)
+        return field if field in TAG_FIELDS else None
+
+    @property
+    def _entry(self):
+        """The widget's text entry, None if it has none."""
+        widget = self.widget if isinstance(self.widget, Gtk.Entry) else self.widget.get_child()
+        return widget if isinstance(widget, Gtk.Entry) else None
+
     def init(self, audio_file, disable_change_signal=False):
+        if self._entry is not None:
+            self._entry.set_placeholder_text(None)
+
         if not disable_change_signal:
             self._init(audio_file)
         else:
@@ -48,6 +74,17 @@ class EditorWidget(GObject.GObject):
     def get(self):
         raise NotImplementedError()
 
+    def selectionValue(self, tag):
+        """The (hashable) value edited of `tag`, selected files sharing it show it."""
+        return getTagValue(tag, self.field)
+
+    def showMultiple(self):
+        """Show the selected files have different values, it is not the current file's."""
+        if self._entry is not None:
+            with self._onChangeInactive():
+                self._entry.set_text("")
+            self._entry.set_placeholder_text(MULTIPLE_VALUES)
+
     def _iterTags(self, audio_file):
         for tag in (audio_file.tag, audio_file.second_v1_tag):
             if tag and self._checkVersion(tag.version):
@@ -58,13 +95,42 @@ class EditorWidget(GObject.GObject):
 
         for tag in self._iterTags(audio_file):
             getter, setter = self._getAccessors(tag)
+            curr_value = getter()
             # Normalize "" to None
-            if (value or None) != (getter() or None):
-                log.info(f"Set [{self._name}] value, tag v{tag.version}: '{getter()}' -> '{value}'")
+            if (value or None) != (curr_value or None):
+                log.debug(f"Set [{self._name}] value, tag v{tag.version}: "
+                          f"'{curr_value}' -> '{value}'")
                 setter(value)
                 changed = True
         return changed
 
+    def apply(self, audio_file, value) -> bool:
+        """Like `set`, with the changes recorded in the editor's undo journal."""
+        field = self.field
+        if field is None:
+            return self.set(audio_file, value)
+
+        tags = list(self._iterTags(audio_file))
+        old_values = [getTagValue(tag, field) for tag in tags]
+
+        changed = self.set(audio_file, value)
+        if changed:
+            for tag, old_value in zip(tags, old_values):
+                self._editor_ctl.journal.record(audio_file, tag, field,
+                                                old_value, getTagValue(tag, field))
+        return changed
+
+    def _applyEdit(self, value):
+        """`apply` `value` to the files edited, the current file or the selection including it.
+        A selection's edit is one undo step, a single file's keystrokes merge as before."""
+        targets = self._editor_ctl.edit_targets
+        with self._editor_ctl.journal.transaction() if len(targets) > 1 else nullcontext():
+            changed = [af for af in targets if self.apply(af, value)]
+        for audio_file in changed:
+            audio_file.is_dirty = True
+        if changed:
+            self.emit("tag-changed")
+
     def _connect(self):
         self.widget.connect("changed", self._onChanged)
         self.widget.connect("icon-release", self._onDeepCopy)
@@ -95,11 +161,7 @@ class EditorWidget(GObject.GObject):
 
     def _onChanged(self, widget):
         if self._on_change_active and self._editor_ctl.current_edit:
-
-            if self.set(self._editor_ctl.current_edit, widget.get_text()):
-                log.debug("Setting tag_dirty4")
-                self._editor_ctl.current_edit.is_dirty = True
-                self.emit("tag-changed")
+            self._applyEdit(widget.get_text())
 
     def _onDeepCopy(self, entry, icon_pos, button):
         raise NotImplementedError()
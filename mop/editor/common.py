@@ -13,7 +13,7 @@ from .abc import EditorWidget
 
 log = logging.getLogger(__name__)
 
-# Genre models. A static ID3 v1 and dynamic v2, for quick swapping
+# Genre models, built once. A static ID3 v1 and v2, with custom genres, for quick swapping
 _id3_v1_genre_model = Gtk.ListStore(str, str)
 _id3_v1_genre_model.append(["", "-1"])
 _id3_v2_genre_model = Gtk.ListStore(str, str)
@@ -156,6 +156,9 @@ class NumTotalEditorWidget(EntryEditorWidget):
 
         return changed
 
+    def selectionValue(self, tag):
+        return super().selectionValue(tag)[1 if self._is_total else 0]
+
     def _onDeepCopy(self, entry, icon_pos, button):
         if button.state & MOUSE_BUTTON1_MASK:
             if icon_pos == ENTRY_ICON_PRIMARY:
@@ -242,6 +245,10 @@ class AlbumTypeEditorWidget(ComboBoxEditorWidget):
                     self.widget.set_active(i)
                     break
 
+    def showMultiple(self):
+        with self._onChangeInactive():
+            self.widget.set_active(-1)
+
     def set(self, audio_file, value) -> bool:
         changed = False
 
@@ -254,11 +261,7 @@ class AlbumTypeEditorWidget(ComboBoxEditorWidget):
 
     def _onChanged(self, widget):
         if self._on_change_active and self._editor_ctl.current_edit:
-            album_type = self.widget.get_active_text()
-            if self.set(self._editor_ctl.current_edit, album_type):
-                log.debug("Setting tag_dirty5")
-                self._editor_ctl.current_edit.is_dirty = True
-                self.emit("tag-changed")
+            self._applyEdit(self.widget.get_active_text())
 
 
 class GenreEditorWidget(ComboBoxEditorWidget):
@@ -270,6 +273,30 @@ class GenreEditorWidget(ComboBoxEditorWidget):
             self.widget.set_wrap_width(5)
             self.widget.set_entry_text_column(0)
 
+            # Typeahead, matched with the genre registry's completion index
+            self._completion_key, self._completion_ids = None, set()
+            completion = Gtk.EntryCompletion(model=_id3_v2_genre_model)
+            completion.set_text_column(0)
+            completion.set_match_func(self._completionMatch)
+            entry = self.widget.get_child()
+            entry.set_completion(completion)
+            # Typed custom genres are registered once done with, not per keystroke
+            entry.connect("focus-out-event", self._onEntryFocusOut)
+
+    def _completionMatch(self, completion, key, tree_iter):
+        if key != self._completion_key:
+            self._completion_key = key
+            self._completion_ids = {str(gid) for gid in GENRES.complete(key)}
+        return _id3_v2_genre_model[tree_iter][1] in self._completion_ids
+
+    def _onEntryFocusOut(self, entry, event):
+        name = entry.get_text()
+        if self.widget.get_model() is _id3_v2_genre_model and name.strip() \
+                and name not in GENRES:
+            genre = GENRES.add(name)
+            _id3_v2_genre_model.append([genre.name, str(genre.id)])
+        return False
+
     def _init(self, audio_file):
         tag = audio_file.selected_tag
         assert self._checkVersion(tag.version)
@@ -293,19 +320,25 @@ class GenreEditorWidget(ComboBoxEditorWidget):
                 self.widget.set_active_id(str(tag.genre.id))
             else:
                 if tag.isV2():
-                    # Custom (non-std) genre
-                    try:
-                        gid = str(GENRES.get(tag.genre.name).id)
-                    except KeyError:
-                        genre = GENRES.add(tag.genre.name)
-                        gid = str(genre.id)
-                        self.widget.append(gid, genre.name)
-
-                    self.widget.set_active_id(gid)
+                    # Custom (non-std) genre, unregistered genres are only shown
+                    if tag.genre.name in GENRES:
+                        self.widget.set_active_id(str(GENRES[tag.genre.name]))
+                    else:
+                        self.widget.set_active_id("-1")
+                        self.widget.get_child().set_text(tag.genre.name)
                 else:
                     # No custom for v1.x
                     self.widget.set_active_id("-1")
 
+    def selectionValue(self, tag):
+        # Genre is not hashable
+        return tag.genre.name if tag.genre else None
+
+    def showMultiple(self):
+        with self._onChangeInactive():
+            self.widget.set_active_id("-1")
+        super().showMultiple()
+
     def set(self, audio_file, genre: Genre) -> bool:
         changed = False
         for tag in self._iterTags(audio_file):
@@ -318,19 +351,12 @@ class GenreEditorWidget(ComboBoxEditorWidget):
         if self._on_change_active and self._editor_ctl.current_edit:
             gid = self.widget.get_active_id()
             if gid is not None:
-                try:
-                    genre = GENRES.get(int(gid))
-                except KeyError:
-                    assert gid == "-1" or int(gid) > GENRES.GENRE_ID3V1_MAX
-                    genre = None
+                # Custom genres by name, so they have no id like those read from tags
+                genre = GENRES.genre(GENRES[int(gid)]) if gid != "-1" else None
             else:
-                genre_text = self.widget.get_active_text()
-                genre = Genre(genre_text, genre_map=GENRES) if genre_text else None
+                genre = GENRES.genre(self.widget.get_active_text())
 
-            if self.set(self._editor_ctl.current_edit, genre):
-                log.debug("Setting tag_dirty6")
-                self._editor_ctl.current_edit.is_dirty = True
-                self.emit("tag-changed")
+            self._applyEdit(genre)
 
 
 class TagVersionChoiceWidget(EditorWidget):
@@ -1,6 +1,12 @@
 import logging
-from gi.repository import GObject
+from collections import Counter
+from gi.repository import GObject, GLib
 from eyed3.id3 import ID3_ANY_VERSION, ID3_V1, ID3_V1_1, ID3_V2, ID3_V2_4
+from ..core import getTagValue, setTagValue
+from ..undo import UndoJournal
+from ..config import DEFAULT_EDIT_LOG_FILE
+from ..editlog import EditLog
+from ..transforms import TransformPipeline
 from .common import (
     EntryEditorWidget,
     NumTotalEditorWidget, DateEditorWidget,
@@ -10,6 +16,11 @@ from .common import (
 
 log = logging.getLogger(__name__)
 
+# Group commit interval of the edit log
+EDIT_LOG_COMMIT_MS = 500
+# Quiet period after the last edit before list rows are refreshed, coalesces keystrokes.
+ROW_REFRESH_DELAY_MS = 150
+
 
 class EditorControl(GObject.GObject):
     COMMON_PAGE = 0
@@ -51,6 +62,13 @@ class EditorControl(GObject.GObject):
         self._file_list_ctl = file_list_ctl
         self._current_audio_file = None
 
+        self._pending_row_updates = {}  # AudioFile -> None, an ordered set
+        self._row_refresh_id = None
+
+        self.edit_log = EditLog(DEFAULT_EDIT_LOG_FILE)
+        self._edit_log_flush_id = None
+        self.journal = UndoJournal(on_change=self._onJournalChange)
+
         self._notebook = builder.get_object("editor_notebook")
         # XXX: Disable WIP notebook tabs
         self._notebook.get_nth_page(self.IMAGES_PAGE).hide()
@@ -70,16 +88,42 @@ class EditorControl(GObject.GObject):
             self._editor_widgets[widget_name] = editor_widget
 
     def _onTagChanged(self, *args):
-        log.debug(f"_onTagChanged: {args}")
-        self._file_list_ctl.list_store.updateRow(self._file_list_ctl.current_audio_file)
-        self.emit("tag-changed")
+        # The tags are already modified, refreshing their rows is deferred until editing pauses.
+        for audio_file in self.edit_targets:
+            self._pending_row_updates[audio_file] = None
 
-    def _onTagValueCopy(self, editor_widget, copy_value):
-        for audio_file in self._file_list_ctl.list_store.iterAudioFiles():
-            if editor_widget.set(audio_file, copy_value):
-                log.debug("Setting tag_dirty1")
-                audio_file.is_dirty = True
+        if self._row_refresh_id is not None:
+            GLib.source_remove(self._row_refresh_id)
+        self._row_refresh_id = GLib.timeout_add(ROW_REFRESH_DELAY_MS, self.flushRowUpdates)
+
+    def flushRowUpdates(self):
+        """Refresh the list rows of files edited since the last refresh."""
+        if self._row_refresh_id is not None:
+            GLib.source_remove(self._row_refresh_id)
+            self._row_refresh_id = None
+
+        if self._pending_row_updates:
+            audio_files = list(self._pending_row_updates)
+            self._pending_row_updates.clear()
+
+            for audio_file in audio_files:
                 self._file_list_ctl.list_store.updateRow(audio_file)
+            log.debug(f"Tags edited: {len(audio_files)} file(s)")
+            self.emit("tag-changed")
+
+        # Not repeated (i.e. GLib.SOURCE_REMOVE), the next edit reschedules it.
+        return False
+
+    def _onTagValueCopy(self, editor_widget, copy_value):
+        list_store = self._file_list_ctl.list_store
+
+        # Copy to the files grouped with the current edit
+        with self.journal.transaction():
+            for audio_file in list_store.groups.group(self.current_edit):
+                if editor_widget.apply(audio_file, copy_value):
+                    log.debug("Setting tag_dirty1")
+                    audio_file.is_dirty = True
+                    list_store.updateRow(audio_file)
 
         # Update current edit
         self.edit(self.current_edit)
@@ -87,31 +131,113 @@ class EditorControl(GObject.GObject):
     def _onTagValueIncrement(self, editor_widget):
         track_num_entry = self._editor_widgets["tag_track_num_entry"]
         track_total_entry = self._editor_widgets["tag_track_total_entry"]
+        list_store = self._file_list_ctl.list_store
 
-        if editor_widget == track_num_entry:
-            # Track number -> 1, 2, 3, ...
-            i = 1
-            for audio_file in self._file_list_ctl.list_store.iterAudioFiles():
-                if editor_widget.set(audio_file, str(i)):
-                    log.debug("Setting tag_dirty2")
-                    audio_file.is_dirty = True
-                    self._file_list_ctl.list_store.updateRow(audio_file)
-                i += 1
-        elif editor_widget == track_total_entry:
-            # Track total -> len(audio_files) ...
-            all_files = list(self._file_list_ctl.list_store.iterAudioFiles())
-            file_count = len(all_files)
-            for audio_file in self._file_list_ctl.list_store.iterAudioFiles():
-                # No second_v1_tag supported needed for totals
-                if editor_widget.set(audio_file, str(file_count)):
-                    log.debug("Setting tag_dirty3")
+        # One pass over all groups, each group numbered in list order.
+        with self.journal.transaction():
+            for group in list_store.groups.iterGroups(sort_key=list_store.indexOf):
+                if editor_widget == track_num_entry:
+                    # Track number -> 1, 2, 3, ...
+                    values = [str(i) for i in range(1, len(group) + 1)]
+                elif editor_widget == track_total_entry:
+                    # Track total -> len(group) ...
+                    # No second_v1_tag supported needed for totals
+                    values = [str(len(group))] * len(group)
+                else:
+                    break
+
+                for audio_file, value in zip(group, values):
+                    if editor_widget.apply(audio_file, value):
+                        log.debug("Setting tag_dirty2")
+                        audio_file.is_dirty = True
+                        list_store.updateRow(audio_file)
+
+        # Update current edit
+        self.edit(self.current_edit)
+
+    def _onJournalChange(self, audio_file, slot, field, value):
+        self.edit_log.append(audio_file, slot, field, value)
+        if self._edit_log_flush_id is None:
+            self._edit_log_flush_id = GLib.timeout_add(EDIT_LOG_COMMIT_MS, self.flushEditLog)
+
+    def flushEditLog(self):
+        if self._edit_log_flush_id is not None:
+            GLib.source_remove(self._edit_log_flush_id)
+            self._edit_log_flush_id = None
+
+        try:
+            self.edit_log.flush()
+        except OSError as ex:
+            log.error(f"Edit log write error: {ex}")
+
+        # Not repeated (i.e. GLib.SOURCE_REMOVE), the next edit reschedules it.
+        return False
+
+    def recoverEdits(self, audio_files):
+        """Reapply the unsaved edits of `audio_files` found in the edit log."""
+        num_edits, num_files = 0, 0
+        with self.journal.transaction():
+            for audio_file in audio_files:
+                recovered = False
+                for slot, field, value in self.edit_log.recoveredEdits(audio_file):
+                    tag = getattr(audio_file, slot)
+                    if tag is None:
+                        continue
+
+                    old_value = getTagValue(tag, field)
+                    if old_value != value:
+                        setTagValue(tag, field, value)
+                        self.journal.record(audio_file, tag, field, old_value, value)
+                        recovered = True
+                        num_edits += 1
+
+                if recovered:
                     audio_file.is_dirty = True
                     self._file_list_ctl.list_store.updateRow(audio_file)
+                    num_files += 1
+
+        if num_edits:
+            log.warning(f"Recovered {num_edits} unsaved edit(s) of {num_files} file(s)")
+            if self.current_edit:
+                self.edit(self.current_edit, disable_change_signal=True)
+            self.emit("tag-changed")
+
+    def applyTransformChanges(self, changes) -> list:
+        """Apply previewed transform changes as one undoable edit. Returns the renames."""
+        with self.journal.transaction():
+            renames = TransformPipeline.apply(changes, journal=self.journal)
+
+        for audio_file in {c.audio_file: None for c in changes}:
+            self._file_list_ctl.list_store.updateRow(audio_file)
+
+        if self.current_edit:
+            self.edit(self.current_edit, disable_change_signal=True)
+        self.emit("tag-changed")
+
+        return renames
+
+    def undo(self):
+        self._onJournalApplied(self.journal.undo())
+
+    def redo(self):
+        self._onJournalApplied(self.journal.redo())
+
+    def _onJournalApplied(self, changes):
+        if not changes:
+            return
+
+        # Each file once, no matter how many of its fields changed.
+        for audio_file in {c.audio_file: None for c in changes}:
+            self._file_list_ctl.list_store.updateRow(audio_file)
 
         # Update current edit
-        self.edit(self.current_edit)
+        self.edit(self.current_edit, disable_change_signal=True)
+        self.emit("tag-changed")
 
     def edit(self, audio_file, tag=None, disable_change_signal=False):
+        # Rows of the previous edit first.
+        self.flushRowUpdates()
+
         self._current_audio_file = audio_file
         tag1 = audio_file.tag if audio_file else None
         tag2 = audio_file.second_v1_tag if audio_file else None
@@ -141,12 +267,42 @@ class EditorControl(GObject.GObject):
             except Exception as ex:
                 log.exception(ex)
 
+        if len(self.edit_targets) > 1:
+            for widget, values in self.selectionValues().items():
+                if len(values) > 1 and widget.widget.get_sensitive():
+                    widget.showMultiple()
+
         self.file_list_ctl.list_store.updateRow(audio_file)
 
+    def selectionValues(self) -> dict:
+        """Histograms of the values of the selected files, EditorWidget -> Counter, counted in
+        one pass over the selection. The tags are those of the current edit's version."""
+        widgets = [w for w in self._editor_widgets.values() if w.field]
+        values = {w: Counter() for w in widgets}
+        use_v1 = bool(self.current_edit.selected_tag
+                      and self.current_edit.selected_tag is self.current_edit.second_v1_tag)
+
+        for audio_file in self.edit_targets:
+            tag = (audio_file.second_v1_tag if use_v1 else None) or audio_file.tag
+            if tag is None:
+                continue
+            for widget in widgets:
+                values[widget][widget.selectionValue(tag)] += 1
+        return values
+
     @property
     def current_edit(self):
         return self._current_audio_file
 
+    @property
+    def edit_targets(self) -> list:
+        """The files edits apply to: the selection when it includes the current edit, else the
+        current edit."""
+        selected = self._file_list_ctl.selected_audio_files
+        if len(selected) > 1 and self._current_audio_file in selected:
+            return selected
+        return [self._current_audio_file] if self._current_audio_file else []
+
     @property
     def file_list_ctl(self):
         return self._file_list_ctl
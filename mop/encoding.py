@@ -0,0 +1,115 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from eyed3.id3 import (
+    Tag, ID3_V2, LATIN1_ENCODING, UTF_8_ENCODING, UTF_16_ENCODING, UTF_16BE_ENCODING
+)
+from .merge import lockFile
+from .memory import peekTags
+from .storage import LocalStorage, ReadAheadFile, isLocal, localCopy
+
+log = logging.getLogger(__name__)
+
+__all__ = ["targetEncoding", "framesToEncode", "normalizeEncoding", "scanEncodings",
+           "normalizeFiles", "ENCODING_NAMES"]
+
+ENCODING_NAMES = {
+    LATIN1_ENCODING: "latin1",
+    UTF_8_ENCODING: "utf8",
+    UTF_16_ENCODING: "utf16",
+    UTF_16BE_ENCODING: "utf16be",
+}
+
+
+def targetEncoding(encoding: bytes, version) -> bytes:
+    """The encoding an ID3 `version` tag can actually be written with, UTF-8 requires v2.4."""
+    if encoding == UTF_8_ENCODING and version[:2] < (2, 4):
+        return UTF_16_ENCODING
+    return encoding
+
+
+def framesToEncode(tag, encoding: bytes, version=None) -> list:
+    """The frames of `tag` not already using `encoding`, when written as `version` (the tag's
+    own version by default)."""
+    if not tag.isV2():
+        return []
+
+    encoding = targetEncoding(encoding, version or tag.version)
+    return [frame for frame_list in tag.frame_set.values() for frame in frame_list
+            if getattr(frame, "encoding", encoding) != encoding]
+
+
+def normalizeEncoding(tag, encoding: bytes, version=None) -> int:
+    """Set the encoding of the frames of `tag` that differ, returns the number changed."""
+    frames = framesToEncode(tag, encoding, version=version)
+    target = targetEncoding(encoding, version or tag.version)
+    for frame in frames:
+        frame.encoding = target
+    return len(frames)
+
+
+def scanEncodings(audio_files, encoding: bytes) -> dict:
+    """Which files would change, AudioFile -> number of frames. Nothing is modified.
+
+    The check runs on the loaded tags, no file is read.
+    """
+    changes = {}
+    for audio_file in audio_files:
+        tag = peekTags(audio_file)[0]
+        if tag and (n := len(framesToEncode(tag, encoding))):
+            changes[audio_file] = n
+    return changes
+
+
+def _normalizeFile(args):
+    """Parse, normalize, and save the tag of one file, as saves do: locked, reading the tag as
+    it is now (so changes made by other programs are kept), written through the file's storage.
+    Also a process pool worker, for local files."""
+    path, encoding, storage = args
+    storage = storage or LocalStorage()
+    try:
+        with lockFile(path, storage=storage):
+            tag = Tag()
+            with ReadAheadFile(storage, path, storage.stat(path).st_size) as file_obj:
+                if not tag.parse(file_obj, version=ID3_V2):
+                    return path, 0
+
+            n = normalizeEncoding(tag, encoding)
+            if n:
+                with localCopy(storage, path) as local_path:
+                    tag.file_info.name = str(local_path)
+                    tag.save(version=tag.version)
+        return path, n
+    except Exception as ex:
+        # Exceptions may not pickle, the message will.
+        return path, f"{type(ex).__name__}: {ex}"
+
+
+def normalizeFiles(audio_files, encoding: bytes, max_workers=None, chunksize=32) -> dict:
+    """Normalize and save the tags of `audio_files`, each parsed again from its file. Local
+    files are done across a process pool, others (see mop.storage.isLocal) in this thread. Only
+    use for files without unsaved edits, and not from the UI thread.
+
+    Returns path -> number of frames changed, or an error message if the file failed.
+    """
+    local_args, other_args = [], []
+    for audio_file in audio_files:
+        if isLocal(audio_file.storage):
+            local_args.append((str(audio_file.path), encoding, None))
+        else:
+            other_args.append((str(audio_file.path), encoding, audio_file.storage))
+
+    def results():
+        if local_args:
+            # Spawned, forking a process with GTK running is not safe.
+            mp_context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+                yield from executor.map(_normalizeFile, local_args, chunksize=chunksize)
+        yield from map(_normalizeFile, other_args)
+
+    normalized = {}
+    for path, result in results():
+        if isinstance(result, str):
+            log.error(f"Encoding normalization error, {path}: {result}")
+        normalized[path] = result
+    return normalized
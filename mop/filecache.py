@@ -0,0 +1,60 @@
+import os
+import json
+import logging
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+__all__ = ["FileCache"]
+
+
+class FileCache:
+    """Persistent cache of values computed from file contents, e.g. audio hashes.
+
+    Values are keyed by path and only returned while the file's (mtime, size) still match
+    those it was computed for. Values must be JSON compatible, the cache is a JSON file
+    written by `save`, only if something changed.
+    """
+    def __init__(self, filename):
+        self._path = Path(filename)
+        self._entries = {}  # path -> [mtime_ns, size, value]
+        self._modified = False
+
+        if self._path.exists():
+            try:
+                self._entries = json.loads(self._path.read_text(encoding="utf8"))
+            except ValueError as ex:
+                log.warning(f"Discarding invalid cache {self._path}: {ex}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _stamp(stat_result):
+        return [stat_result.st_mtime_ns, stat_result.st_size]
+
+    def get(self, path, stat_result=None, default=None):
+        """The cached value for `path`, or `default` if there is none or the file changed.
+        `stat_result` is the file's current stat, when the caller has it."""
+        entry = self._entries.get(str(path))
+        if entry is None:
+            return default
+
+        stat_result = stat_result or os.stat(path)
+        return entry[2] if entry[:2] == self._stamp(stat_result) else default
+
+    def set(self, path, stat_result, value):
+        self._entries[str(path)] = self._stamp(stat_result) + [value]
+        self._modified = True
+
+    def save(self):
+        if not self._modified:
+            return
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._entries), encoding="utf8")
+        os.replace(tmp_path, self._path)
+
+        self._modified = False
+        log.debug(f"Saved {len(self._entries)} cache entries to {self._path}")
@@ -1,10 +1,39 @@
+import re
 import logging
+import threading
 from pathlib import Path
-from gi.repository import GObject, Gtk, Pango
+from gi.repository import GLib, GObject, Gtk, Pango
 from eyed3.core import AudioFile
+from .config import getConfig
+from .groups import GroupIndex
+from .search import SearchIndex
+from .mpeg import accurateDurations
 
 log = logging.getLogger(__name__)
 
+_SORT_ARTICLES = ("the ", "a ", "an ")
+_SORT_NUMBER_RE = re.compile(r"\d+")
+
+
+def makeSortKey(s) -> str:
+    """Normalized string sort key: casefolded, leading article stripped, and numbers zero-padded
+    so they order numerically."""
+    if not s:
+        return ""
+
+    key = " ".join(str(s).casefold().split())
+    for article in _SORT_ARTICLES:
+        if key.startswith(article) and len(key) > len(article):
+            key = key[len(article):]
+            break
+    return _SORT_NUMBER_RE.sub(lambda m: m.group().zfill(10), key)
+
+
+def makeTrackSortKey(tag) -> int:
+    """Disc and track number packed into an int, so the Track column orders numerically."""
+    disc, track = (tag.disc_num[0] if tag.isV2() else None), tag.track_num[0]
+    return (min(disc or 0, 0x7fff) << 16) | min(track or 0, 0xffff)
+
 
 class AudioFileListStore:
     # Column indexes
@@ -14,6 +43,18 @@ class AudioFileListStore:
     ARTIST = 3
     ALBUM = 4
     TEXT_WEIGHT = 5
+    FILENAME_SORT_KEY = 6
+    TRACK_NUM_SORT_KEY = 7
+    TITLE_SORT_KEY = 8
+    ARTIST_SORT_KEY = 9
+    ALBUM_SORT_KEY = 10
+    DUPLICATE = 11
+    DUPLICATE_SORT_KEY = 12
+    STREAM = 13
+    VISIBLE = 14
+
+    # Duplicate sort key of files without duplicates, after all groups
+    NO_DUPLICATE = 0x7fffffff
 
     model_map = {
         FILENAME: ("Filename", str),
@@ -22,21 +63,61 @@ class AudioFileListStore:
         ARTIST: ("Artist", str),
         ALBUM: ("Album", str),
         TEXT_WEIGHT: ("__text_weight__", int),
+        FILENAME_SORT_KEY: ("__filename_sort_key__", str),
+        TRACK_NUM_SORT_KEY: ("__track_num_sort_key__", int),
+        TITLE_SORT_KEY: ("__title_sort_key__", str),
+        ARTIST_SORT_KEY: ("__artist_sort_key__", str),
+        ALBUM_SORT_KEY: ("__album_sort_key__", str),
+        DUPLICATE: ("Duplicate", str),
+        DUPLICATE_SORT_KEY: ("__duplicate_sort_key__", int),
+        STREAM: ("Stream", str),
+        VISIBLE: ("__visible__", bool),
+    }
+
+    # Display column -> column of its precomputed sort key
+    sort_map = {
+        FILENAME: FILENAME_SORT_KEY,
+        TRACK_NUM: TRACK_NUM_SORT_KEY,
+        TITLE: TITLE_SORT_KEY,
+        ARTIST: ARTIST_SORT_KEY,
+        ALBUM: ALBUM_SORT_KEY,
+        DUPLICATE: DUPLICATE_SORT_KEY,
+        STREAM: STREAM,
     }
 
-    def __init__(self):
+    def __init__(self, group_by=None):
         self._audio_files = {}  # Relies on py3.7 ordered dict.
+        self._row_indexes = {}  # Path -> list store index, the two dicts share key order.
         self._list_store = Gtk.ListStore(*(spec[1] for spec in self.model_map.values()))
 
+        self._search_index = SearchIndex()
+        self._search_matches = None  # None is "all rows"
+        self.groups = GroupIndex(group_by)
+
+        # Filtering is done by the visible column, so GTK never calls back into Python for it.
+        self._filter_model = self._list_store.filter_new()
+        self._filter_model.set_visible_column(self.VISIBLE)
+        # No sort functions are set, the hidden key columns are compared by GTK's defaults.
+        self._sort_model = Gtk.TreeModelSort(model=self._filter_model)
+
     @property
     def store(self):
         return self._list_store
 
+    @property
+    def model(self):
+        """The model for views, i.e. the sorted and filtered store."""
+        return self._sort_model
+
     def __len__(self):
         return len(self._list_store)
 
     def clear(self):
         self._audio_files.clear()
+        self._row_indexes.clear()
+        self._search_index.clear()
+        self._search_matches = None
+        self.groups.clear()
         self._list_store.clear()
 
     @staticmethod
@@ -56,21 +137,114 @@ class AudioFileListStore:
             tag.title if tag else None,
             tag.artist if tag else None,
             tag.album if tag else None,
-            Pango.Weight.BOOK if not dirty else Pango.Weight.BOLD
+            Pango.Weight.BOOK if not dirty else Pango.Weight.BOLD,
+            # Sort keys
+            makeSortKey(path.name),
+            makeTrackSortKey(tag) if tag else 0,
+            makeSortKey(tag.title if tag else None),
+            makeSortKey(tag.artist if tag else None),
+            makeSortKey(tag.album if tag else None),
+        ]
+
+    @staticmethod
+    def makeSearchFields(audio_file):
+        tag = audio_file.selected_tag or audio_file.tag
+        return [
+            Path(audio_file.path).name,
+            tag.title if tag else None,
+            tag.artist if tag else None,
+            tag.album if tag else None,
         ]
 
     def updateRow(self, audio_file):
         row = self.getRow(audio_file)
+        # Visibility, duplicates, and stream status are left as is, an edit does not hide the
+        # row being edited.
         for i, r in enumerate(self.makeRow(audio_file)):
             row[i] = r
+        self._search_index.update(row.path[0], self.makeSearchFields(audio_file))
+        self.groups.update(audio_file)
 
     def append(self, audio_file):
         path = Path(audio_file.path)
         if path in self._audio_files:
             raise ValueError(f"Duplicate AudioFile error: {path}")
 
+        index = len(self._list_store)
         self._audio_files[path] = audio_file
-        self._list_store.append(self.makeRow(audio_file))
+        self._row_indexes[path] = index
+        self._search_index.update(index, self.makeSearchFields(audio_file))
+        self.groups.update(audio_file)
+
+        visible = self._search_matches is None or index in self._search_matches
+        self._list_store.append(self.makeRow(audio_file) + ["", self.NO_DUPLICATE, "", visible])
+
+    def setDuplicates(self, groups: list):
+        """Number the rows of each group of duplicate files (lists of AudioFile), the rows of
+        other files are cleared."""
+        for row in self._list_store:
+            row[self.DUPLICATE], row[self.DUPLICATE_SORT_KEY] = "", self.NO_DUPLICATE
+
+        for n, group in enumerate(groups, 1):
+            for audio_file in group:
+                row = self.getRow(audio_file)
+                row[self.DUPLICATE], row[self.DUPLICATE_SORT_KEY] = f"#{n} of {len(group)}", n
+
+    def rename(self, renames: dict):
+        """Re-key files that were moved, `renames` maps AudioFile to its new path. The rows
+        keep their place in the list."""
+        for audio_file, new_path in renames.items():
+            new_path = Path(new_path)
+            if new_path in self._audio_files:
+                raise ValueError(f"Duplicate AudioFile error: {new_path}")
+
+            self.groups.remove(audio_file)
+            audio_file.path = str(new_path)
+            # Evicted tags are parsed again with the new path
+            tags = getattr(audio_file, "resident_tags", None) or (audio_file.tag,
+                                                                  audio_file.second_v1_tag)
+            for tag in tags:
+                if tag is not None and tag.file_info is not None:
+                    tag.file_info.name = str(new_path)
+
+        # Rebuilt once, keeping the (list) order.
+        self._audio_files = {Path(af.path): af for af in self._audio_files.values()}
+        self._row_indexes = {path: i for i, path in enumerate(self._audio_files)}
+
+        for audio_file in renames:
+            self.updateRow(audio_file)
+
+    def filter(self, query: str):
+        """Show only the rows matching `query`, an empty query shows all rows."""
+        matches = self._search_index.search(query)
+        prev_matches = self._search_matches
+        self._search_matches = matches
+
+        # Only rows whose visibility changed are touched.
+        if matches is None and prev_matches is None:
+            return
+        elif matches is None:
+            changed = set(range(len(self._list_store))) - prev_matches
+        elif prev_matches is None:
+            changed = set(range(len(self._list_store))) - matches
+        else:
+            changed = matches ^ prev_matches
+
+        log.debug(f"Filter '{query}': {len(changed)} row(s) changed")
+        for index in changed:
+            self._list_store[index][self.VISIBLE] = matches is None or index in matches
+
+    def viewPathToIndex(self, view_path) -> int:
+        """Convert a path of `model` to a store index."""
+        filter_path = self._sort_model.convert_path_to_child_path(view_path)
+        return self._filter_model.convert_path_to_child_path(filter_path)[0]
+
+    def indexToViewPath(self, index):
+        """Convert a store index to a path of `model`, None if the row is filtered out."""
+        filter_path = self._filter_model.convert_child_path_to_path(Gtk.TreePath(index))
+        if filter_path is None:
+            return None
+        return self._sort_model.convert_child_path_to_path(filter_path)
 
     def getRow(self, key):
         """`key` may be index, path, or AudioFile"""
@@ -82,7 +256,10 @@ class AudioFileListStore:
         else:
             if isinstance(key, AudioFile):
                 key = key.path
-            return self._list_store[list(self._audio_files.keys()).index(Path(key))]
+            return self._list_store[self._row_indexes[Path(key)]]
+
+    def indexOf(self, audio_file) -> int:
+        return self._row_indexes[Path(audio_file.path)]
 
     def getAudioFile(self, key):
         """`key` may be index, path, or AudioFile"""
@@ -96,6 +273,11 @@ class AudioFileListStore:
                 key = key.path
             return self._audio_files[Path(key)]
 
+    def getAudioFiles(self, indexes) -> list:
+        """The AudioFile of each of `indexes`."""
+        audio_files = list(self._audio_files.values())
+        return [audio_files[i] for i in indexes]
+
     def iterAudioFiles(self):
         for f in self._audio_files.values():
             yield f
@@ -107,12 +289,15 @@ class AudioFileListStore:
 
 class FileListControl(GObject.GObject):
     __gsignals__ = {
-        "current-edit-changed": (GObject.SIGNAL_RUN_LAST, None, [])
+        "current-edit-changed": (GObject.SIGNAL_RUN_LAST, None, []),
+        # Times were updated, e.g. to accurate durations (see total_time_secs)
+        "durations-changed": (GObject.SIGNAL_RUN_LAST, None, []),
     }
 
-    def __init__(self, tree_view):
+    def __init__(self, tree_view, search_entry=None):
         super().__init__()
 
+        self._columns = {}
         for i, (title, type_) in AudioFileListStore.model_map.items():
             if title.startswith("_"):
                 continue
@@ -120,16 +305,28 @@ class FileListControl(GObject.GObject):
             cell_renderer = Gtk.CellRendererText()
             column = Gtk.TreeViewColumn(title, cell_renderer, text=i)
             column.add_attribute(cell_renderer, 'weight', AudioFileListStore.TEXT_WEIGHT)
+            if i in AudioFileListStore.sort_map:
+                column.set_sort_column_id(AudioFileListStore.sort_map[i])
             tree_view.append_column(column)
+            self._columns[i] = column
+        # Shown once duplicates are searched for, or streams are verified
+        self._columns[AudioFileListStore.DUPLICATE].set_visible(False)
+        self._columns[AudioFileListStore.STREAM].set_visible(False)
 
         select = tree_view.get_selection()
         select.connect("changed", self._onSelectionChanged)
         self.tree_view = tree_view
 
-        self.list_store = AudioFileListStore()
+        if search_entry is not None:
+            search_entry.connect("search-changed", self._onSearchChanged)
+        self.search_entry = search_entry
+
+        self.list_store = AudioFileListStore(group_by=getConfig().group_by)
         self._current = dict(index=None, audio_file=None)
+        self._selected = []
         self.total_size_bytes = 0
         self.total_time_secs = 0
+        self._durations_scan = None
 
     @property
     def current_audio_file(self):
@@ -139,6 +336,11 @@ class FileListControl(GObject.GObject):
     def current_index(self):
         return self._current["index"]
 
+    @property
+    def selected_audio_files(self) -> list:
+        """The selected files, in list order. The current file is one of them, if any are."""
+        return self._selected
+
     @property
     def is_dirty(self):
         for _ in self.dirty_files:
@@ -155,13 +357,22 @@ class FileListControl(GObject.GObject):
         self.total_size_bytes, self.total_time_secs = 0, 0
 
         self.list_store.clear()
-        self.tree_view.set_model(self.list_store.store)
+        if self.search_entry is not None:
+            self.search_entry.set_text("")
+        self.tree_view.set_model(self.list_store.model)
+        self._columns[AudioFileListStore.DUPLICATE].set_visible(False)
+        self._columns[AudioFileListStore.STREAM].set_visible(False)
 
         for audio_file in audio_files:
             self.list_store.append(audio_file)
             self.total_size_bytes += audio_file.info.size_bytes
             self.total_time_secs += audio_file.info.time_secs
 
+        # Header estimates until then
+        self._durations_scan = None
+        if getConfig().accurate_durations:
+            self._scanDurations(audio_files)
+
         # Size widget according to # audio_files
         n, w, h = len(audio_files), -1, 50
 
@@ -171,14 +382,84 @@ class FileListControl(GObject.GObject):
         # Select first row
         self.tree_view.set_cursor(0)
 
+    def _scanDurations(self, audio_files: list):
+        """Count the frames of files with estimated durations in the background, then update
+        their times and the total (see _applyDurations)."""
+        scan = self._durations_scan = object()
+
+        def accurate():
+            try:
+                durations = accurateDurations(audio_files)
+            except Exception as ex:
+                log.exception(f"Duration scan failed: {ex}")
+                return
+            GLib.idle_add(self._applyDurations, scan, durations)
+
+        threading.Thread(target=accurate, name="durations", daemon=True).start()
+
+    def _applyDurations(self, scan, durations: dict):
+        if scan is not self._durations_scan:
+            # The files were replaced meanwhile
+            return False
+
+        # The file's own time is replaced too, so it agrees with the total.
+        for audio_file, time_secs in durations.items():
+            self.total_time_secs += time_secs - audio_file.info.time_secs
+            audio_file.info.time_secs = time_secs
+        log.debug(f"Accurate durations of {len(durations)} file(s)")
+
+        self._durations_scan = None
+        if durations:
+            self.emit("durations-changed")
+        return False
+
+    def showDuplicates(self, groups: list):
+        """Mark the groups of duplicate files, and sort the list so each group is together."""
+        self.list_store.setDuplicates(groups)
+        self._columns[AudioFileListStore.DUPLICATE].set_visible(bool(groups))
+        if groups:
+            self.list_store.model.set_sort_column_id(AudioFileListStore.DUPLICATE_SORT_KEY,
+                                                     Gtk.SortType.ASCENDING)
+
+        if self.current_index is not None:
+            view_path = self.list_store.indexToViewPath(self.current_index)
+            if view_path is not None:
+                self.tree_view.scroll_to_cell(view_path, None, False, 0, 0)
+
+    def showStreamStatus(self, path, status: str):
+        """Show a file's stream verification `status`, files no longer listed are ignored."""
+        try:
+            row = self.list_store.getRow(path)
+        except KeyError:
+            return
+        row[AudioFileListStore.STREAM] = status
+        self._columns[AudioFileListStore.STREAM].set_visible(True)
+
     def _onSelectionChanged(self, selection):
         self._current["index"] = None
         self._current["audio_file"] = None
 
-        model, tree_iter = selection.get_selected()
-        if tree_iter is not None:
-            self._current["index"] = selection.get_selected_rows()[1][0][0]
-            self._current["audio_file"] = self.list_store.getAudioFile(self._current["index"])
-
-        log.debug(f"File selection: {self._current}")
+        _, view_paths = selection.get_selected_rows()
+        indexes = [self.list_store.viewPathToIndex(p) for p in view_paths]
+        self._selected = self.list_store.getAudioFiles(indexes)
+        if indexes:
+            # The row with the cursor, when it is selected, else the first selected.
+            cursor_path, _ = self.tree_view.get_cursor()
+            i = 0
+            if cursor_path is not None and selection.path_is_selected(cursor_path):
+                i = indexes.index(self.list_store.viewPathToIndex(cursor_path))
+            self._current["index"] = indexes[i]
+            self._current["audio_file"] = self._selected[i]
+
+        log.debug(f"File selection: {self._current}, {len(self._selected)} selected")
         self.emit("current-edit-changed")
+
+    def _onSearchChanged(self, search_entry):
+        self.list_store.filter(search_entry.get_text())
+
+        # Keep the current edit selected, when it is still visible.
+        if self.current_index is not None:
+            view_path = self.list_store.indexToViewPath(self.current_index)
+            if view_path is not None:
+                self.tree_view.get_selection().select_path(view_path)
+                self.tree_view.scroll_to_cell(view_path, None, False, 0, 0)
@@ -0,0 +1,88 @@
+import logging
+from pathlib import Path
+from collections import defaultdict
+from .memory import peekTags
+
+log = logging.getLogger(__name__)
+
+__all__ = ["GroupIndex"]
+
+
+class GroupIndex:
+    """Groups audio files by directory, album, or album disc.
+
+    Memberships are maintained incrementally as files are added and edited, so per group
+    operations never need to rescan the whole list to find a file's siblings.
+    """
+    NONE = "none"
+    DIRECTORY = "directory"
+    ALBUM = "album"
+    DISC = "disc"
+    GROUP_BY_CHOICES = (NONE, DIRECTORY, ALBUM, DISC)
+
+    def __init__(self, group_by=None):
+        group_by = group_by or self.DIRECTORY
+        if group_by not in self.GROUP_BY_CHOICES:
+            raise ValueError(f"Invalid group_by value: {group_by}")
+        self.group_by = group_by
+
+        self._groups = defaultdict(dict)  # group key -> {Path: AudioFile}
+        self._keys = {}                   # Path -> group key
+
+    def __len__(self):
+        return len(self._groups)
+
+    def clear(self):
+        self._groups.clear()
+        self._keys.clear()
+
+    def groupKey(self, audio_file):
+        tag = peekTags(audio_file)[0]
+
+        def norm(s):
+            return " ".join(s.casefold().split()) if s else ""
+
+        if self.group_by == self.NONE:
+            return None
+        elif self.group_by == self.DIRECTORY:
+            return Path(audio_file.path).parent
+        elif self.group_by == self.ALBUM:
+            return (norm(tag.album_artist) if tag and tag.isV2() else "",
+                    norm(tag.album) if tag else "")
+        else:
+            return (norm(tag.album_artist) if tag and tag.isV2() else "",
+                    norm(tag.album) if tag else "",
+                    tag.disc_num[0] if tag and tag.isV2() else None)
+
+    def update(self, audio_file):
+        """Add `audio_file`, or move it to another group if its key changed."""
+        path = Path(audio_file.path)
+        key = self.groupKey(audio_file)
+        prev_key = self._keys.get(path, key)
+
+        if prev_key != key:
+            self._discard(path, prev_key)
+        self._groups[key][path] = audio_file
+        self._keys[path] = key
+
+    def remove(self, audio_file):
+        path = Path(audio_file.path)
+        if path in self._keys:
+            self._discard(path, self._keys.pop(path))
+
+    def _discard(self, path, key):
+        group = self._groups[key]
+        del group[path]
+        if not group:
+            del self._groups[key]
+
+    def group(self, audio_file, sort_key=None) -> list:
+        """The files grouped with `audio_file`, itself included."""
+        key = self._keys[Path(audio_file.path)]
+        return sorted(self._groups[key].values(), key=sort_key) if sort_key \
+                else list(self._groups[key].values())
+
+    def iterGroups(self, sort_key=None):
+        """Yields each group as a list of audio files, optionally sorted by `sort_key`."""
+        for group in list(self._groups.values()):
+            yield sorted(group.values(), key=sort_key) if sort_key else list(group.values())
@@ -0,0 +1,115 @@
+import logging
+import struct
+from typing import Optional
+from eyed3.id3 import Tag, ID3_V1_0, ID3_V1_1
+from eyed3.id3.tag import FileInfo, TagHeader, ID3_V1_STRIP_CHARS, ID3_V1_COMMENT_DESC
+from .editlog import fileStamp
+
+log = logging.getLogger(__name__)
+
+__all__ = ["V1_TAG_SIZE", "parseV1Tag", "renderV1Tag", "saveV1Tag"]
+
+# "TAG", title, artist, album, year, comment (v1.1: 28 bytes, 0, track), genre id
+_V1_TAG = struct.Struct("3s30s30s30s4s30sB")
+V1_TAG_SIZE = _V1_TAG.size
+_V1_ENCODING = "latin1"
+# Genre written for tags without one
+_V1_OTHER_GENRE = 12
+
+
+def _text(data: bytes) -> Optional[str]:
+    data = data.strip(ID3_V1_STRIP_CHARS)
+    return str(data, _V1_ENCODING) if data else None
+
+
+def parseV1Tag(data: bytes, file_name) -> Optional[Tag]:
+    """The ID3 v1 tag of `data`, the last 128 bytes of file `file_name`, or None if there is
+    none. The same tag as eyeD3's parse (Tag.parse with ID3_V1), without its file reads."""
+    if len(data) != V1_TAG_SIZE:
+        return None
+    marker, title, artist, album, year, comment, genre = _V1_TAG.unpack(data)
+    if marker != b"TAG":
+        return None
+
+    tag = Tag()
+    tag.file_info = FileInfo(file_name)
+    # As Tag.parse sets it, for v1 tags too
+    tag.file_info.tag_size = TagHeader.SIZE + tag.header.tag_size
+    tag.version = ID3_V1_0
+
+    # Only the fields with a value are set, as eyeD3 does
+    for name, data in (("title", title), ("artist", artist), ("album", album)):
+        if text := _text(data):
+            setattr(tag, name, text)
+    year = year.strip(ID3_V1_STRIP_CHARS)
+    try:
+        if year and int(year):
+            tag.release_date = int(year)
+    except ValueError:
+        log.warning(f"ID3 v1 tag with an invalid year: {year}")
+
+    comment = comment.rstrip(b"\x00")
+    if len(comment) >= 2 and comment[-2] == 0:
+        # A track number, v1.1
+        tag.version = ID3_V1_1
+        tag.track_num = (comment[-1], None)
+        comment = comment[:-2].strip(ID3_V1_STRIP_CHARS)
+    if comment:
+        tag.comments.set(str(comment, _V1_ENCODING), ID3_V1_COMMENT_DESC)
+
+    try:
+        tag.genre = genre
+    except ValueError as ex:
+        log.warning(ex)
+        tag.genre = None
+
+    return tag
+
+
+def renderV1Tag(tag, version) -> bytes:
+    """The 128 bytes of `tag` as an ID3 v1 tag of `version`, as eyeD3 saves it."""
+    def encode(text) -> bytes:
+        data = (text or "").encode(_V1_ENCODING, "replace")
+        if len(data) > 30:
+            log.warning("ID3 v1.x text value truncated to length 30")
+        return data
+
+    comment = ""
+    for c in tag.comments:
+        if c.description == ID3_V1_COMMENT_DESC:
+            comment = c.text
+            break
+        elif c.description == "":
+            comment = c.text
+    comment = encode(comment)[:30].ljust(30, b"\x00")
+    if version != ID3_V1_0 and tag.track_num[0] is not None:
+        comment = comment[:28] + bytes([0, int(tag.track_num[0]) & 0xff])
+
+    date = tag.getBestDate()
+    genre = tag.genre.id if tag.genre and tag.genre.id is not None else _V1_OTHER_GENRE
+    return _V1_TAG.pack(b"TAG", encode(tag.title), encode(tag.artist), encode(tag.album),
+                        str(date.year).encode("ascii") if date else b"", comment, genre & 0xff)
+
+
+def saveV1Tag(audio_file, tag, version) -> Tag:
+    """Write `tag` as the ID3 v1 tag of `audio_file`, replacing the one at its end or appended,
+    in a single write. The file is not read, unless it changed since loaded (else whether it has
+    a tag is `has_v1_tag`). Returns the tag as written, parsed (e.g. with text truncated)."""
+    # mop.storage imports this module
+    from .storage import LocalStorage
+
+    storage = audio_file.storage or LocalStorage()
+    stat_result = storage.stat(audio_file.path)
+    data = renderV1Tag(tag, version)
+
+    if fileStamp(stat_result) == fileStamp(audio_file.load_stat):
+        has_tag = audio_file.has_v1_tag
+    else:
+        with storage.open(audio_file.path) as fp:
+            has_tag = (stat_result.st_size >= V1_TAG_SIZE
+                       and storage.readRange(fp, stat_result.st_size - V1_TAG_SIZE, 3) == b"TAG")
+
+    offset = stat_result.st_size - V1_TAG_SIZE if has_tag else stat_result.st_size
+    storage.write(audio_file.path, data, offset)
+    log.debug(f"Wrote ID3 v1 tag at {offset}: {audio_file.path}")
+    return parseV1Tag(data, audio_file.path)
@@ -0,0 +1,152 @@
+import shlex
+import sqlite3
+import logging
+from pathlib import Path
+from .config import DEFAULT_LIBRARY_FILE
+from .memory import peekTags
+
+log = logging.getLogger(__name__)
+
+__all__ = ["LibraryIndex", "parseQuery", "QUERY_FIELDS"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    title TEXT,
+    artist TEXT COLLATE NOCASE,
+    album TEXT COLLATE NOCASE,
+    album_artist TEXT COLLATE NOCASE,
+    genre TEXT COLLATE NOCASE,
+    track_num INTEGER,
+    track_total INTEGER,
+    disc_num INTEGER,
+    disc_total INTEGER,
+    release_date TEXT,
+    time_secs REAL,
+    bit_rate INTEGER,
+    sample_rate INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_artist ON files (artist);
+CREATE INDEX IF NOT EXISTS files_album ON files (album);
+CREATE INDEX IF NOT EXISTS files_genre ON files (genre);
+"""
+
+_COLUMNS = ("path", "mtime_ns", "size", "title", "artist", "album", "album_artist", "genre",
+            "track_num", "track_total", "disc_num", "disc_total", "release_date", "time_secs",
+            "bit_rate", "sample_rate")
+
+# Query field -> column. Fields without a prefix search title, artist, and album.
+QUERY_FIELDS = {
+    "title": "title", "artist": "artist", "album": "album", "album_artist": "album_artist",
+    "genre": "genre", "year": "release_date", "track": "track_num", "disc": "disc_num",
+    "path": "path",
+}
+_TEXT_SEARCH_COLUMNS = ("title", "artist", "album")
+
+
+def parseQuery(query: str) -> tuple:
+    """Parse a query such as "artist:X genre:'Hip Hop' year:1994* word" to a (SQL where clause,
+    parameters) pair. Terms are ANDed. A field term is a case-insensitive equality, which uses
+    the artist, album, and genre indexes, or a LIKE pattern when it contains "*" (year always
+    matches as a prefix). Bare words match any of title, artist, or album. Raises ValueError for
+    non-numeric track and disc values.
+    """
+    clauses, params = [], []
+    for term in shlex.split(query):
+        field, sep, value = term.partition(":")
+        if sep and field in QUERY_FIELDS:
+            column = QUERY_FIELDS[field]
+            if "*" in value or column == "release_date":
+                clauses.append(f"{column} LIKE ?")
+                params.append(value.replace("*", "%") + ("%" if field == "year" else ""))
+            elif column in ("track_num", "disc_num"):
+                clauses.append(f"{column} = ?")
+                params.append(int(value))
+            else:
+                clauses.append(f"{column} = ? COLLATE NOCASE")
+                params.append(value)
+        else:
+            clauses.append("(" + " OR ".join(f"{c} LIKE ?" for c in _TEXT_SEARCH_COLUMNS) + ")")
+            params.extend([f"%{term}%"] * len(_TEXT_SEARCH_COLUMNS))
+
+    return " AND ".join(clauses) or "1", params
+
+
+class LibraryIndex:
+    """Persistent SQLite index of the audio files Mop has loaded: paths, tags, and MPEG info.
+
+    Rows are replaced whenever files are loaded or saved, and follow renames.
+    """
+    def __init__(self, filename=DEFAULT_LIBRARY_FILE):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(filename))
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    @staticmethod
+    def makeRow(audio_file) -> tuple:
+        tag, info = peekTags(audio_file)[0], audio_file.info
+        v2 = tag is not None and tag.isV2()
+        track_num, track_total = tag.track_num if tag else (None, None)
+        disc_num, disc_total = tag.disc_num if v2 else (None, None)
+        stat = audio_file.load_stat
+
+        return (
+            str(audio_file.path), stat.st_mtime_ns, stat.st_size,
+            tag.title if tag else None,
+            tag.artist if tag else None,
+            tag.album if tag else None,
+            tag.album_artist if v2 else None,
+            tag.genre.name if tag and tag.genre else None,
+            track_num, track_total, disc_num, disc_total,
+            str(tag.getBestDate()) if tag and tag.getBestDate() else None,
+            info.time_secs if info else None,
+            info.bit_rate[1] if info else None,
+            info.sample_freq if info else None,
+        )
+
+    def update(self, audio_files):
+        """Add or replace the rows of `audio_files`, in one transaction."""
+        rows = [self.makeRow(af) for af in audio_files]
+        with self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COLUMNS))})", rows
+            )
+        log.debug(f"Library indexed {len(rows)} file(s)")
+
+    def remove(self, paths):
+        with self._db:
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(str(p),) for p in paths])
+
+    def rename(self, renames: dict):
+        """Move the rows of renamed files, `renames` maps old to new paths."""
+        with self._db:
+            self._db.executemany("DELETE FROM files WHERE path = ?",
+                                 [(str(new),) for new in renames.values()])
+            self._db.executemany("UPDATE files SET path = ? WHERE path = ?",
+                                 [(str(new), str(old)) for old, new in renames.items()])
+
+    def query(self, query: str) -> list:
+        """The paths matching `query` (see parseQuery), ordered by album and track. Paths that no
+        longer exist are removed from the index."""
+        where, params = parseQuery(query)
+        rows = self._db.execute(
+            f"SELECT path FROM files WHERE {where} "
+            "ORDER BY album_artist, album, disc_num, track_num, path", params
+        ).fetchall()
+
+        paths = [Path(row[0]) for row in rows]
+        missing = {p for p in paths if not p.exists()}
+        if missing:
+            log.info(f"Removing {len(missing)} missing file(s) from the library")
+            self.remove(missing)
+
+        return [p for p in paths if p not in missing]
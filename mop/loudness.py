@@ -0,0 +1,217 @@
+import json
+import math
+import shutil
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+from collections import namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .config import DEFAULT_LOUDNESS_CACHE_FILE
+from .duplicates import audioHashes
+
+try:
+    import numpy
+    import scipy.signal
+except ImportError:
+    # No ReplayGain analysis
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ["ReplayGain", "analyzeAlbums", "integratedLoudness", "DEFAULT_DECODER"]
+
+# The decoder command, "{path}" is replaced by the file. It must write raw signed 16-bit little
+# endian stereo PCM at 48 kHz to stdout, the K-weighting filter coefficients are for 48 kHz.
+DEFAULT_DECODER = ("ffmpeg", "-v", "error", "-i", "{path}",
+                   "-f", "s16le", "-ac", "2", "-ar", "48000", "-")
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+# ReplayGain 2.0 reference loudness
+REFERENCE_LUFS = -18.0
+
+# EBU R128 / ITU BS.1770: 400 ms gating blocks overlapping by 75%, so 100 ms steps.
+STEP_FRAMES = SAMPLE_RATE // 10
+# The end of the decoder's stderr reported on failure.
+DECODER_ERROR_BYTES = 4096
+# PCM read size, 10 s of audio, which bounds memory per file.
+READ_SIZE = STEP_FRAMES * CHANNELS * 2 * 100
+
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+# Block loudness is kept as a histogram of 0.1 LU bins, from the absolute gate up to +5 LUFS.
+# Per file histograms add up to the album's, without keeping every block.
+HISTOGRAM_BINS = 750
+
+# K-weighting biquads at 48 kHz: ((b0, b1, b2), (1, a1, a2))
+_SHELF = ((1.53512485958697, -2.69169618940638, 1.19839281085285),
+          (1.0, -1.69065929318241, 0.73248077421585))
+_HIGH_PASS = ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621))
+
+ReplayGain = namedtuple("ReplayGain", ["track_gain", "track_peak", "album_gain", "album_peak"])
+
+
+def _binLoudness(n) -> float:
+    return ABSOLUTE_GATE_LUFS + (n + 0.5) / 10
+
+
+def _loudness(mean_square) -> float:
+    return -0.691 + 10 * math.log10(mean_square) if mean_square > 0 else -math.inf
+
+
+def integratedLoudness(histogram: Counter):
+    """Gated loudness (LUFS) of a block loudness histogram, None if all blocks are silent."""
+    def meanSquare(bins):
+        count = sum(histogram[n] for n in bins)
+        if not count:
+            return 0
+        return sum(10 ** ((_binLoudness(n) + 0.691) / 10) * histogram[n] for n in bins) / count
+
+    absolute_gated = [n for n in histogram if histogram[n]]
+    if not absolute_gated:
+        return None
+
+    relative_gate = _loudness(meanSquare(absolute_gated)) + RELATIVE_GATE_LU
+    return _loudness(meanSquare([n for n in absolute_gated
+                                 if _binLoudness(n) >= relative_gate]))
+
+
+def _kWeightedSteps(samples, states: list):
+    """K-weight `samples`, frames by channel (floats) of whole 100 ms steps, returns the sum of
+    squares of each step, summed over channels. `states` carries the filter memory (per biquad,
+    by channel) between chunks."""
+    for i, (b, a) in enumerate((_SHELF, _HIGH_PASS)):
+        samples, states[i] = scipy.signal.lfilter(b, a, samples, axis=0, zi=states[i])
+    return numpy.square(samples).reshape(-1, STEP_FRAMES, CHANNELS).sum(axis=(1, 2))
+
+
+def analyzeFile(path, decoder=DEFAULT_DECODER) -> dict:
+    """Decode and measure `path`, returns {"histogram": {bin: count}, "peak": sample peak}."""
+    command = [arg.replace("{path}", str(path)) for arg in decoder]
+    histogram = Counter()
+    peak = 0
+    states = [numpy.zeros((2, CHANNELS)) for _ in range(2)]
+    steps = []  # The last 3 steps, a block is 4
+
+    # Not a pipe, a decoder writing more than a pipe buffer to stderr would block
+    with tempfile.TemporaryFile() as stderr_file, \
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file) as proc:
+        pending = b""
+        while chunk := proc.stdout.read(READ_SIZE):
+            # Whole steps only, the rest is kept for the next read.
+            data = pending + chunk
+            usable = len(data) - len(data) % (STEP_FRAMES * CHANNELS * 2)
+            pending = data[usable:]
+
+            pcm = numpy.frombuffer(data[:usable], dtype="<i2").reshape(-1, CHANNELS)
+            if not len(pcm):
+                continue
+            # As int, -32768 has no int16 negation
+            peak = max(peak, int(pcm.max()), -int(pcm.min()))
+
+            for step in _kWeightedSteps(pcm / 32768, states):
+                steps.append(float(step) / STEP_FRAMES)
+                if len(steps) == 4:
+                    loudness = _loudness(sum(steps) / 4)
+                    if loudness >= ABSOLUTE_GATE_LUFS:
+                        n = min(int((loudness - ABSOLUTE_GATE_LUFS) * 10), HISTOGRAM_BINS - 1)
+                        histogram[n] += 1
+                    del steps[0]
+
+        if proc.wait() != 0:
+            # The end of it, the error
+            size = stderr_file.seek(0, 2)
+            stderr_file.seek(max(size - DECODER_ERROR_BYTES, 0))
+            stderr = stderr_file.read()
+            raise RuntimeError(f"Decoder exit status {proc.returncode}: "
+                               f"{stderr.decode(errors='replace').strip()}")
+
+    return {"histogram": dict(histogram), "peak": min(peak / 32768, 1.0)}
+
+
+def _analyzeFile(args):
+    """Process pool worker, returns (path, analysis or an error message)."""
+    path, decoder = args
+    try:
+        return path, analyzeFile(path, decoder)
+    except Exception as ex:
+        # Exceptions may not pickle, the message will.
+        return path, f"{type(ex).__name__}: {ex}"
+
+
+def _loadCache(cache_file) -> dict:
+    try:
+        with open(cache_file, "r", encoding="utf8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except ValueError as ex:
+        log.warning(f"Discarding invalid cache {cache_file}: {ex}")
+        return {}
+
+
+def _saveCache(cache_file, cache: dict):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(cache), encoding="utf8")
+    tmp_file.replace(cache_file)
+
+
+def analyzeAlbums(albums, decoder=None, max_workers=None,
+                  cache_file=DEFAULT_LOUDNESS_CACHE_FILE) -> dict:
+    """ReplayGain 2.0 values (EBU R128 loudness, -18 LUFS reference) for `albums`, lists of
+    AudioFile. Returns AudioFile -> ReplayGain, files that fail to decode are left out.
+
+    Files are decoded by `decoder` (see DEFAULT_DECODER) across a process pool, streaming the
+    PCM in chunks, and filtered with numpy and scipy (required). Analyses are cached by audio
+    hash, so retagging (e.g. writing the results) does not require another analysis.
+    """
+    if numpy is None:
+        raise ImportError("ReplayGain analysis requires numpy and scipy, install the "
+                          "\"replaygain\" extra: pip install \"Mop[replaygain]\"")
+    decoder = tuple(decoder or DEFAULT_DECODER)
+    if not shutil.which(decoder[0]):
+        raise FileNotFoundError(f"ReplayGain decoder not found: {decoder[0]}")
+
+    audio_files = [af for album in albums for af in album]
+    hashes = audioHashes(audio_files)
+    cache = _loadCache(cache_file)
+
+    to_analyze = {str(af.path): hash_ for af, hash_ in hashes.items() if hash_ not in cache}
+    if to_analyze:
+        # Spawned, forking a process with GTK running is not safe.
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = [executor.submit(_analyzeFile, (path, decoder)) for path in to_analyze]
+            for future in as_completed(futures):
+                path, result = future.result()
+                if isinstance(result, str):
+                    log.error(f"Loudness analysis error, {path}: {result}")
+                else:
+                    cache[to_analyze[path]] = result
+        _saveCache(cache_file, cache)
+
+    log.debug(f"Analyzed {len(to_analyze)} of {len(audio_files)} file(s), "
+              f"{len(audio_files) - len(to_analyze)} cached")
+
+    def histogram(audio_file):
+        # JSON object keys are strings
+        return Counter({int(n): c for n, c in cache[hashes[audio_file]]["histogram"].items()})
+
+    results = {}
+    for album in albums:
+        album = [af for af in album if hashes.get(af) in cache]
+        histograms = {af: histogram(af) for af in album}
+        peaks = {af: cache[hashes[af]]["peak"] for af in album}
+
+        album_loudness = integratedLoudness(sum(histograms.values(), Counter()))
+        album_peak = max(peaks.values(), default=0)
+        for audio_file in album:
+            loudness = integratedLoudness(histograms[audio_file])
+            if loudness is None:
+                log.warning(f"Silent, no ReplayGain: {audio_file.path}")
+                continue
+            results[audio_file] = ReplayGain(REFERENCE_LUFS - loudness, peaks[audio_file],
+                                             REFERENCE_LUFS - album_loudness, album_peak)
+    return results
@@ -0,0 +1,161 @@
+import logging
+from collections import namedtuple
+from eyed3.utils import formatSize
+from .id3v1 import V1_TAG_SIZE
+from .utils import takeTouchedFiles
+
+log = logging.getLogger(__name__)
+
+__all__ = ["MemoryReport", "tagBytes", "fileTagBytes", "peekTags", "memoryReport",
+           "formatReport", "enforceBudget", "MemoryMonitor"]
+
+# Memory of loaded files. `tag_bytes` is of the tags in memory, of which `image_bytes` are of
+# image frames. `evicted` files have their tags in the tag cache only, of `tag_cache_bytes`.
+MemoryReport = namedtuple("MemoryReport", ["files", "dirty", "evicted", "tag_bytes",
+                                           "image_bytes", "tag_cache_bytes"])
+
+
+def tagBytes(tag) -> tuple:
+    """The (frame bytes, image bytes) of `tag`, approximately the memory it holds. Frames keep
+    their data as read and images their decoded data too, both are counted."""
+    if tag is None:
+        return 0, 0
+    elif tag.isV1():
+        # Its fields are not frames
+        return V1_TAG_SIZE, 0
+
+    total = images = 0
+    for frames in tag.frame_set.values():
+        for frame in frames:
+            size = len(frame.data or b"")
+            if hasattr(frame, "image_data"):
+                size += len(frame.image_data or b"")
+                images += size
+            total += size
+    return total, images
+
+
+def _residentTags(audio_file) -> tuple:
+    if hasattr(audio_file, "resident_tags"):
+        return audio_file.resident_tags
+    return audio_file.tag, audio_file.second_v1_tag
+
+
+def fileTagBytes(audio_file) -> tuple:
+    """The (frame bytes, image bytes) of the tags of `audio_file` in memory, 0 when evicted."""
+    sizes = [tagBytes(tag) for tag in _residentTags(audio_file)]
+    return sum(s[0] for s in sizes), sum(s[1] for s in sizes)
+
+
+def peekTags(audio_file) -> tuple:
+    """The (tag, second_v1_tag) of `audio_file` for reading values, evicted tags are not
+    restored (see ReadAheadMp3AudioFile.peekTags). For passes over all files, e.g. previews."""
+    if hasattr(audio_file, "peekTags"):
+        return audio_file.peekTags()
+    return audio_file.tag, audio_file.second_v1_tag
+
+
+def memoryReport(audio_files, tag_cache=None) -> MemoryReport:
+    tag_bytes = image_bytes = dirty = evicted = 0
+    for audio_file in audio_files:
+        size, images = fileTagBytes(audio_file)
+        tag_bytes += size
+        image_bytes += images
+        dirty += audio_file.is_dirty
+        evicted += getattr(audio_file, "evicted", False)
+
+    return MemoryReport(len(audio_files), dirty, evicted, tag_bytes, image_bytes,
+                        tag_cache.size_bytes if tag_cache is not None else 0)
+
+
+def formatReport(report: MemoryReport) -> str:
+    return (f"Tags {formatSize(report.tag_bytes)} (images {formatSize(report.image_bytes)}), "
+            f"{report.files} file(s), {report.evicted} evicted, {report.dirty} modified, "
+            f"tag cache {formatSize(report.tag_cache_bytes)}")
+
+
+def enforceBudget(audio_files, budget, keep=()) -> int:
+    """Evict the tags of the least recently used files until those in memory are within
+    `budget` bytes, when over it. Files with unsaved changes, those of `keep` (e.g. being
+    edited), and files that cannot be evicted (no `evict`) stay. Returns the number evicted."""
+    if not budget:
+        return 0
+
+    sizes = {af: fileTagBytes(af)[0] for af in audio_files}
+    total = sum(sizes.values())
+    if total <= budget:
+        return 0
+
+    keep = set(keep)
+    evictable = sorted((af for af, size in sizes.items()
+                        if size and hasattr(af, "evict") and not af.is_dirty and af not in keep),
+                       key=lambda af: af.last_access)
+    n = 0
+    for audio_file in evictable:
+        if total <= budget:
+            break
+        audio_file.evict()
+        total -= sizes[audio_file]
+        n += 1
+
+    log.info(f"Evicted the tags of {n} file(s), {formatSize(total)} of tags in memory "
+             f"(budget {formatSize(budget)})")
+    return n
+
+
+class MemoryMonitor:
+    """Tracks the memory of the tags of loaded files, for checking it periodically on the UI
+    thread. Files are measured when set, then only those touched since (tags used, restored or
+    evicted, see mop.utils.takeTouchedFiles) and those given as changed, not all of them.
+    """
+    def __init__(self):
+        self._sizes = {}
+        self._tag_bytes = self._image_bytes = 0
+
+    def setFiles(self, audio_files):
+        takeTouchedFiles()
+        self._sizes = {}
+        self._tag_bytes = self._image_bytes = 0
+        for audio_file in audio_files:
+            self._measure(audio_file)
+
+    def _measure(self, audio_file):
+        old_size, old_images = self._sizes.get(audio_file, (0, 0))
+        size, images = self._sizes[audio_file] = fileTagBytes(audio_file)
+        self._tag_bytes += size - old_size
+        self._image_bytes += images - old_images
+
+    @property
+    def tag_bytes(self) -> int:
+        return self._tag_bytes
+
+    def check(self, changed=(), budget=None, keep=(), tag_cache=None) -> MemoryReport:
+        """Re-measure the files touched since the last check and those of `changed` (e.g. the
+        modified files), then when over `budget` evict the least recently used files (as
+        enforceBudget). Returns the report."""
+        for audio_file in takeTouchedFiles() | set(changed):
+            if audio_file in self._sizes:
+                self._measure(audio_file)
+
+        if budget and self._tag_bytes > budget:
+            keep = set(keep)
+            evictable = sorted((af for af, (size, _) in self._sizes.items()
+                                if size and hasattr(af, "evict") and not af.is_dirty
+                                and af not in keep),
+                               key=lambda af: af.last_access)
+            n = 0
+            for audio_file in evictable:
+                if self._tag_bytes <= budget:
+                    break
+                audio_file.evict()
+                self._measure(audio_file)
+                n += 1
+            takeTouchedFiles()
+            log.info(f"Evicted the tags of {n} file(s), {formatSize(self._tag_bytes)} of tags "
+                     f"in memory (budget {formatSize(budget)})")
+
+        audio_files = self._sizes.keys()
+        return MemoryReport(len(self._sizes), sum(af.is_dirty for af in audio_files),
+                            sum(getattr(af, "evicted", False) for af in audio_files),
+                            self._tag_bytes, self._image_bytes,
+                            tag_cache.size_bytes if tag_cache is not None else 0)
@@ -0,0 +1,157 @@
+import time
+import hashlib
+import logging
+from pathlib import Path
+from collections import namedtuple
+from contextlib import contextmanager
+from eyed3.core import TXXX_ALBUM_TYPE
+from eyed3.id3 import Tag, ID3_V1, ID3_V2
+from .core import REPLAYGAIN_FIELDS, getTagValue, getTagValues, setTagValue
+from .editlog import fileStamp
+from .storage import LocalStorage, ReadAheadFile, isLocal
+
+try:
+    import fcntl
+except ImportError:
+    # Not POSIX, saves are unlocked
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ["Conflict", "loadValues", "otherFrames", "lockFile", "mergeExternalChanges"]
+
+# A field changed both by the user and on disk, the user's value is kept.
+Conflict = namedtuple("Conflict", ["audio_file", "field", "base", "theirs", "mine"])
+
+TAG_SLOTS = ("tag", "second_v1_tag")
+LOCK_TIMEOUT_SECS = 5.0
+
+# The load values key of the digests of the frames of no field (see otherFrames).
+OTHER_FRAMES = "other_frames"
+# Frames of the fields, those of eyeD3 Tag attributes (dates being several for ID3 v2.3)
+_FIELD_FRAME_IDS = {
+    b"TIT2", b"TPE1", b"TALB", b"TPE2", b"TOPE", b"TCOM", b"TENC", b"TPUB", b"TCOP", b"TRCK",
+    b"TPOS", b"TDRL", b"TDRC", b"TDOR", b"TYER", b"TDAT", b"TIME", b"TORY", b"TRDA", b"XDOR",
+    b"TCON",
+}
+# User text, comment, and URL frames are of a field by description
+_FIELD_FRAME_DESCRIPTIONS = {
+    b"TXXX": {TXXX_ALBUM_TYPE, *REPLAYGAIN_FIELDS.values()},
+    b"COMM": {""},
+    b"WXXX": {""},
+}
+
+
+def otherFrames(tag) -> dict:
+    """Digests of the frames of `tag` that are of no field (e.g. images, lyrics, private and
+    user frames), (frame id, description) -> sorted digests of the frame data, for detecting
+    changes to them. Empty for v1 tags."""
+    frames = {}
+    if tag is None or not tag.isV2():
+        return frames
+
+    for fid, fid_frames in tag.frame_set.items():
+        if fid in _FIELD_FRAME_IDS:
+            continue
+        for frame in fid_frames:
+            description = getattr(frame, "description", None)
+            if description in _FIELD_FRAME_DESCRIPTIONS.get(fid, ()):
+                continue
+            digest = hashlib.blake2b(frame.data or b"", digest_size=16).digest()
+            frames.setdefault((fid.decode("ascii", "replace"), description), []).append(digest)
+    return {key: sorted(digests) for key, digests in frames.items()}
+
+
+def loadValues(audio_file) -> dict:
+    """The field values of the tags of `audio_file` as loaded, the base of a three-way merge,
+    with the digests of their other frames (see otherFrames), as OTHER_FRAMES."""
+    values = {}
+    for slot in TAG_SLOTS:
+        if (tag := getattr(audio_file, slot)) is not None:
+            values[slot] = getTagValues(tag)
+            values[slot][OTHER_FRAMES] = otherFrames(tag)
+    return values
+
+
+@contextmanager
+def lockFile(path, timeout=LOCK_TIMEOUT_SECS, storage=None):
+    """Hold an exclusive advisory lock (flock) on `path`, other programs that also lock the file
+    wait for it. Raises TimeoutError if the lock is not acquired within `timeout` seconds. Files
+    of non-local storage (see mop.storage.isLocal) are not locked."""
+    if fcntl is None or not isLocal(storage):
+        yield
+        return
+
+    with open(path, "rb") as fp:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"File is locked: {path}")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def mergeExternalChanges(audio_file) -> list:
+    """Merge changes made on disk since `audio_file` was loaded into its tags. Call with the file
+    locked, before saving.
+
+    If the file's (mtime, size) still match the load time nothing is read. Otherwise only its
+    tags are re-read (no MPEG info), the re-read values being the content check, and for each
+    tag the user's changed fields are applied to the tag on disk, keeping everything else that
+    changed there. Returns the fields both changed differently, the user's value wins.
+
+    Frames of no field (see otherFrames) are not merged but those on disk kept, those changed
+    there are logged as a warning.
+    """
+    storage = audio_file.storage or LocalStorage()
+    stat_result = storage.stat(audio_file.path)
+    if fileStamp(stat_result) == fileStamp(audio_file.load_stat):
+        return []
+
+    conflicts = []
+    for slot, base_values in audio_file.load_values.items():
+        my_tag = getattr(audio_file, slot)
+        if my_tag is None:
+            continue
+
+        their_tag = Tag()
+        with ReadAheadFile(storage, audio_file.path, stat_result.st_size) as file_obj:
+            found = their_tag.parse(file_obj, version=ID3_V2 if my_tag.isV2() else ID3_V1)
+        if not found:
+            log.warning(f"Tag removed by another program, saving ours: {audio_file.path}")
+            continue
+
+        base_values = dict(base_values)
+        base_frames = base_values.pop(OTHER_FRAMES, {})
+        their_frames = otherFrames(their_tag)
+        if their_frames != base_frames:
+            frames = sorted({key for key in base_frames.keys() | their_frames.keys()
+                             if base_frames.get(key) != their_frames.get(key)})
+            log.warning(f"Frames changed by another program, theirs are kept: "
+                        f"{', '.join(fid + (f' ({d})' if d else '') for fid, d in frames)}, "
+                        f"{audio_file.path}")
+
+        changed = 0
+        for field, base in base_values.items():
+            mine, theirs = getTagValue(my_tag, field), getTagValue(their_tag, field)
+            if mine != base:
+                if theirs not in (base, mine):
+                    conflicts.append(Conflict(audio_file, field, base, theirs, mine))
+                setTagValue(their_tag, field, mine)
+            elif theirs != base:
+                changed += 1
+
+        # The tag is replaced, as on reload (the undo journal and editor refer to slots). Its file
+        # info is that of the file now, saving with the stale info could corrupt the file.
+        setattr(audio_file, slot, their_tag)
+        log.info(f"Merged {changed} external change(s), {len(conflicts)} conflict(s): "
+                 f"{Path(audio_file.path).name}")
+
+    return conflicts
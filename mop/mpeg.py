@@ -0,0 +1,277 @@
+import os
+import mmap
+import logging
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .config import DEFAULT_STREAM_SCAN_CACHE_FILE
+from .duplicates import audioRegion
+from .filecache import FileCache
+
+log = logging.getLogger(__name__)
+
+__all__ = ["FrameScan", "scanFrames", "scanFile", "scanFiles", "scanProblems",
+           "scanDuration", "accurateDurations"]
+
+# The result of walking every frame of an MPEG audio stream. `frames` and `samples` exclude a
+# VBR header frame, `vbr_frames` is the frame count the header declares (None without one).
+FrameScan = namedtuple("FrameScan", ["frames", "samples", "sample_rate", "sync_errors",
+                                     "skipped_bytes", "truncated_bytes", "vbr_header",
+                                     "vbr_frames"])
+
+# Header bits that must not change from frame to frame: sync, version, layer, sample rate.
+_STREAM_MASK = 0xfffe0c00
+_SYNC_MASK = 0xffe00000
+
+_BITRATES = {  # (version, layer) -> kbps by bitrate index
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+_VERSIONS = {0: 2.5, 2: 2, 3: 1}
+_LAYERS = {1: 3, 2: 2, 3: 1}
+
+
+def _frameTable() -> list:
+    """(frame length, samples, sample rate) indexed by header bits 9-20 (padding, sample rate,
+    bitrate, CRC flag, layer, version), None for invalid and free format headers."""
+    table = [None] * 4096
+    for index in range(4096):
+        padding, sr_index, br_index = index & 1, (index >> 1) & 3, (index >> 3) & 0xf
+        layer, version = _LAYERS.get((index >> 8) & 3), _VERSIONS.get((index >> 10) & 3)
+        if not layer or not version or sr_index == 3 or br_index in (0, 15):
+            continue
+
+        bitrate = _BITRATES[(min(int(version), 2), layer)][br_index] * 1000
+        sample_rate = _SAMPLE_RATES[version][sr_index]
+        if layer == 1:
+            samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 576 if layer == 3 and version != 1 else 1152
+            length = samples // 8 * bitrate // sample_rate + padding
+        table[index] = (length, samples, sample_rate)
+    return table
+
+
+_FRAME_TABLE = _frameTable()
+
+
+def _frameInfo(header: int):
+    if header & _SYNC_MASK != _SYNC_MASK:
+        return None
+    return _FRAME_TABLE[(header >> 9) & 0xfff]
+
+
+def _syncsAt(buf, pos, end, stream_bits) -> bool:
+    """Whether a frame header at `pos` is followed by another (or the end of the stream)."""
+    header = int.from_bytes(buf[pos:pos + 4], "big")
+    info = _frameInfo(header)
+    if not info or (stream_bits is not None and header & _STREAM_MASK != stream_bits):
+        return False
+
+    next_pos = pos + info[0]
+    return (next_pos + 4 > end
+            or _frameInfo(int.from_bytes(buf[next_pos:next_pos + 4], "big")) is not None)
+
+
+def _vbrHeader(buf, pos, header) -> tuple:
+    """The (name, frame count) of a Xing/Info or VBRI header in the frame at `pos`."""
+    mono = (header >> 6) & 3 == 3
+    if (header >> 19) & 3 == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+
+    xing = pos + 4 + side_info
+    if buf[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(buf[xing + 4:xing + 8], "big")
+        frames = int.from_bytes(buf[xing + 8:xing + 12], "big") if flags & 1 else None
+        return buf[xing:xing + 4].decode("ascii"), frames
+
+    vbri = pos + 4 + 32
+    if buf[vbri:vbri + 4] == b"VBRI":
+        return "VBRI", int.from_bytes(buf[vbri + 14:vbri + 18], "big")
+
+    return None, None
+
+
+def scanFrames(buf, start, end) -> FrameScan:
+    """Walk every frame of the MPEG audio in `buf[start:end]`.
+
+    Once in sync, frame headers must keep the version, layer, and sample rate of the first
+    frame, which must be followed by another (as when resyncing). After a sync error the
+    stream is searched for the next header that is followed by another, the bytes skipped are
+    counted. Bytes before the first frame are skipped but not a
+    sync error. A last frame extending past `end` is truncated.
+    """
+    frames = samples = sync_errors = skipped = truncated = 0
+    sample_rate, stream_bits = None, None
+    vbr_header = vbr_frames = None
+
+    pos = start
+    while pos + 4 <= end:
+        header = int.from_bytes(buf[pos:pos + 4], "big")
+        info = _frameInfo(header)
+        if stream_bits is None:
+            # The first frame locks the stream, a header-shaped stray must not
+            in_sync = _syncsAt(buf, pos, end, None)
+        else:
+            in_sync = info is not None and header & _STREAM_MASK == stream_bits
+        if in_sync:
+            length, frame_samples, frame_rate = info
+            if pos + length > end:
+                truncated = pos + length - end
+                break
+
+            if stream_bits is None:
+                stream_bits, sample_rate = header & _STREAM_MASK, frame_rate
+                vbr_header, vbr_frames = _vbrHeader(buf, pos, header)
+                if vbr_header:
+                    # Not audio
+                    pos += length
+                    continue
+
+            frames += 1
+            samples += frame_samples
+            pos += length
+            continue
+
+        # Lost sync, or not yet in sync
+        if stream_bits is not None:
+            sync_errors += 1
+        resync = pos + 1
+        while (resync := buf.find(b"\xff", resync, end - 3)) != -1:
+            if _syncsAt(buf, resync, end, stream_bits):
+                break
+            resync += 1
+
+        if resync == -1:
+            skipped += end - pos
+            break
+        skipped += resync - pos
+        pos = resync
+
+    return FrameScan(frames, samples, sample_rate, sync_errors, skipped, truncated,
+                     vbr_header, vbr_frames)
+
+
+def scanFile(path) -> FrameScan:
+    """Scan the MPEG frames of `path`, its ID3 tags excluded."""
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        start, end = audioRegion(fp, size)
+        if start == end:
+            return FrameScan(0, 0, None, 0, 0, 0, None, None)
+
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return scanFrames(buf, start, end)
+
+
+def scanProblems(scan: FrameScan) -> list:
+    """Descriptions of the problems found by a scan, empty if there are none."""
+    problems = []
+    if not scan.frames:
+        problems.append("No audio frames")
+    if scan.truncated_bytes:
+        problems.append(f"Truncated, last frame missing {scan.truncated_bytes} bytes")
+    if scan.sync_errors:
+        problems.append(f"{scan.sync_errors} sync error(s), {scan.skipped_bytes} bytes skipped")
+    if scan.vbr_frames is not None and scan.vbr_frames != scan.frames:
+        problems.append(f"{scan.vbr_header} header declares {scan.vbr_frames} frames, "
+                        f"found {scan.frames}")
+    return problems
+
+
+def scanDuration(scan: FrameScan) -> float:
+    """The exact duration of a scanned stream, in seconds."""
+    return scan.samples / scan.sample_rate if scan.sample_rate else 0.0
+
+
+def _hasHeaderFrameCount(info) -> bool:
+    """Whether eyeD3's duration is from a Xing/Info or VBRI header frame count, rather than
+    estimated from the file size and first frame."""
+    return bool((info.xing_header and info.xing_header.numFrames)
+                or (info.vbri_header and info.vbri_header.num_frames))
+
+
+def accurateDurations(audio_files) -> dict:
+    """Exact durations, AudioFile -> seconds, for `audio_files` whose eyeD3 duration is an
+    estimate. Their frames are counted (see `scanFiles`, the scans are cached)."""
+    estimated = {str(af.path): af for af in audio_files
+                 if af.info and af.info.mp3_header and not _hasHeaderFrameCount(af.info)}
+    if not estimated:
+        return {}
+
+    scans = scanFiles(list(estimated))
+    return {estimated[path]: scanDuration(scan) for path, scan in scans.items() if scan.frames}
+
+
+def _scanFile(path):
+    """Process pool worker, returns (path, FrameScan or an error message)."""
+    try:
+        return path, scanFile(path)
+    except Exception as ex:
+        # Exceptions may not pickle, the message will.
+        return path, f"{type(ex).__name__}: {ex}"
+
+
+# Cache saves while scanning, so an interrupted full library scan resumes where it stopped.
+SCAN_CACHE_SAVE_INTERVAL = 500
+
+
+def scanFiles(paths, on_result=None, max_workers=None,
+              cache_file=DEFAULT_STREAM_SCAN_CACHE_FILE) -> dict:
+    """Scan `paths` across a process pool, returns path -> FrameScan for the files scanned.
+
+    Scans are cached by path, mtime, and size in `cache_file`. `on_result(path, scan)` is
+    called for each file as it completes, from the calling thread.
+    """
+    cache = FileCache(cache_file)
+    results, to_scan = {}, {}
+    for path in paths:
+        try:
+            # Stat before the scan, a file changing meanwhile is rescanned next time.
+            stat_result = os.stat(path)
+        except OSError as ex:
+            log.error(f"Stream scan error: {ex}")
+            continue
+
+        if (cached := cache.get(path, stat_result)) is not None:
+            results[path] = FrameScan(*cached)
+            if on_result:
+                on_result(path, results[path])
+        else:
+            to_scan[path] = stat_result
+
+    def handleResult(path, scan, stat_result):
+        if isinstance(scan, str):
+            log.error(f"Stream scan error, {path}: {scan}")
+            return
+        results[path] = scan
+        cache.set(path, stat_result, list(scan))
+        if on_result:
+            on_result(path, scan)
+
+    if len(to_scan) == 1:
+        # Not worth starting a process
+        path, stat_result = next(iter(to_scan.items()))
+        handleResult(path, _scanFile(path)[1], stat_result)
+    elif to_scan:
+        # Spawned, forking a process with GTK running is not safe.
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = {executor.submit(_scanFile, str(path)): path for path in to_scan}
+            for n, future in enumerate(as_completed(futures), 1):
+                path = futures[future]
+                handleResult(path, future.result()[1], to_scan[path])
+                if n % SCAN_CACHE_SAVE_INTERVAL == 0:
+                    cache.save()
+
+    cache.save()
+    log.debug(f"Stream scanned {len(to_scan)} of {len(paths)} file(s), "
+              f"{len(paths) - len(to_scan)} cached")
+    return results
@@ -0,0 +1,97 @@
+import logging
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .storage import LocalStorage
+from .transforms import TagsToFilename, TransformPipeline, FILENAME
+
+log = logging.getLogger(__name__)
+
+__all__ = ["planRenames", "findCollisions", "renameFiles"]
+
+# Renames are latency, not CPU, bound (and network filesystems benefit the most).
+MAX_RENAME_WORKERS = 8
+
+
+def planRenames(audio_files, template, base_dir=None) -> dict:
+    """Map each of `audio_files` to its new path from tag `template` (see TagsToFilename).
+    Files whose path would not change, or that lack values the template uses, are left out."""
+    pipeline = TransformPipeline(TagsToFilename(template, base_dir=base_dir))
+    return {c.audio_file: c.new for c in pipeline.preview(audio_files) if c.field == FILENAME}
+
+
+def findCollisions(renames: dict) -> dict:
+    """Check a whole batch of renames before any are made.
+
+    Returns a dict of target path to the reason it cannot be used, for targets that more than
+    one file would be moved to, that already exist (in the file's storage), or that are
+    themselves being moved (no chains or swaps; the renames run concurrently, in no particular
+    order).
+    """
+    targets = defaultdict(list)
+    for audio_file, new_path in renames.items():
+        targets[Path(new_path)].append(audio_file)
+    sources = {Path(af.path) for af in renames}
+
+    collisions = {}
+    for target, audio_files in targets.items():
+        if len(audio_files) > 1:
+            collisions[target] = f"Target of {len(audio_files)} files"
+        elif target in sources:
+            collisions[target] = "Target is also being renamed"
+        elif _exists(audio_files[0], target):
+            collisions[target] = "Target exists"
+    return collisions
+
+
+# For files of eyeD3's own (local) file access
+_local_storage = LocalStorage()
+
+
+def _storage(audio_file):
+    return getattr(audio_file, "storage", None) or _local_storage
+
+
+def _exists(audio_file, path) -> bool:
+    try:
+        _storage(audio_file).stat(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _rename(storage, src, dst):
+    storage.rename(src, dst)
+    return dst
+
+
+def renameFiles(renames: dict, max_workers=MAX_RENAME_WORKERS):
+    """Move files, `renames` maps AudioFile to its new path, through the file's storage. Call
+    `findCollisions` first. A target that exists anyway (e.g. created since) is not replaced,
+    the file fails with FileExistsError.
+
+    Returns (done, errors): dicts of AudioFile to new path, and AudioFile to exception. The
+    AudioFile objects are not modified.
+    """
+    done, errors = {}, {}
+
+    # Target directories first, once each.
+    parents = {(_storage(af), Path(p).parent) for af, p in renames.items()}
+    for storage, parent in parents:
+        try:
+            storage.makedirs(parent)
+        except OSError as ex:
+            log.error(f"Directory create error: {ex}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_rename, _storage(audio_file), audio_file.path, new_path):
+                   audio_file for audio_file, new_path in renames.items()}
+        for future, audio_file in futures.items():
+            try:
+                done[audio_file] = future.result()
+            except OSError as ex:
+                log.error(f"Rename error: {ex}")
+                errors[audio_file] = ex
+
+    log.debug(f"Renamed {len(done)} file(s), {len(errors)} error(s)")
+    return done, errors
@@ -0,0 +1,269 @@
+import os
+import json
+import logging
+from pathlib import Path, PurePath
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from eyed3.mp3 import EXTENSIONS as MP3_EXTENSIONS
+from .config import DEFAULT_SCAN_CHECKPOINT_FILE
+from .storage import DirEntry, LocalStorage
+
+log = logging.getLogger(__name__)
+
+__all__ = ["ScanFilter", "loadFiles", "DirectoryScan", "ScanProgress"]
+
+# Loads in flight at once when loading from network storage. I/O of the files overlaps, and
+# the bound keeps the read-ahead buffers of only that many files in memory.
+MAX_IN_FLIGHT = 16
+
+
+class ScanFilter:
+    """Which files and directories a scan visits, decided from directory listings (names and the
+    listing's stat) before any file is opened.
+
+    Files are loaded when their name matches an `include` glob and no `exclude` glob; excluded
+    directories are not listed. Globs are case-insensitive and match the path relative to the
+    scanned directory from the right, i.e. names, or trailing path components for globs with a
+    "/" (e.g. "Podcasts/*"). `min_size` and `max_size` (bytes) bound file sizes, and directories
+    deeper than `max_depth` (the scanned directory being 0) are not listed. Symlinked files are
+    loaded, symlinked directories are only listed with `follow_symlinks`, once each (see
+    DirectoryScan).
+    """
+    DEFAULT_INCLUDE = tuple(f"*{ext}" for ext in MP3_EXTENSIONS)
+
+    def __init__(self, include=DEFAULT_INCLUDE, exclude=(), max_depth=None, min_size=None,
+                 max_size=None, follow_symlinks=False):
+        self.include = [g.lower() for g in include]
+        self.exclude = [g.lower() for g in exclude]
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_size = max_size
+        self.follow_symlinks = follow_symlinks
+
+    @classmethod
+    def fromConfig(cls, config):
+        """The filter of the scan_* options of `config`."""
+        return cls(include=config.scan_include or cls.DEFAULT_INCLUDE,
+                   exclude=config.scan_exclude or (),
+                   max_depth=config.scan_max_depth, min_size=config.scan_min_size,
+                   max_size=config.scan_max_size,
+                   follow_symlinks=bool(config.scan_follow_symlinks))
+
+    @staticmethod
+    def _matches(rel_path: PurePath, globs) -> bool:
+        return any(rel_path.match(g) for g in globs)
+
+    def includeFile(self, entry, rel_path: str) -> bool:
+        path = PurePath(rel_path.lower())
+        size = entry.stat.st_size
+        return (self._matches(path, self.include) and not self._matches(path, self.exclude)
+                and (self.min_size is None or size >= self.min_size)
+                and (self.max_size is None or size <= self.max_size))
+
+    def includeDir(self, entry, rel_path: str, depth: int) -> bool:
+        return ((self.max_depth is None or depth <= self.max_depth)
+                and (self.follow_symlinks or not entry.is_symlink)
+                and not self._matches(PurePath(rel_path.lower()), self.exclude))
+
+
+def loadFiles(entries, load, max_in_flight=MAX_IN_FLIGHT):
+    """Call `load(entry)` for each of `entries` (DirEntry's) across threads, at most
+    `max_in_flight` at once. Yields (entry, result) in the order of `entries`, result is None
+    for loads that fail."""
+    def tryLoad(entry):
+        try:
+            return load(entry)
+        except Exception as ex:
+            log.error(f"Load error, {entry.path}: {ex}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = deque()
+        for entry in entries:
+            if len(in_flight) == max_in_flight:
+                done_entry, future = in_flight.popleft()
+                yield done_entry, future.result()
+            in_flight.append((entry, executor.submit(tryLoad, entry)))
+
+        while in_flight:
+            done_entry, future = in_flight.popleft()
+            yield done_entry, future.result()
+
+
+# Progress of a DirectoryScan, reported as each directory completes: the directory, its files
+# and those loaded, and the totals so far. `resumed` is whether it was done by an earlier scan.
+ScanProgress = namedtuple("ScanProgress", ["directory", "files", "loaded", "dirs_done",
+                                           "dirs_found", "files_loaded", "resumed"])
+
+# Checkpoints are written as this many files complete (and when the scan stops), a scan that is
+# killed repeats at most that many loads.
+CHECKPOINT_INTERVAL = 500
+
+
+class DirectoryScan:
+    """A scan of the files under `root`, directory by directory, depth first and in sorted
+    order, loading the files of each with `load(entry)` (see loadFiles). Files and directories
+    are those of `scan_filter` (ScanFilter, by default .mp3 files, symlinked directories not
+    followed). Followed symlinked directories are listed once, by their resolved path, and not
+    when inside the scanned directory or one of them, so links looping back are skipped.
+
+    Completed directories are recorded in `checkpoint_file`, JSON lines of their loaded files
+    and subdirectories. A scan of the same root finding the file resumes: completed directories
+    are not listed again and only their loaded files are loaded again, which for loads through a
+    cache (see mop.tagcache) reads nothing. `on_checkpoint()` is called before each write, to
+    save such a cache, so the checkpoint never gets ahead of it. The checkpoint is removed when a
+    scan completes, and kept when it is cancelled (`cancel` or KeyboardInterrupt) or dies.
+    """
+    def __init__(self, root, load, storage=None, max_in_flight=1,
+                 checkpoint_file=DEFAULT_SCAN_CHECKPOINT_FILE, on_progress=None,
+                 on_checkpoint=None, scan_filter=None):
+        self.root = str(root)
+        self.scan_filter = scan_filter or ScanFilter()
+        self._load = load
+        self._storage = storage or LocalStorage()
+        self._max_in_flight = max_in_flight
+        self._checkpoint_file = Path(checkpoint_file)
+        self._on_progress = on_progress
+        self._on_checkpoint = on_checkpoint
+        self._cancelled = False
+        self._pending = []  # Checkpoint lines not yet written
+        self._pending_files = 0
+        self._linked_dirs = []  # Resolved paths of the directories listed, of the root and links
+
+    def cancel(self):
+        """Stop the scan after the loads in flight, callable from other threads."""
+        self._cancelled = True
+
+    def _readCheckpoint(self) -> dict:
+        """Directory -> (loaded files, subdirectories) of the checkpoint of this root."""
+        done = {}
+        if not self._checkpoint_file.exists():
+            return done
+
+        with open(self._checkpoint_file, "r", encoding="utf8") as fp:
+            for n, line in enumerate(fp):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn by a crash while writing
+                    log.debug(f"Skipping invalid checkpoint line {n + 1}")
+                    continue
+                if n == 0 and record.get("root") != self.root:
+                    log.info(f"Discarding the scan checkpoint of {record.get('root')}")
+                    done = {}
+                    break
+                if "dir" in record:
+                    done[record["dir"]] = (record["files"], record["subdirs"])
+                    self._linked_dirs.extend(record.get("links", []))
+        if not done:
+            self._checkpoint_file.unlink()
+        else:
+            log.info(f"Resuming scan of {self.root}, {len(done)} directories done")
+        return done
+
+    def _checkpoint(self, record=None, flush=False):
+        if record is not None:
+            self._pending.append(json.dumps(record, ensure_ascii=False) + "\n")
+            self._pending_files += len(record["files"])
+        if not self._pending or (not flush and self._pending_files < CHECKPOINT_INTERVAL):
+            return
+
+        if self._on_checkpoint:
+            self._on_checkpoint()
+        self._checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        new = not self._checkpoint_file.exists()
+        with open(self._checkpoint_file, "a", encoding="utf8") as fp:
+            if new:
+                fp.write(json.dumps({"root": self.root}, ensure_ascii=False) + "\n")
+            fp.writelines(self._pending)
+        self._pending.clear()
+        self._pending_files = 0
+
+    def _isLinkedDir(self, real_path) -> bool:
+        """Whether resolved directory `real_path` is, is within, or contains a listed directory
+        of a followed link (or the root)."""
+        for linked in self._linked_dirs:
+            common = os.path.commonpath([linked, real_path])
+            if common in (linked, real_path):
+                return True
+        return False
+
+    def _listDirectory(self, dir_path, depth, done) -> tuple:
+        """The (file entries, subdirectories, resolved paths of subdirectory links) to scan of
+        `dir_path`, from the checkpoint if done."""
+        if dir_path in done:
+            files = []
+            for path in done[dir_path][0]:
+                try:
+                    files.append(DirEntry(path, False, self._storage.stat(path)))
+                except OSError as ex:
+                    log.warning(f"Scan error: {ex}")
+            return files, done[dir_path][1], []
+
+        files, subdirs, links = [], [], []
+        for entry in sorted(self._storage.scandir(dir_path)):
+            rel_path = os.path.relpath(entry.path, self.root)
+            if not entry.is_dir:
+                if self.scan_filter.includeFile(entry, rel_path):
+                    files.append(entry)
+            elif self.scan_filter.includeDir(entry, rel_path, depth + 1):
+                if entry.is_symlink:
+                    real_path = self._storage.realpath(entry.path)
+                    if self._isLinkedDir(real_path):
+                        log.info(f"Skipping symlink to a scanned directory: {entry.path}")
+                        continue
+                    self._linked_dirs.append(real_path)
+                    links.append(real_path)
+                subdirs.append(entry.path)
+        return files, subdirs, links
+
+    def run(self) -> list:
+        """Scan, returns the load results that are not None, in order."""
+        done = self._readCheckpoint()
+        self._linked_dirs.append(self._storage.realpath(self.root))
+        results = []
+        dirs = [(self.root, 0)]
+        dirs_found, dirs_done = 1, 0
+        try:
+            while dirs and not self._cancelled:
+                dir_path, depth = dirs.pop()
+                try:
+                    files, subdirs, links = self._listDirectory(dir_path, depth, done)
+                except OSError as ex:
+                    log.error(f"Directory listing error: {ex}")
+                    continue
+                dirs.extend((d, depth + 1) for d in reversed(subdirs))
+                dirs_found += len(subdirs)
+
+                loaded = []
+                for entry, result in loadFiles(files, self._load, self._max_in_flight):
+                    if result is not None:
+                        loaded.append(entry.path)
+                        results.append(result)
+                    if self._cancelled:
+                        break
+                else:
+                    dirs_done += 1
+                    resumed = dir_path in done
+                    if not resumed:
+                        self._checkpoint({"dir": dir_path, "files": loaded, "subdirs": subdirs,
+                                          "links": links})
+                    if self._on_progress:
+                        self._on_progress(ScanProgress(dir_path, len(files), len(loaded),
+                                                       dirs_done, dirs_found, len(results),
+                                                       resumed))
+        except KeyboardInterrupt:
+            self._cancelled = True
+            raise
+        finally:
+            if self._cancelled:
+                self._checkpoint(flush=True)
+                log.info(f"Scan of {self.root} stopped, {dirs_done} of {dirs_found} "
+                         "directories done")
+
+        if not self._cancelled:
+            if self._on_checkpoint:
+                self._on_checkpoint()
+            if self._checkpoint_file.exists():
+                self._checkpoint_file.unlink()
+        return results
@@ -0,0 +1,105 @@
+import logging
+from collections import defaultdict
+from typing import Iterable, Optional, Set
+
+log = logging.getLogger(__name__)
+
+__all__ = ["SearchIndex", "normalizeText"]
+
+# Separates the fields of a row's indexed text so that trigrams (and substring matches) never
+# span two fields.
+_FIELD_SEP = "\x00"
+
+
+def normalizeText(s: Optional[str]) -> str:
+    """Casefold and collapse whitespace, the form used for both indexed text and queries."""
+    return " ".join(s.casefold().split()) if s else ""
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """An in-memory trigram inverted index of row ids.
+
+    Each row is indexed by the trigrams of its (normalized) field values. A query is split
+    into whitespace delimited terms and a row matches when every term is a substring of one of
+    its fields. Candidates come from intersecting trigram posting sets, smallest first, and are
+    then verified against the stored row text, so only a tiny fraction of rows is ever looked at.
+    """
+    def __init__(self):
+        self._postings = defaultdict(set)  # trigram -> {row_id, ...}
+        self._texts = {}                   # row_id -> normalized, field separated text
+
+    def __len__(self):
+        return len(self._texts)
+
+    def clear(self):
+        self._postings.clear()
+        self._texts.clear()
+
+    def update(self, row_id, fields: Iterable[Optional[str]]):
+        """Add or re-index `row_id`. Only the trigrams that changed are touched."""
+        text = _FIELD_SEP.join(normalizeText(f) for f in fields)
+        prev_text = self._texts.get(row_id)
+        if prev_text == text:
+            return
+
+        old_grams = _trigrams(prev_text) if prev_text is not None else set()
+        new_grams = _trigrams(text)
+
+        for gram in old_grams - new_grams:
+            posting = self._postings[gram]
+            posting.discard(row_id)
+            if not posting:
+                del self._postings[gram]
+        for gram in new_grams - old_grams:
+            self._postings[gram].add(row_id)
+
+        self._texts[row_id] = text
+
+    def remove(self, row_id):
+        text = self._texts.pop(row_id, None)
+        if text is None:
+            return
+
+        for gram in _trigrams(text):
+            posting = self._postings[gram]
+            posting.discard(row_id)
+            if not posting:
+                del self._postings[gram]
+
+    def search(self, query: str) -> Optional[Set]:
+        """Returns the set of matching row ids, or None when `query` is empty (i.e. match all)."""
+        terms = normalizeText(query).split()
+        if not terms:
+            return None
+
+        # Longest terms are the most selective
+        candidates = None
+        for term in sorted(terms, key=len, reverse=True):
+            candidates = self._candidates(term, candidates)
+            if not candidates:
+                return set()
+
+        # Trigram hits are only candidates, verify the full terms. Terms cannot span fields since
+        # they never contain the separator.
+        return {row_id for row_id in candidates
+                if all(term in self._texts[row_id] for term in terms)}
+
+    def _candidates(self, term: str, within: Optional[Set]) -> Set:
+        if len(term) >= 3:
+            postings = sorted((self._postings.get(gram, set()) for gram in _trigrams(term)),
+                              key=len)
+            result = within & postings[0] if within is not None else set(postings[0])
+            for posting in postings[1:]:
+                if not result:
+                    break
+                result &= posting
+            return result
+
+        # Terms shorter than a trigram have no postings, only the first keystroke or two of a
+        # query gets here.
+        rows = within if within is not None else self._texts
+        return {row_id for row_id in rows if term in self._texts[row_id]}
@@ -0,0 +1,201 @@
+import csv
+import json
+import logging
+from pathlib import Path
+from eyed3.core import Date
+from .core import GENRES, TAG_FIELDS, Genre, getTagValue
+from .memory import peekTags
+from .transforms import TransformChange
+
+log = logging.getLogger(__name__)
+
+PARQUET_UNAVAILABLE = ("Parquet snapshots require pyarrow, install the \"parquet\" extra: "
+                       "pip install \"Mop[parquet]\"")
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    log.info(PARQUET_UNAVAILABLE)
+    pyarrow = None
+
+__all__ = ["exportSnapshot", "readSnapshot", "diffSnapshot", "SNAPSHOT_COLUMNS",
+           "SNAPSHOT_FORMATS"]
+
+# Field -> its columns. Number/total pairs are two columns, so each column is a plain value.
+_FIELD_COLUMNS = {field: (field,) for field in TAG_FIELDS}
+_FIELD_COLUMNS["track_num"] = ("track_num", "track_total")
+_FIELD_COLUMNS["disc_num"] = ("disc_num", "disc_total")
+
+SNAPSHOT_COLUMNS = ("path",) + tuple(c for columns in _FIELD_COLUMNS.values() for c in columns)
+SNAPSHOT_FORMATS = [".csv", ".jsonl"] + ([".parquet"] if pyarrow else [])
+
+# Rows per Parquet row group, rows are written as each group fills.
+PARQUET_BATCH_ROWS = 10000
+
+
+def _encode(value) -> str:
+    """A field value as text, "" for None."""
+    if value is None:
+        return ""
+    return value.name if isinstance(value, Genre) else str(value)
+
+
+def _decode(field, texts: tuple):
+    """The field value of its column `texts`, raises ValueError for invalid values."""
+    if field in ("track_num", "disc_num"):
+        return tuple(int(t) if t else None for t in texts)
+
+    text = texts[0]
+    if not text:
+        return None
+    elif field.endswith("_date"):
+        return Date.parse(text)
+    elif field == "genre":
+        return GENRES.genre(text)
+    return text
+
+
+def _row(audio_file) -> list:
+    tag = peekTags(audio_file)[0]
+    row = [str(audio_file.path)]
+    for field in TAG_FIELDS:
+        value = getTagValue(tag, field) if tag else None
+        if field in ("track_num", "disc_num"):
+            row.extend(_encode(v) for v in (value or (None, None)))
+        else:
+            row.append(_encode(value))
+    return row
+
+
+def _format(filename) -> str:
+    suffix = Path(filename).suffix.lower()
+    if suffix == ".parquet" and pyarrow is None:
+        raise ValueError(PARQUET_UNAVAILABLE)
+    if suffix not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unsupported snapshot format: {suffix or filename} "
+                         f"(supported: {', '.join(SNAPSHOT_FORMATS)})")
+    return suffix
+
+
+def exportSnapshot(audio_files, filename) -> int:
+    """Write the tag fields of `audio_files` to `filename`, a row per file with a column per
+    value (SNAPSHOT_COLUMNS), all text with "" for no value. The format is that of the file's
+    suffix: .csv, .jsonl, or .parquet (with the "parquet" extra). Rows are written as they are
+    made, not held in memory. Returns the number of rows."""
+    fmt = _format(filename)
+    n = 0
+
+    if fmt == ".parquet":
+        schema = pyarrow.schema([(c, pyarrow.string()) for c in SNAPSHOT_COLUMNS])
+
+        def writeBatch(writer, batch):
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, pyarrow.string()) for column in zip(*batch)],
+                schema=schema))
+
+        with pyarrow.parquet.ParquetWriter(str(filename), schema) as writer:
+            batch = []
+            for audio_file in audio_files:
+                batch.append(_row(audio_file))
+                if len(batch) == PARQUET_BATCH_ROWS:
+                    writeBatch(writer, batch)
+                    n += len(batch)
+                    batch.clear()
+            if batch:
+                writeBatch(writer, batch)
+                n += len(batch)
+
+    else:
+        with open(filename, "w", encoding="utf8", newline="") as fp:
+            if fmt == ".csv":
+                writer = csv.writer(fp)
+                writer.writerow(SNAPSHOT_COLUMNS)
+                for audio_file in audio_files:
+                    writer.writerow(_row(audio_file))
+                    n += 1
+            else:
+                for audio_file in audio_files:
+                    fp.write(json.dumps(dict(zip(SNAPSHOT_COLUMNS, _row(audio_file))),
+                                        ensure_ascii=False) + "\n")
+                    n += 1
+
+    log.info(f"Exported {n} file(s) to {filename}")
+    return n
+
+
+def readSnapshot(filename) -> dict:
+    """The columns of snapshot `filename`, column -> list of text. Columns other than
+    SNAPSHOT_COLUMNS are ignored, and missing ones are left out (not diffed). A "path" column is
+    required."""
+    fmt = _format(filename)
+
+    if fmt == ".parquet":
+        names = pyarrow.parquet.read_schema(str(filename)).names
+        table = pyarrow.parquet.read_table(str(filename),
+                                           columns=[c for c in SNAPSHOT_COLUMNS if c in names])
+        columns = {name: ["" if v is None else str(v) for v in values]
+                   for name, values in table.to_pydict().items()}
+    else:
+        with open(filename, "r", encoding="utf8", newline="") as fp:
+            if fmt == ".csv":
+                rows = csv.DictReader(fp)
+            else:
+                rows = (json.loads(line) for line in fp if line.strip())
+
+            columns = None
+            for row in rows:
+                if columns is None:
+                    columns = {c: [] for c in SNAPSHOT_COLUMNS if c in row}
+                for column, values in columns.items():
+                    value = row.get(column)
+                    values.append("" if value is None else str(value))
+            columns = columns or {}
+
+    if "path" not in columns:
+        raise ValueError(f"Snapshot has no path column: {filename}")
+    return columns
+
+
+def diffSnapshot(columns: dict, audio_files) -> tuple:
+    """Compare snapshot `columns` (see readSnapshot) with the current tags of `audio_files`.
+    Returns (TransformChange list, paths of the snapshot not among `audio_files`).
+
+    The comparison is column by column, the snapshot's against the same column of the current
+    values, and only the values of changed cells are decoded. Invalid values are logged and
+    skipped.
+    """
+    by_path = {str(af.path): af for af in audio_files}
+    rows = [i for i, path in enumerate(columns["path"]) if path in by_path]
+    missing = [path for path in columns["path"] if path not in by_path]
+    files = [by_path[columns["path"][i]] for i in rows]
+
+    current = [_row(af) for af in files]
+    changed = {}  # (row, field) -> None, ordered
+    for index, column in enumerate(SNAPSHOT_COLUMNS[1:], 1):
+        if column not in columns:
+            continue
+        snapshot_values = columns[column]
+        field = next(f for f, cols in _FIELD_COLUMNS.items() if column in cols)
+        for n, (i, values) in enumerate(zip(rows, current)):
+            if snapshot_values[i] != values[index]:
+                changed[(n, field)] = None
+
+    changes = []
+    for n, field in sorted(changed, key=lambda k: (k[0], TAG_FIELDS.index(k[1]))):
+        audio_file, i = files[n], rows[n]
+        texts = tuple(columns[c][i] if c in columns else current[n][SNAPSHOT_COLUMNS.index(c)]
+                      for c in _FIELD_COLUMNS[field])
+        try:
+            new = _decode(field, texts)
+        except ValueError as ex:
+            log.error(f"Invalid snapshot value, {audio_file.path} {field}: {ex}")
+            continue
+
+        # Equal though differently written, e.g. "01" for 1
+        old = getTagValue(audio_file.tag, field)
+        if new != old:
+            changes.append(TransformChange(audio_file, field, old, new))
+
+    log.debug(f"Snapshot diff: {len(changes)} change(s), {len(missing)} file(s) not open")
+    return changes, missing
@@ -0,0 +1,401 @@
+import io
+import os
+import stat
+import time
+import logging
+import tempfile
+from pathlib import Path
+from collections import namedtuple
+from contextlib import contextmanager
+from .id3v1 import V1_TAG_SIZE
+
+log = logging.getLogger(__name__)
+
+__all__ = ["DirEntry", "LocalStorage", "MemoryStorage", "LatencyStorage", "ReadAheadFile",
+           "RegionsFile", "RegionMissError", "getStorage", "isLocal", "localCopy", "synchsafe",
+           "ID3_V2_HEADER_SIZE"]
+
+# A directory listing entry, `stat` is None for directories. `is_dir` and `stat` are of the
+# target of symlinks.
+DirEntry = namedtuple("DirEntry", ["path", "is_dir", "stat", "is_symlink"], defaults=[False])
+
+# Reads are of whole, aligned, chunks. Network filesystems favor few large reads over many
+# small ones, each a round trip.
+READ_ALIGN = 64 * 1024
+# Read at open: the ID3 v2 header and, for most files, the whole tag and first frames.
+READ_AHEAD_SIZE = 256 * 1024
+# Read past the end of an ID3 v2 tag, for the first MPEG frames (Xing/VBRI header).
+FRAME_READ_AHEAD_SIZE = 16 * 1024
+
+ID3_V2_HEADER_SIZE = 10
+
+
+class LocalStorage:
+    """File access through the OS, local or mounted (e.g. NFS, SMB) filesystems.
+
+    The storage interface, of every backend: `scandir`, `stat`, `realpath`, `open` (for reading),
+    `readRange`, `write`, `replace`, `rename` (never replacing), and `makedirs`.
+    """
+
+    def scandir(self, path):
+        """List directory `path`, DirEntry per entry. The type of entries is that of the listing
+        (no stat calls) and files are stat'ed once, symlinks followed."""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                    yield DirEntry(entry.path, is_dir, None if is_dir else entry.stat(),
+                                   entry.is_symlink())
+                except OSError as ex:
+                    log.warning(f"Listing error: {ex}")
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def realpath(self, path) -> str:
+        """`path` with symlinks resolved."""
+        return os.path.realpath(path)
+
+    def open(self, path):
+        return open(path, "rb", buffering=0)
+
+    def readRange(self, fp, offset, size) -> bytes:
+        """Read `size` bytes at `offset` of `fp` (returned by `open`), fewer at the end."""
+        if hasattr(os, "pread"):
+            return os.pread(fp.fileno(), size, offset)
+        fp.seek(offset)
+        return fp.read(size)
+
+    def write(self, path, data, offset=None):
+        """Write `data` at `offset` of existing file `path`, or as the whole file when None."""
+        if offset is None:
+            with open(path, "wb") as fp:
+                fp.write(data)
+            return
+
+        with open(path, "r+b", buffering=0) as fp:
+            if hasattr(os, "pwrite"):
+                os.pwrite(fp.fileno(), data, offset)
+            else:
+                fp.seek(offset)
+                fp.write(data)
+
+    def replace(self, src, dst):
+        os.replace(src, dst)
+
+    def rename(self, src, dst):
+        """Move `src` to `dst`, raising FileExistsError if `dst` exists, even if created by
+        another program or thread meanwhile. It is never replaced."""
+        try:
+            # Fails if dst exists, atomically
+            os.link(src, dst)
+        except FileExistsError:
+            raise
+        except OSError:
+            # No hard links (e.g. some SMB and FAT filesystems), the name is claimed instead
+            os.close(os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            try:
+                os.replace(src, dst)
+            except OSError:
+                os.unlink(dst)
+                raise
+            return
+
+        try:
+            os.unlink(src)
+        except OSError:
+            os.unlink(dst)
+            raise
+
+    def makedirs(self, path):
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+
+class MemoryStorage:
+    """Files in memory, path -> bytes, for tests and benchmarks. Directories are implied by the
+    paths of files."""
+
+    def __init__(self, files=None):
+        self._files = {}  # str path -> (bytearray, mtime_ns)
+        for path, data in (files or {}).items():
+            self.write(path, data)
+
+    def __contains__(self, path):
+        return str(path) in self._files
+
+    def __getitem__(self, path) -> bytes:
+        return bytes(self._files[str(path)][0])
+
+    def scandir(self, path):
+        prefix = str(path).rstrip(os.sep) + os.sep
+        dirs = set()
+        for file_path in list(self._files):
+            if file_path.startswith(prefix):
+                name, sep, _ = file_path[len(prefix):].partition(os.sep)
+                if sep:
+                    dirs.add(prefix + name)
+                else:
+                    yield DirEntry(file_path, False, self.stat(file_path))
+        for dir_path in sorted(dirs):
+            yield DirEntry(dir_path, True, None)
+
+    def stat(self, path):
+        try:
+            data, mtime_ns = self._files[str(path)]
+        except KeyError:
+            raise FileNotFoundError(f"No such file: {path}") from None
+        return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, len(data), mtime_ns / 1e9,
+                               mtime_ns / 1e9, mtime_ns / 1e9, None, None, None,
+                               mtime_ns, mtime_ns, mtime_ns))
+
+    def realpath(self, path) -> str:
+        # No symlinks
+        return str(path)
+
+    def open(self, path):
+        self.stat(path)
+        # Reads see the file as opened, as with a file replaced while open.
+        return io.BytesIO(self[path])
+
+    def readRange(self, fp, offset, size) -> bytes:
+        return fp.getbuffer()[offset:offset + size].tobytes()
+
+    def write(self, path, data, offset=None):
+        if offset is None:
+            buffer = bytearray(data)
+        else:
+            buffer = self._files[str(path)][0]
+            buffer[offset:offset + len(data)] = data
+        self._files[str(path)] = (buffer, time.time_ns())
+
+    def replace(self, src, dst):
+        self.stat(src)
+        self._files[str(dst)] = self._files.pop(str(src))
+
+    def rename(self, src, dst):
+        if dst in self:
+            raise FileExistsError(f"File exists: {dst}")
+        self.replace(src, dst)
+
+    def makedirs(self, path):
+        # Implied by the paths of files
+        pass
+
+
+class LatencyStorage:
+    """Wraps a storage adding `latency` seconds to each request, e.g. a network filesystem's
+    round trip, so remote loading can be measured locally."""
+
+    def __init__(self, storage=None, latency=0.005):
+        self._storage = storage or LocalStorage()
+        self.latency = latency
+
+    def scandir(self, path):
+        time.sleep(self.latency)
+        for entry in self._storage.scandir(path):
+            if entry.stat is not None:
+                time.sleep(self.latency)
+            yield entry
+
+    def stat(self, path):
+        time.sleep(self.latency)
+        return self._storage.stat(path)
+
+    def realpath(self, path) -> str:
+        time.sleep(self.latency)
+        return self._storage.realpath(path)
+
+    def open(self, path):
+        time.sleep(self.latency)
+        return self._storage.open(path)
+
+    def readRange(self, fp, offset, size) -> bytes:
+        time.sleep(self.latency)
+        return self._storage.readRange(fp, offset, size)
+
+    def write(self, path, data, offset=None):
+        time.sleep(self.latency)
+        self._storage.write(path, data, offset)
+
+    def replace(self, src, dst):
+        time.sleep(self.latency)
+        self._storage.replace(src, dst)
+
+    def rename(self, src, dst):
+        time.sleep(self.latency)
+        self._storage.rename(src, dst)
+
+    def makedirs(self, path):
+        time.sleep(self.latency)
+        self._storage.makedirs(path)
+
+
+def getStorage(config):
+    """The storage of `config`, `storage_latency` (seconds) adds latency."""
+    storage = LocalStorage()
+    if config.storage_latency:
+        log.info(f"Storage latency: {config.storage_latency * 1000:.1f} ms")
+        storage = LatencyStorage(storage, config.storage_latency)
+    return storage
+
+
+def isLocal(storage) -> bool:
+    """Whether the files of `storage` are local paths, None being eyeD3's own (local) reads."""
+    return storage is None or isinstance(storage, LocalStorage)
+
+
+# Copies are read in chunks of this size.
+COPY_SIZE = 16 * READ_ALIGN
+
+
+@contextmanager
+def localCopy(storage, path):
+    """A local file path of `path`, for code that only writes to local files (e.g. eyeD3's tag
+    saves). For local storage it is `path` itself, else a temporary copy that is written back,
+    as a whole and replacing `path`, when the context exits without error."""
+    if isLocal(storage):
+        yield path
+        return
+
+    with tempfile.TemporaryDirectory(prefix="mop-") as tmp_dir:
+        tmp_path = Path(tmp_dir) / Path(path).name
+        with storage.open(path) as src, open(tmp_path, "wb") as dst:
+            offset = 0
+            while data := storage.readRange(src, offset, COPY_SIZE):
+                dst.write(data)
+                offset += len(data)
+
+        yield tmp_path
+
+        part_path = f"{path}.mop-part"
+        storage.write(part_path, tmp_path.read_bytes())
+        storage.replace(part_path, path)
+
+
+def synchsafe(data: bytes) -> int:
+    """The value of 4 bytes of 7 bits, e.g. the size of an ID3 v2 header."""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+class _RandomAccessFile(io.RawIOBase):
+    """A read-only, seekable, file of `size` bytes, whose reads are those of `readAt`."""
+    def __init__(self, path, size):
+        super().__init__()
+        self.name = str(path)
+        self.size = size
+        self._pos = 0
+
+    def readAt(self, offset, size) -> bytes:
+        raise NotImplementedError()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.readAt(self._pos, len(buffer))
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        if base + offset < 0:
+            raise OSError(f"Invalid seek position: {base + offset}")
+        self._pos = base + offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class ReadAheadFile(_RandomAccessFile):
+    """A read-only file of `storage` read in aligned chunks of READ_ALIGN, which are kept.
+
+    At open the ID3 v2 tag and first frames are read, in one read when within READ_AHEAD_SIZE
+    or two otherwise, and the last chunk (ID3 v1 tag). Parsing tags and MPEG headers then reads
+    no more. `name` is the path, as for files eyeD3 opens.
+    """
+    def __init__(self, storage, path, size):
+        super().__init__(path, size)
+        self._storage = storage
+        self._fp = storage.open(path)
+        self._chunks = {}  # chunk index -> bytes
+
+        self.prefetch(0, READ_AHEAD_SIZE)
+        header = self.readAt(0, ID3_V2_HEADER_SIZE)
+        self.head_size = min(FRAME_READ_AHEAD_SIZE, size)
+        if len(header) == ID3_V2_HEADER_SIZE and header[:3] == b"ID3":
+            self.head_size = min(ID3_V2_HEADER_SIZE + synchsafe(header[6:10])
+                                 + FRAME_READ_AHEAD_SIZE, size)
+            self.prefetch(0, self.head_size)
+        self.prefetch(size - V1_TAG_SIZE, V1_TAG_SIZE)
+
+    def prefetch(self, offset, size):
+        """Read the chunks of `offset` to `offset + size` not yet read, in a single read."""
+        first = max(offset, 0) // READ_ALIGN
+        last = (min(offset + size, self.size) - 1) // READ_ALIGN
+        while first <= last and first in self._chunks:
+            first += 1
+        if first > last:
+            return
+
+        data = self._storage.readRange(self._fp, first * READ_ALIGN,
+                                       (last - first + 1) * READ_ALIGN)
+        for i in range(0, len(data), READ_ALIGN):
+            self._chunks[first + i // READ_ALIGN] = data[i:i + READ_ALIGN]
+
+    def readAt(self, offset, size) -> bytes:
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b""
+        self.prefetch(offset, end - offset)
+
+        parts = []
+        while offset < end:
+            index, start = divmod(offset, READ_ALIGN)
+            part = self._chunks.get(index, b"")[start:start + end - offset]
+            if not part:
+                # Shorter than its stat size, e.g. truncated since.
+                break
+            parts.append(part)
+            offset += len(part)
+        return b"".join(parts)
+
+    def regions(self) -> tuple:
+        """The (head, tail) of the file read at open, the tags and first frames, for a
+        RegionsFile."""
+        tail_start = max(self.size - V1_TAG_SIZE, self.head_size)
+        return self.readAt(0, self.head_size), self.readAt(tail_start, self.size - tail_start)
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+            self._chunks.clear()
+        super().close()
+
+
+class RegionMissError(OSError):
+    """A read of a RegionsFile outside of its regions."""
+
+
+class RegionsFile(_RandomAccessFile):
+    """A file of `size` bytes of which only the `head` and `tail` bytes are known, e.g. kept
+    from a ReadAheadFile. Reads outside of those raise RegionMissError."""
+    def __init__(self, path, size, head, tail):
+        super().__init__(path, size)
+        self._head, self._tail = head, tail
+
+    def readAt(self, offset, size) -> bytes:
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b""
+        elif end <= len(self._head):
+            return self._head[offset:end]
+
+        tail_start = self.size - len(self._tail)
+        if offset >= tail_start:
+            return self._tail[offset - tail_start:end - tail_start]
+        raise RegionMissError(f"Read of {offset}-{end} not cached: {self.name}")
@@ -0,0 +1,101 @@
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from .config import DEFAULT_TAG_CACHE_FILE, getConfig
+
+log = logging.getLogger(__name__)
+
+__all__ = ["TagCache", "getTagCache"]
+
+# Global cache
+_tag_cache = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS regions (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    head BLOB,
+    tail BLOB,
+    stored REAL
+);
+CREATE INDEX IF NOT EXISTS regions_stored ON regions (stored);
+"""
+
+# Cache size limit, the oldest entries are dropped past it. Tags with images are large.
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class TagCache:
+    """Persistent SQLite cache of the regions of files holding their tags and first MPEG frames,
+    (head, tail) bytes as read by mop.storage.ReadAheadFile, so files are parsed again without
+    reading them.
+
+    As with FileCache, regions are only returned while the file's (mtime, size) still match.
+    Writes are committed by `commit`. Safe to use from several threads.
+    """
+    def __init__(self, filename=DEFAULT_TAG_CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(filename), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM regions").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        """The size of the cached regions, in bytes."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(head) + LENGTH(tail)), 0) FROM regions"
+            ).fetchone()[0]
+
+    def get(self, path, stat_result):
+        """The (head, tail) of `path`, or None if not cached or the file changed since."""
+        with self._lock:
+            row = self._db.execute("SELECT mtime_ns, size, head, tail FROM regions WHERE path = ?",
+                                   (str(path),)).fetchone()
+        if row is None or row[:2] != (stat_result.st_mtime_ns, stat_result.st_size):
+            return None
+        return row[2], row[3]
+
+    def set(self, path, stat_result, head, tail):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO regions VALUES (?, ?, ?, ?, ?, ?)",
+                             (str(path), stat_result.st_mtime_ns, stat_result.st_size,
+                              head, tail, time.time()))
+
+    def commit(self):
+        """Commit changes, first dropping the oldest entries past `max_bytes`."""
+        with self._lock:
+            total = 0
+            rows = self._db.execute("SELECT path, LENGTH(head) + LENGTH(tail) FROM regions "
+                                    "ORDER BY stored DESC")
+            expired = []
+            for path, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    expired.append((path,))
+            if expired:
+                self._db.executemany("DELETE FROM regions WHERE path = ?", expired)
+                log.debug(f"Tag cache dropped {len(expired)} old entries")
+            self._db.commit()
+
+
+def getTagCache() -> TagCache:
+    """Get the application tag cache, of size tag_cache_size (config)."""
+    global _tag_cache
+
+    if _tag_cache is None:
+        _tag_cache = TagCache(max_bytes=getConfig().tag_cache_size or DEFAULT_MAX_BYTES)
+    return _tag_cache
@@ -0,0 +1,322 @@
+import re
+import string
+import difflib
+import logging
+from pathlib import Path
+from collections import namedtuple
+from .core import TAG_FIELDS, GENRES, getTagValue, setTagValue, normalizeGenre
+from .memory import peekTags
+
+log = logging.getLogger(__name__)
+
+__all__ = ["Transform", "RegexReplace", "TitleCase", "FilenameToTags", "TagsToFilename",
+           "GenreCleanup", "TransformPipeline", "TransformChange", "FILENAME"]
+
+# Pseudo field for file renames, the value is the new Path.
+FILENAME = "filename"
+
+# Fields ID3 v1 tags support, changes to others are not applied to a second v1 tag.
+V1_FIELDS = ("title", "artist", "album", "track_num", "genre", "comment")
+
+TransformChange = namedtuple("TransformChange", ["audio_file", "field", "old", "new"])
+
+
+class Transform:
+    """A compiled transform.
+
+    `transform(audio_file, values)` is given the file's current field values (a dict of
+    TAG_FIELDS, values of earlier transforms in a pipeline included) and returns a dict of the
+    fields it changes.
+    """
+    fields = ()
+
+    def prepare(self, audio_files):
+        """Called once before a pass over `audio_files`, to precompute anything per run."""
+        pass
+
+    def transform(self, audio_file, values) -> dict:
+        raise NotImplementedError()
+
+
+class RegexReplace(Transform):
+    def __init__(self, fields, pattern, repl, flags=0):
+        self.fields = (fields,) if isinstance(fields, str) else tuple(fields)
+        self._regex = re.compile(pattern, flags)
+        self._repl = repl
+
+    def transform(self, audio_file, values):
+        changes = {}
+        for field in self.fields:
+            value = values.get(field)
+            if isinstance(value, str):
+                new_value = self._regex.sub(self._repl, value)
+                if new_value != value:
+                    changes[field] = new_value
+        return changes
+
+
+class TitleCase(Transform):
+    # Words kept lower case, unless first or last
+    SMALL_WORDS = frozenset("a an and as at but by for in nor of on or the to vs".split())
+
+    def __init__(self, fields=("title", "artist", "album")):
+        self.fields = (fields,) if isinstance(fields, str) else tuple(fields)
+
+    @classmethod
+    def titleCase(cls, s: str) -> str:
+        words = s.split(" ")
+        last = len(words) - 1
+        for i, word in enumerate(words):
+            if not word or (word.isupper() and len(word) > 1):
+                # Acronyms as is
+                continue
+            elif 0 < i < last and word.lower() in cls.SMALL_WORDS:
+                words[i] = word.lower()
+            else:
+                words[i] = word[0].upper() + word[1:].lower()
+        return " ".join(words)
+
+    def transform(self, audio_file, values):
+        changes = {}
+        for field in self.fields:
+            value = values.get(field)
+            if isinstance(value, str):
+                new_value = self.titleCase(value)
+                if new_value != value:
+                    changes[field] = new_value
+        return changes
+
+
+# Template fields that are numbers; num/total tag fields are split into two template fields.
+_NUMBER_FIELDS = ("track_num", "track_total", "disc_num", "disc_total")
+
+
+class FilenameToTags(Transform):
+    """Parse tag values out of filenames with a pattern such as "{track_num} - {title}".
+
+    The pattern is matched against the filename stem. Besides TAG_FIELDS names, pattern fields
+    may be track_total and disc_total. A pattern field may also be {} to skip over text.
+    """
+    def __init__(self, pattern):
+        regex = ""
+        for literal, field, _, _ in string.Formatter().parse(pattern):
+            regex += re.escape(literal)
+            if field is None:
+                continue
+            elif field == "":
+                regex += ".*?"
+            elif field in _NUMBER_FIELDS:
+                regex += fr"(?P<{field}>\d+)"
+            elif field in TAG_FIELDS:
+                regex += fr"(?P<{field}>.+?)"
+            else:
+                raise ValueError(f"Unsupported pattern field: {field}")
+
+        self._regex = re.compile(regex + "$")
+        self.fields = tuple({_numTotalField(f) for f in self._regex.groupindex})
+
+    def transform(self, audio_file, values):
+        match = self._regex.match(Path(audio_file.path).stem)
+        if not match:
+            return {}
+
+        changes = {}
+        for field, value in match.groupdict().items():
+            if field in _NUMBER_FIELDS:
+                tag_field = _numTotalField(field)
+                curr = changes.get(tag_field, values.get(tag_field)) or (None, None)
+                value = (int(value), curr[1]) if field.endswith("_num") else (curr[0], int(value))
+                field = tag_field
+            else:
+                value = value.strip()
+
+            if value != values.get(field):
+                changes[field] = value
+        return changes
+
+
+class TagsToFilename(Transform):
+    """Rename files from a str.format template such as "{track_num:02d} - {title}".
+
+    Template fields are the TAG_FIELDS names, with track_num, track_total, disc_num, and
+    disc_total as ints. The file suffix is kept and characters unsafe in filenames replaced.
+    Templates may include "/" to place files in subdirectories, relative to `base_dir` (the
+    file's directory by default) or anywhere when absolute. Files missing a value used by the
+    template are skipped.
+    """
+    fields = (FILENAME,)
+    UNSAFE_CHARS_RE = re.compile(r'[\x00-\x1f/\\:*?"<>|]')
+
+    def __init__(self, template, replace_char="_", base_dir=None):
+        self._template = template
+        self._replace_char = replace_char
+        self._base_dir = Path(base_dir) if base_dir else None
+        # Also fails early on malformed templates
+        self._template_fields = {field for _, field, _, _ in string.Formatter().parse(template)
+                                 if field}
+
+    def formatValues(self, values) -> dict:
+        fmt_values = {}
+        for field in TAG_FIELDS:
+            value = values.get(field)
+            if field in ("track_num", "disc_num"):
+                num, total = value or (None, None)
+                fmt_values[field] = num or 0
+                fmt_values[field.replace("_num", "_total")] = total or 0
+            else:
+                value = str(value) if value is not None else ""
+                fmt_values[field] = self.UNSAFE_CHARS_RE.sub(self._replace_char, value).strip()
+        return fmt_values
+
+    def transform(self, audio_file, values):
+        path = Path(audio_file.path)
+        fmt_values = self.formatValues(values)
+        if not all(fmt_values.get(field) for field in self._template_fields):
+            return {}
+
+        try:
+            name = self._template.format(**fmt_values)
+        except (KeyError, ValueError) as ex:
+            log.warning(f"Filename template error, {path}: {ex}")
+            return {}
+
+        parts = [p.strip() for p in name.split("/") if p.strip()]
+        base_dir = Path("/") if self._template.startswith("/") else (self._base_dir or path.parent)
+        new_path = Path(base_dir, *parts[:-1], parts[-1] + path.suffix)
+        return {FILENAME: new_path} if new_path != path else {}
+
+
+# Genre spellings fuzzy matching cannot relate, spelling -> genre. More can be added with
+# `genre_aliases` in mop_cfg.py.
+DEFAULT_GENRE_ALIASES = {
+    "RnB": "R&B",
+    "DnB": "Drum & Bass",
+    "Electronica": "Electronic",
+    "Prog Rock": "Progressive Rock",
+    "Alt Rock": "Alternative Rock",
+}
+
+
+def _genreKey(name) -> str:
+    """Fuzzy genre key, ignoring case, spacing, and punctuation: "Hip Hop" is "hip-hop"."""
+    return re.sub(r"[\W_]+", "", normalizeGenre(name).replace("&", "and"))
+
+
+class GenreCleanup(Transform):
+    """Normalize genre spellings to the standard and registered custom genres.
+
+    A genre is mapped by `aliases` (spelling -> genre), then by matching the genres ignoring
+    case, spacing, and punctuation, and last by the closest (difflib) name above `cutoff`.
+    The mapping of every distinct genre in the files is computed once, in `prepare`.
+    """
+    fields = ("genre",)
+
+    def __init__(self, aliases=None, cutoff=0.85):
+        self._aliases = dict(DEFAULT_GENRE_ALIASES)
+        self._aliases.update(aliases or {})
+        self._cutoff = cutoff
+        self._lookup = {}  # genre name -> genre name to use
+
+    def prepare(self, audio_files):
+        # Rebuilt per run, custom genres may have been added.
+        table = {_genreKey(GENRES[gid]): GENRES[gid] for gid in GENRES.ids}
+        table.update({_genreKey(alias): name for alias, name in self._aliases.items()})
+        keys = list(table)
+
+        tags = (peekTags(af)[0] for af in audio_files)
+        names = {tag.genre.name for tag in tags if tag and tag.genre and tag.genre.name}
+        self._lookup = {}
+        for name in names:
+            key = _genreKey(name)
+            if key not in table and self._cutoff:
+                close = difflib.get_close_matches(key, keys, n=1, cutoff=self._cutoff)
+                key = close[0] if close else key
+            if key in table:
+                self._lookup[name] = table[key]
+
+        log.debug(f"Genre cleanup: {len(self._lookup)} of {len(names)} genre(s) mapped")
+
+    def transform(self, audio_file, values):
+        genre = values.get("genre")
+        name = self._lookup.get(genre.name) if genre else None
+        if name and name != genre.name:
+            return {"genre": GENRES.genre(name)}
+        return {}
+
+
+def _numTotalField(field):
+    return field.replace("_total", "_num")
+
+
+class TransformPipeline:
+    """Composes transforms, applied in order with each seeing the results of those before it."""
+    def __init__(self, *transforms):
+        self.transforms = list(transforms)
+
+    def preview(self, audio_files) -> list:
+        """Compute all changes, in one pass over `audio_files`, without modifying anything."""
+        fields = {f for t in self.transforms for f in t.fields if f != FILENAME}
+        # Fields a template may reference
+        if any(isinstance(t, TagsToFilename) for t in self.transforms):
+            fields.update(TAG_FIELDS)
+
+        audio_files = list(audio_files)
+        for transform in self.transforms:
+            transform.prepare(audio_files)
+
+        changes = []
+        for audio_file in audio_files:
+            tag = peekTags(audio_file)[0]
+            if tag is None:
+                continue
+
+            values = {f: getTagValue(tag, f) for f in fields}
+            new_values = dict(values)
+            for transform in self.transforms:
+                new_values.update(transform.transform(audio_file, new_values))
+
+            for field, new_value in new_values.items():
+                old_value = values.get(field, Path(audio_file.path) if field == FILENAME else None)
+                if new_value != old_value:
+                    changes.append(TransformChange(audio_file, field, old_value, new_value))
+
+        log.debug(f"Transform preview: {len(changes)} change(s)")
+        return changes
+
+    @staticmethod
+    def apply(changes, journal=None) -> list:
+        """Apply previewed tag changes, recording them in `journal` if given. The FILENAME
+        changes are not applied but returned, for the caller to rename."""
+        renames = []
+        for change in changes:
+            if change.field == FILENAME:
+                renames.append(change)
+                continue
+
+            audio_file = change.audio_file
+            for tag in (audio_file.tag, audio_file.second_v1_tag):
+                if tag is None or (tag.isV1() and change.field not in V1_FIELDS):
+                    continue
+
+                old_value = getTagValue(tag, change.field)
+                if old_value != change.new:
+                    setTagValue(tag, change.field, change.new)
+                    audio_file.is_dirty = True
+                    if journal is not None:
+                        journal.record(audio_file, tag, change.field, old_value, change.new)
+
+        return renames
+
+
+_TEXT_FIELDS = ("title", "artist", "album", "album_artist")
+
+# Transforms available in the Tools menu, more can be added with `transforms` in mop_cfg.py
+DEFAULT_TRANSFORMS = {
+    "Title Case": TransformPipeline(TitleCase()),
+    "Clean Whitespace": TransformPipeline(RegexReplace(_TEXT_FIELDS, r"^\s+|\s+$", ""),
+                                          RegexReplace(_TEXT_FIELDS, r"\s{2,}", " ")),
+    "Tags From Filename: {track_num} - {title}":
+        TransformPipeline(FilenameToTags("{track_num} - {title}")),
+    "Rename: {track_num:02d} - {title}":
+        TransformPipeline(TagsToFilename("{track_num:02d} - {title}")),
+}
@@ -0,0 +1,132 @@
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+from .core import setTagValue
+
+log = logging.getLogger(__name__)
+
+__all__ = ["Change", "UndoJournal"]
+
+# A single tag field edit. `slot` is the AudioFile attribute holding the tag ("tag" or
+# "second_v1_tag") rather than the tag itself, since saving replaces the tag objects.
+Change = namedtuple("Change", ["audio_file", "slot", "field", "old", "new"])
+
+
+class UndoJournal:
+    """Undo/redo history of tag edits, recorded as per field deltas.
+
+    Changes recorded within `transaction()` are undone and redone as one. A change recorded
+    outside of a transaction that edits the same field as the previous lone change is merged
+    into it, so typing a value is a single undo step.
+
+    `on_change(audio_file, slot, field, value)`, if given, is called for every value recorded,
+    undone, or redone.
+    """
+    def __init__(self, max_transactions=None, on_change=None):
+        self._undo = []
+        self._redo = []
+        self._max_transactions = max_transactions
+        self._transaction = None
+        self._transaction_depth = 0
+        self._merge_allowed = False
+        self._on_change = on_change
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._merge_allowed = False
+
+    @staticmethod
+    def tagSlot(audio_file, tag) -> str:
+        if tag is audio_file.tag:
+            return "tag"
+        elif tag is audio_file.second_v1_tag:
+            return "second_v1_tag"
+        raise ValueError("Tag does not belong to audio file")
+
+    def record(self, audio_file, tag, field, old, new):
+        if old == new:
+            return
+
+        change = Change(audio_file, self.tagSlot(audio_file, tag), field, old, new)
+        self._redo.clear()
+        if self._on_change:
+            self._on_change(audio_file, change.slot, field, new)
+
+        if self._transaction is not None:
+            self._transaction.append(change)
+            return
+
+        prev = self._undo[-1] if self._undo and self._merge_allowed else None
+        if prev and len(prev) == 1 and prev[0][:3] == change[:3]:
+            prev[0] = prev[0]._replace(new=new)
+        else:
+            self._push([change])
+        self._merge_allowed = True
+
+    @contextmanager
+    def transaction(self):
+        """Group all changes recorded within the context into one undo step."""
+        if self._transaction_depth == 0:
+            self._transaction = []
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                if self._transaction:
+                    self._push(self._transaction)
+                self._transaction = None
+                self._merge_allowed = False
+
+    def _push(self, changes):
+        self._undo.append(changes)
+        if self._max_transactions and len(self._undo) > self._max_transactions:
+            del self._undo[0]
+
+    def undo(self) -> list:
+        """Revert the last transaction, returns the changes reverted."""
+        if not self._undo:
+            return []
+
+        changes = self._undo.pop()
+        self._apply(reversed(changes), undo=True)
+        self._redo.append(changes)
+        self._merge_allowed = False
+        return changes
+
+    def redo(self) -> list:
+        """Reapply the last undone transaction, returns the changes applied."""
+        if not self._redo:
+            return []
+
+        changes = self._redo.pop()
+        self._apply(changes, undo=False)
+        self._undo.append(changes)
+        self._merge_allowed = False
+        return changes
+
+    def _apply(self, changes, undo):
+        n = 0
+        for change in changes:
+            tag = getattr(change.audio_file, change.slot)
+            if tag is None:
+                log.warning(f"Tag no longer exists, skipping: {change.audio_file.path}")
+                continue
+
+            value = change.old if undo else change.new
+            setTagValue(tag, change.field, value)
+            change.audio_file.is_dirty = True
+            if self._on_change:
+                self._on_change(change.audio_file, change.slot, change.field, value)
+            n += 1
+        log.debug(f"{'Undo' if undo else 'Redo'}: {n} change(s)")
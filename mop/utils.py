@@ -1,31 +1,308 @@
 import logging
+import weakref
+import itertools
 import eyed3
 
 from pathlib import Path
 from typing import Optional
+from eyed3 import core, id3
 from eyed3.id3 import ID3_V1, ID3_DEFAULT_VERSION
 from eyed3.core import AudioFile
+from eyed3.mp3 import Mp3AudioFile, Mp3AudioInfo, Mp3Exception, EXTENSIONS as MP3_EXTENSIONS
+from eyed3.mp3 import headers
 from .config import getConfig
+from .merge import loadValues
+from .editlog import fileStamp
+from .storage import (
+    LocalStorage, ReadAheadFile, RegionsFile, RegionMissError, getStorage, isLocal
+)
+from .id3v1 import parseV1Tag, V1_TAG_SIZE
+from .scan import DirectoryScan, ScanFilter, MAX_IN_FLIGHT
+from .tagcache import getTagCache
 
 log = logging.getLogger(__name__)
 
 
-def eyed3_load(path) -> Optional[AudioFile]:
+class StorageMp3AudioInfo(Mp3AudioInfo):
+    """Mp3AudioInfo of a file of size `size_bytes`, which Mp3AudioInfo gets with os.stat of the
+    file's name, so only works for local files. Otherwise the same, for files of other storage
+    (local files use Mp3AudioInfo itself)."""
+    def __init__(self, file_obj, start_offset, tag, size_bytes):
+        core.AudioInfo.__init__(self)
+        self.xing_header = self.vbri_header = self.lame_tag = None
+
+        self.mp3_header = None
+        while self.mp3_header is None:
+            header_pos, header_int, _ = headers.findHeader(file_obj, start_offset)
+            if not header_int:
+                raise Mp3Exception(f"Unable to find a valid mp3 frame in '{file_obj.name}'")
+            try:
+                self.mp3_header = headers.Mp3Header(header_int)
+            except Mp3Exception:
+                start_offset += 4
+
+        file_obj.seek(header_pos)
+        mp3_frame = file_obj.read(self.mp3_header.frame_length)
+        if b"Xing" in mp3_frame or b"Info" in mp3_frame:
+            self.xing_header = headers.XingHeader()
+            if not self.xing_header.decode(mp3_frame):
+                self.xing_header = None
+        elif b"VBRI" in mp3_frame:
+            self.vbri_header = headers.VbriHeader()
+            if not self.vbri_header.decode(mp3_frame):
+                self.vbri_header = None
+        self.lame_tag = headers.LameHeader(mp3_frame)
+
+        self.size_bytes = size_bytes
+        if self.xing_header and self.xing_header.vbr:
+            tpf = headers.timePerFrame(self.mp3_header, True)
+            self.time_secs = tpf * self.xing_header.numFrames
+        elif self.vbri_header and self.vbri_header.version == 1:
+            tpf = headers.timePerFrame(self.mp3_header, True)
+            self.time_secs = tpf * self.vbri_header.num_frames
+        else:
+            tpf = headers.timePerFrame(self.mp3_header, False)
+            length = size_bytes
+            if tag and tag.isV2():
+                # Mp3AudioInfo does not subtract a v1 tag after it (its check compares bytes to
+                # str), neither is it here, for the same durations.
+                length -= tag.header.SIZE + tag.header.tag_size
+            elif tag and tag.isV1():
+                length -= V1_TAG_SIZE
+            self.time_secs = (length / self.mp3_header.frame_length) * tpf
+
+        if self.xing_header and self.xing_header.vbr and self.xing_header.numFrames:
+            self.bit_rate = (True, int((self.xing_header.numBytes * 8)
+                                       / (tpf * self.xing_header.numFrames * 1000)))
+        else:
+            self.bit_rate = (False, self.mp3_header.bit_rate)
+
+        self.sample_freq = self.mp3_header.sample_freq
+        self.mode = self.mp3_header.mode
+
+
+# Incremented on each tag access, the order of last use of evictable files.
+_tag_access_clock = itertools.count()
+# Files whose tags were used, restored, or evicted since last taken (see takeTouchedFiles), for
+# measuring only those (see mop.memory.MemoryMonitor).
+_touched_files = weakref.WeakSet()
+
+
+def takeTouchedFiles() -> set:
+    """The ReadAheadMp3AudioFile's touched since the last call."""
+    touched = set(_touched_files)
+    _touched_files.clear()
+    return touched
+
+
+class ReadAheadMp3AudioFile(Mp3AudioFile):
+    """An Mp3AudioFile read through a ReadAheadFile of `storage`, i.e. in a few large reads, or
+    from the cached `regions` of the file (see mop.tagcache) without reading it, raising
+    RegionMissError if they do not hold all it reads. The ID3 v1 tag of a file with a v2 tag is
+    read too, as `second_v1_tag`. `regions` are those read, after, until cached.
+
+    The tags can be evicted, to save memory, and are parsed again on next use from the tag
+    cache, or the file if the cache no longer has them. `peekTags` reads them without that.
+    `selected_tag` is kept as the slot selected, so it is the same tag once restored.
+    """
+    def __init__(self, path, storage, stat_result, regions=None):
+        self._storage = storage
+        self._stat_result = stat_result
+        self._second_v1_tag = None
+        self._selected_slot = None
+        self.evicted = False
+        self.last_access = next(_tag_access_clock)
+        self.regions = regions
+        super().__init__(path)
+
+    @property
+    def tag(self):
+        self._useTags()
+        return self._tag
+
+    @tag.setter
+    def tag(self, t):
+        self.evicted = False
+        Mp3AudioFile.tag.fset(self, t)
+
+    @property
+    def second_v1_tag(self):
+        self._useTags()
+        return self._second_v1_tag
+
+    @second_v1_tag.setter
+    def second_v1_tag(self, t):
+        self._second_v1_tag = t
+
+    @property
+    def selected_tag(self):
+        self._useTags()
+        return getattr(self, f"_{self._selected_slot}") if self._selected_slot else None
+
+    @selected_tag.setter
+    def selected_tag(self, t):
+        if t is None:
+            self._selected_slot = None
+        elif t is self._tag:
+            self._selected_slot = "tag"
+        elif t is self._second_v1_tag:
+            self._selected_slot = "second_v1_tag"
+        else:
+            raise ValueError("Tag does not belong to audio file")
+
+    @property
+    def resident_tags(self) -> tuple:
+        """The (tag, second_v1_tag) in memory, Nones when evicted. Not a use of the tags."""
+        return self._tag, self._second_v1_tag
+
+    def peekTags(self) -> tuple:
+        """The (tag, second_v1_tag), for reading values. Evicted tags are parsed but not kept,
+        the file stays evicted. Not a use of the tags."""
+        if not self.evicted:
+            return self._tag, self._second_v1_tag
+        return self._parseTags()[:2]
+
+    def evict(self):
+        """Drop the tags from memory, the file must not have unsaved changes."""
+        self._tag = self._second_v1_tag = None
+        self.evicted = True
+        _touched_files.add(self)
+
+    def _useTags(self):
+        self.last_access = next(_tag_access_clock)
+        _touched_files.add(self)
+        if self.evicted:
+            self.evicted = False
+            self._restoreTags()
+
+    def _parseTags(self) -> tuple:
+        """The (tag, second_v1_tag, stat_result) of the file, from the tag cache if it has them
+        for the file as loaded, else read (`stat_result` being the file's now)."""
+        stat_result = self.load_stat
+        regions = getTagCache().get(self.path, stat_result)
+        try:
+            if regions is None:
+                raise RegionMissError(f"Not cached: {self.path}")
+            with RegionsFile(self.path, stat_result.st_size, *regions) as file_obj:
+                return self._readTags(file_obj)[:2] + (stat_result,)
+        except RegionMissError as ex:
+            log.debug(f"Tag cache miss, reading the file: {ex}")
+            stat_result = self._storage.stat(self.path)
+            with ReadAheadFile(self._storage, self.path, stat_result.st_size) as file_obj:
+                return self._readTags(file_obj)[:2] + (stat_result,)
+
+    def _restoreTags(self):
+        self._tag, self._second_v1_tag, stat_result = self._parseTags()
+        if self._tag is None:
+            self.initTag(getConfig().preferred_id3_version or ID3_DEFAULT_VERSION)
+        if stat_result is not self.load_stat:
+            if fileStamp(stat_result) != fileStamp(self.load_stat):
+                log.info(f"File changed since loaded, using its current tags: {self.path}")
+            self.load_stat = stat_result
+            self.load_values = loadValues(self)
+
+    def _readTags(self, file_obj) -> tuple:
+        """Parse the tags of `file_obj`, returns (tag, second_v1_tag, offset of the MPEG
+        frames)."""
+        if file_obj.readAt(0, 3) != b"ID3":
+            # No v2 tag, only the fixed v1 struct to unpack
+            return parseV1Tag(file_obj.readAt(file_obj.size - V1_TAG_SIZE, V1_TAG_SIZE),
+                              self.path), None, 0
+
+        tag = id3.Tag()
+        tag_found = tag.parse(file_obj)
+        if tag_found and tag.isV2():
+            v1_tag = id3.Tag()
+            return (tag, v1_tag if v1_tag.parse(file_obj, ID3_V1) else None,
+                    tag.header.SIZE + tag.header.tag_size)
+
+        return tag if tag_found else None, None, 0
+
+    def _read(self):
+        # As Mp3AudioFile._read, but for the file object
+        size = self._stat_result.st_size
+        if self.regions:
+            file_obj = RegionsFile(self.path, size, *self.regions)
+        else:
+            file_obj = ReadAheadFile(self._storage, self.path, size)
+
+        with file_obj:
+            self._tag, self._second_v1_tag, mp3_offset = self._readTags(file_obj)
+            try:
+                if isLocal(self._storage):
+                    # The file's name is its path
+                    self._info = Mp3AudioInfo(file_obj, mp3_offset, self._tag)
+                else:
+                    self._info = StorageMp3AudioInfo(file_obj, mp3_offset, self._tag, size)
+            except Mp3Exception as ex:
+                log.warning(ex)
+                self._info = None
+
+            self.type = core.AUDIO_MP3
+            if not self.regions:
+                self.regions = file_obj.regions()
+
+
+def _loadRegions(path, storage, stat_result, tag_cache):
+    """Load through `storage`, from the regions of `tag_cache` when it has them (else they are
+    added)."""
+    regions = tag_cache.get(path, stat_result) if tag_cache is not None else None
+    if regions:
+        try:
+            audio_file = ReadAheadMp3AudioFile(path, storage, stat_result, regions)
+            audio_file.regions = None
+            return audio_file
+        except RegionMissError as ex:
+            log.debug(f"Tag cache miss: {ex}")
+
+    audio_file = ReadAheadMp3AudioFile(path, storage, stat_result)
+    if tag_cache is not None:
+        tag_cache.set(path, stat_result, *audio_file.regions)
+        # Not kept in memory, with the tags parsed from them
+        audio_file.regions = None
+    return audio_file
+
+
+def eyed3_load(path, storage=None, stat_result=None, tag_cache=None) -> Optional[AudioFile]:
     """Wrapper for eyed3.load.
     Adds the following members to AudioFile:
     - is_dirty
     - second_v1_tag
     - selected_tag
+    - load_stat
+    - load_values
+    - has_v1_tag
+    - storage
+
+    Files with an MP3 extension are read through `storage` (see mop.storage), local files when
+    None, in a few large reads, files without a v2 tag having their v1 tag unpacked directly
+    (see mop.id3v1). With a `storage` only such files are loaded, others are loaded by eyeD3.
+    `stat_result` saves a stat call, if known, and a `tag_cache` (mop.tagcache.TagCache) the
+    reads of files it has. The file is saved through the same storage, None being eyeD3's own
+    local file access.
     """
+    if Path(path).suffix.lower() in MP3_EXTENSIONS:
+        read_storage = storage or LocalStorage()
+        stat_result = stat_result or read_storage.stat(path)
+        audio_file = _loadRegions(path, read_storage, stat_result, tag_cache)
+    elif storage is None:
+        audio_file = eyed3.load(path)
+    else:
+        return None
 
-    audio_file = eyed3.load(path)
     if audio_file and audio_file.info:
         log.debug(f"Handle audio file: {audio_file}")
+        second_v1_tag = getattr(audio_file, "second_v1_tag", None)
         audio_file.second_v1_tag = None
         audio_file.selected_tag = None
+        loaded_tag = audio_file.tag
 
         if audio_file.tag is None:
             audio_file.initTag(getConfig().preferred_id3_version or ID3_DEFAULT_VERSION)
+        elif isinstance(audio_file, ReadAheadMp3AudioFile):
+            if second_v1_tag:
+                log.debug("Found extra v1 tag")
+                audio_file.second_v1_tag = second_v1_tag
         elif audio_file.tag.isV2():
             # v2 preferred, but there may also be an ID3 v1 tag
             v1_audio_file = eyed3.load(path, tag_version=ID3_V1)
@@ -33,8 +310,16 @@ def eyed3_load(path) -> Optional[AudioFile]:
                 log.debug("Found extra v1 tag")
                 audio_file.second_v1_tag = v1_audio_file.tag
 
+        # Whether the file ends with a v1 tag, for saving v1 tags in place
+        audio_file.has_v1_tag = (audio_file.second_v1_tag is not None
+                                 or (loaded_tag is not None and loaded_tag.isV1()))
         # Add flag for tracking edits
         audio_file.is_dirty = False
+        # The file as loaded, to detect if it was changed since
+        audio_file.load_stat = stat_result or Path(audio_file.path).stat()
+        audio_file.storage = storage
+        # The tag values as loaded, to merge with changes made by other programs on save
+        audio_file.load_values = loadValues(audio_file)
 
         return audio_file
     else:
@@ -42,20 +327,23 @@ def eyed3_load(path) -> Optional[AudioFile]:
         return None
 
 
-def eyed3_load_dir(audio_dir) -> list:
-    class FileHandler(eyed3.utils.FileHandler):
-        def __init__(self):
-            self.audio_files = []
-
-        def handleDirectory(self, d, files):
-            for f in files:
-                if audio_file := eyed3_load(Path(d) / f):
-                    self.audio_files.append(audio_file)
+def eyed3_load_dir(audio_dir, on_progress=None) -> list:
+    """Load the audio files under `audio_dir`, with a DirectoryScan, so an interrupted scan
+    resumes where it stopped, parsing the files it loaded from the tag cache. Files and
+    directories are filtered by the scan_* config options (see ScanFilter). `on_progress` is
+    called with the ScanProgress of each directory."""
+    if audio_dir is None:
+        return None
 
-    if audio_dir is not None:
-        handler = FileHandler()
-        eyed3.utils.walk(handler, audio_dir, recursive=True)
-        return handler.audio_files
+    config = getConfig()
+    storage = getStorage(config)
+    tag_cache = getTagCache()
+    scan = DirectoryScan(audio_dir, lambda e: eyed3_load(e.path, storage, e.stat, tag_cache),
+                         storage=storage,
+                         max_in_flight=MAX_IN_FLIGHT if config.network_storage else 1,
+                         on_progress=on_progress, on_checkpoint=tag_cache.commit,
+                         scan_filter=ScanFilter.fromConfig(config))
+    return scan.run()
 
 
 def escapeMarkup(s: str) -> str:
@@ -38,5 +38,5 @@ setup(
     package_dir={"": "."},
     package_data={"mop": ["*.ui"]},
     install_requires=['eyed3[art-plugin]>=0.9.5', 'nicfit.py>=0.8.6', 'pygobject>=3.38.0'],
-    extras_require={"dev": ["check-manifest==0.*,>=0.45.0", "dephell==0.*,>=0.8.3", "pygobject-stubs>=0.0.2", "pytest==6.*,>=6.1.2", "regarding==0.*,>=0.1.2", "tox==3.*,>=3.20.1", "twine==3.*,>=3.2.0", "wheel==0.*,>=0.36.1"]},
+    extras_require={"replaygain": ["numpy>=1.19", "scipy>=1.5"], "parquet": ["pyarrow>=2.0"], "dev": ["check-manifest==0.*,>=0.45.0", "dephell==0.*,>=0.8.3", "pygobject-stubs>=0.0.2", "pytest==6.*,>=6.1.2", "regarding==0.*,>=0.1.2", "tox==3.*,>=3.20.1", "twine==3.*,>=3.2.0", "wheel==0.*,>=0.36.1"]},
 )
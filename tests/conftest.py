@@ -0,0 +1,23 @@
+import pytest
+import eyed3
+from eyed3.id3 import ID3_V1_1, ID3_V2_4
+
+# MPEG 1 Layer III, 128 kbit/s, 44.1 kHz, unpadded frames of silence
+MP3_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+
+
+@pytest.fixture
+def mp3_path(tmp_path):
+    """An MP3 file with ID3 v2.4 and v1.1 tags."""
+    path = tmp_path / "track.mp3"
+    path.write_bytes(MP3_FRAME * 40)
+
+    audio_file = eyed3.load(str(path))
+    audio_file.initTag(ID3_V2_4)
+    audio_file.tag.title = "Master of the Universe"
+    audio_file.tag.artist = "Hawkwind"
+    audio_file.tag.album = "In Search of Space"
+    audio_file.tag.track_num = (2, 6)
+    audio_file.tag.save(version=ID3_V2_4)
+    audio_file.tag.save(version=ID3_V1_1)
+    return path
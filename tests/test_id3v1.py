@@ -0,0 +1,68 @@
+import pytest
+from eyed3.id3 import Tag, ID3_V1, ID3_V1_0, ID3_V1_1
+from mop.core import getTagValues
+from mop.id3v1 import V1_TAG_SIZE, parseV1Tag, renderV1Tag
+from conftest import MP3_FRAME
+
+V1_VERSIONS = pytest.mark.parametrize("version", [ID3_V1_0, ID3_V1_1])
+
+
+def _tag(**values) -> Tag:
+    tag = Tag()
+    for name, value in values.items():
+        setattr(tag, name, value)
+    return tag
+
+
+TAGS = {
+    "full": dict(title="Silver Machine", artist="Hawkwind", album="Greatest Hits",
+                 release_date=1972, track_num=(5, 9), genre="Rock"),
+    "truncated": dict(title="Master of the Universe (Live at the Roundhouse)",
+                      artist="Hawkwind " * 5, album="Space Ritual Alive in Liverpool and London"),
+    "no genre": dict(title="Brainstorm"),
+    "non standard genre": dict(title="Orgone Accumulator", genre="Space Rock Jam"),
+    "empty": dict(),
+}
+
+
+def _eyed3Save(tag, version, tmp_path) -> bytes:
+    """The v1 tag eyeD3 writes for `tag`."""
+    path = tmp_path / "eyed3.mp3"
+    path.write_bytes(MP3_FRAME * 4)
+    tag.save(str(path), version=version)
+    return path.read_bytes()[-V1_TAG_SIZE:]
+
+
+@V1_VERSIONS
+@pytest.mark.parametrize("values", TAGS.values(), ids=TAGS.keys())
+def test_renderV1Tag(values, version, tmp_path):
+    tag = _tag(**values)
+    tag.comments.set("Recorded live, with a comment of more than 30 characters")
+    data = renderV1Tag(tag, version)
+    assert data == _eyed3Save(tag, version, tmp_path)
+
+
+@V1_VERSIONS
+def test_renderV1Tag_otherGenre(version):
+    assert renderV1Tag(_tag(title="Brainstorm"), version)[-1] == 12
+    assert renderV1Tag(_tag(genre="Space Rock Jam"), version)[-1] == 12
+
+
+@V1_VERSIONS
+@pytest.mark.parametrize("values", TAGS.values(), ids=TAGS.keys())
+def test_parseV1Tag(values, version, tmp_path):
+    data = _eyed3Save(_tag(**values), version, tmp_path)
+    path = tmp_path / "eyed3.mp3"
+    eyed3_tag = Tag()
+    assert eyed3_tag.parse(str(path), version=ID3_V1)
+
+    tag = parseV1Tag(data, str(path))
+    assert getTagValues(tag) == getTagValues(eyed3_tag)
+    assert tag.version == eyed3_tag.version
+    # Round trip
+    assert renderV1Tag(tag, version) == data
+
+
+def test_parseV1Tag_noTag():
+    assert parseV1Tag(bytes(V1_TAG_SIZE), "track.mp3") is None
+    assert parseV1Tag(b"TAG", "track.mp3") is None
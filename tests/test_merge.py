@@ -0,0 +1,50 @@
+import os
+import eyed3
+from eyed3.id3 import ID3_V2_4
+from mop.merge import Conflict, mergeExternalChanges
+from mop.utils import eyed3_load
+
+
+def _saveExternally(path, **values):
+    """Change the v2 tag of `path` as another program would, with a later mtime."""
+    stat_result = os.stat(path)
+    audio_file = eyed3.load(str(path))
+    for name, value in values.items():
+        setattr(audio_file.tag, name, value)
+    audio_file.tag.save(version=ID3_V2_4)
+    # The same size is likely, and mtime granularity may hide the change
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 2_000_000_000))
+
+
+def test_mergeExternalChanges_unchanged(mp3_path):
+    audio_file = eyed3_load(str(mp3_path))
+    tag = audio_file.tag
+    tag.title = "Mine"
+
+    assert mergeExternalChanges(audio_file) == []
+    # Nothing was read, the tag is the loaded one
+    assert audio_file.tag is tag
+    assert audio_file.tag.title == "Mine"
+
+
+def test_mergeExternalChanges_keepsTheirs(mp3_path):
+    audio_file = eyed3_load(str(mp3_path))
+    audio_file.tag.title = "Mine"
+    _saveExternally(mp3_path, artist="Theirs")
+
+    assert mergeExternalChanges(audio_file) == []
+    assert audio_file.tag.title == "Mine"
+    assert audio_file.tag.artist == "Theirs"
+    assert audio_file.tag.album == "In Search of Space"
+
+
+def test_mergeExternalChanges_conflictMineWins(mp3_path):
+    audio_file = eyed3_load(str(mp3_path))
+    audio_file.tag.title = "Mine"
+    _saveExternally(mp3_path, title="Theirs", album="Their album")
+
+    conflicts = mergeExternalChanges(audio_file)
+    assert conflicts == [Conflict(audio_file, "title", "Master of the Universe", "Theirs",
+                                  "Mine")]
+    assert audio_file.tag.title == "Mine"
+    assert audio_file.tag.album == "Their album"
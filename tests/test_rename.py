@@ -0,0 +1,63 @@
+import shutil
+from pathlib import Path
+from mop.rename import planRenames, findCollisions, renameFiles
+from mop.utils import eyed3_load
+
+TEMPLATE = "{artist}/{track_num:02d} - {title}"
+
+
+def _load(mp3_path, name, **values):
+    path = shutil.copy(mp3_path, mp3_path.parent / name)
+    audio_file = eyed3_load(str(path))
+    for field, value in values.items():
+        setattr(audio_file.tag, field, value)
+    return audio_file
+
+
+def test_planRenames(mp3_path):
+    audio_file = _load(mp3_path, "a.mp3")
+    no_title = _load(mp3_path, "b.mp3", title=None)
+
+    new_path = mp3_path.parent / "Hawkwind/02 - Master of the Universe.mp3"
+    assert planRenames([audio_file, no_title], TEMPLATE) == {audio_file: new_path}
+
+
+def test_findCollisions(mp3_path):
+    first = _load(mp3_path, "a.mp3")
+    second = _load(mp3_path, "b.mp3")
+    exists = _load(mp3_path, "c.mp3", title="Existing")
+    (mp3_path.parent / "Hawkwind").mkdir()
+    existing_path = mp3_path.parent / "Hawkwind/02 - Existing.mp3"
+    existing_path.write_bytes(b"existing")
+
+    collisions = findCollisions(planRenames([first, second, exists], TEMPLATE))
+    assert set(collisions) == {mp3_path.parent / "Hawkwind/02 - Master of the Universe.mp3",
+                               existing_path}
+    assert collisions[existing_path] == "Target exists"
+
+
+def test_renameFiles(mp3_path):
+    audio_file = _load(mp3_path, "a.mp3")
+    renames = planRenames([audio_file], TEMPLATE)
+    assert findCollisions(renames) == {}
+
+    done, errors = renameFiles(renames)
+    assert done == renames and errors == {}
+    assert not Path(audio_file.path).exists()
+    assert Path(renames[audio_file]).read_bytes() == mp3_path.read_bytes()
+
+
+def test_renameFiles_keepsExistingTarget(mp3_path):
+    audio_file = _load(mp3_path, "a.mp3")
+    renames = planRenames([audio_file], TEMPLATE)
+    assert findCollisions(renames) == {}
+    # Created after the check
+    target = Path(renames[audio_file])
+    target.parent.mkdir()
+    target.write_bytes(b"existing")
+
+    done, errors = renameFiles(renames)
+    assert done == {}
+    assert isinstance(errors[audio_file], FileExistsError)
+    assert target.read_bytes() == b"existing"
+    assert Path(audio_file.path).read_bytes() == mp3_path.read_bytes()